@@ -0,0 +1,368 @@
+"""
+A compressed, versioned file format for processed artifacts, instead of raw pickle.
+
+    python artifacts.py migrate ../processed/professor/*.pkl      # writes an .art next to each pickle
+    python artifacts.py info ../processed/professor/f_toks_per_review.art
+
+An artifact file is:
+    <MAGIC><header length: uint32><header: JSON>
+    <block length: uint32><compressed block> ...
+    <compressed index: JSON><index offset: uint64><INDEX_MAGIC>
+The header records the schema and its version, and the codec (zstd if the zstandard
+package is installed, else zlib). Schemas:
+    - toks: records of <doc_id, [(word, lemma, pos), ...]>, e.g. f_toks_per_review.pkl.
+      Each block holds block_size records with its own string table, and tokens as
+      uint32 indices into it. The index lists each block's offset and doc IDs, so a
+      document can be read without decompressing the others, and records can be read
+      and written as a stream.
+    - lex: <f_ass, m_ass> lists of <<lemma>,<pos>, p, count, group_count>, e.g. lex.pkl.
+    - counts: <fcounts, mcounts> Counters keyed by <lemma>,<pos>, e.g. counts.pkl.
+    - json: any JSON-compatible object (URL lists, school2info); tuples come back
+      as lists.
+Only the standard library and NumPy are needed to read the files, and the JSON
+header and index describe the layout for readers in other languages.
+"""
+import argparse
+from collections import Counter
+import json
+import numpy as np
+import os
+import pickle
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARTIFACT_EXT = '.art'
+MAGIC = b'GLART\x01'
+INDEX_MAGIC = b'GLIDX\x01'
+SCHEMAS = {'toks':1, 'lex':1, 'counts':1, 'json':1}  # schema -> current version
+BLOCK_SIZE = 1000  # records per block
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+PROCESSED_FORMAT = 'pickle'  # or 'artifact': the format save_processed writes
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'zlib'
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('This artifact is zstd-compressed; install the zstandard package to read it')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+# ========== TOKS BLOCKS ==========
+def encode_toks_block(records):
+    """
+    Encodes a list of <doc_id, toks> records as: the number of records and strings,
+    the NUL-separated string table, and uint32 arrays of the doc ID string of each
+    record, the number of tokens of each record, and 3 string indices per token.
+    """
+    string_ids = {}
+    def sid(s):
+        return string_ids.setdefault(s, len(string_ids))
+    doc_ids = np.array([sid(doc_id) for doc_id, _ in records], dtype=np.uint32)
+    lengths = np.array([len(toks) for _, toks in records], dtype=np.uint32)
+    tok_ids = np.array([sid(s) for _, toks in records for tok in toks for s in tok], dtype=np.uint32)
+    strings = '\0'.join(string_ids.keys()).encode('utf-8')
+    header = struct.pack('<IIQ', len(records), len(string_ids), len(strings))
+    return b''.join([header, strings, doc_ids.tobytes(), lengths.tobytes(), tok_ids.tobytes()])
+
+def decode_toks_block(data):
+    num_records, num_strings, strings_len = struct.unpack_from('<IIQ', data, 0)
+    pos = struct.calcsize('<IIQ')
+    strings = data[pos:pos+strings_len].decode('utf-8').split('\0') if num_strings > 0 else []
+    pos += strings_len
+    doc_ids = np.frombuffer(data, dtype=np.uint32, count=num_records, offset=pos)
+    pos += 4 * num_records
+    lengths = np.frombuffer(data, dtype=np.uint32, count=num_records, offset=pos)
+    pos += 4 * num_records
+    tok_ids = np.frombuffer(data, dtype=np.uint32, count=3 * int(lengths.sum()), offset=pos)
+    tok_strings = np.array(strings, dtype=object)[tok_ids].tolist() if len(tok_ids) > 0 else []
+    toks = list(zip(tok_strings[0::3], tok_strings[1::3], tok_strings[2::3]))
+    records = []
+    start = 0
+    for doc_sid, length in zip(doc_ids.tolist(), lengths.tolist()):
+        records.append((strings[doc_sid], toks[start:start+length]))
+        start += length
+    return records
+
+# ========== LEX AND JSON ==========
+def encode_object(obj, schema):
+    if schema == 'lex':
+        f_ass, m_ass = obj
+        # p-values and counts are often NumPy scalars, which json cannot encode
+        obj = {key:[[[str(x) for x in w], float(p), int(c), int(gc)] for w, p, c, gc in ass]
+               for key, ass in [('f', f_ass), ('m', m_ass)]}
+    elif schema == 'counts':
+        fcounts, mcounts = obj
+        obj = {key:[[[str(x) for x in w], int(c)] for w, c in counts.items()]
+               for key, counts in [('f', fcounts), ('m', mcounts)]}
+    return json.dumps(obj).encode('utf-8')
+
+def decode_object(data, schema):
+    obj = json.loads(data.decode('utf-8'))
+    if schema == 'lex':
+        return ([(tuple(w), p, c, gc) for w, p, c, gc in obj['f']], [(tuple(w), p, c, gc) for w, p, c, gc in obj['m']])
+    if schema == 'counts':
+        return (Counter({tuple(w):c for w, c in obj['f']}), Counter({tuple(w):c for w, c in obj['m']}))
+    return obj
+
+'''
+    This class writes an artifact as a stream: records are buffered into blocks,
+    and each full block is compressed and appended. The index is written by close().
+    For the lex, counts, and json schemas, the whole object is written as one block.
+'''
+class ArtifactWriter:
+    def __init__(self, path, schema, codec=None, block_size=BLOCK_SIZE, meta=None):
+        assert(schema in SCHEMAS)
+        self.path = path
+        self.schema = schema
+        self.codec = codec or default_codec()
+        self.block_size = block_size
+        self._tmp_path = path + '.tmp'
+        self._f = open(self._tmp_path, 'wb')
+        header = {'schema':schema, 'schema_version':SCHEMAS[schema], 'codec':self.codec, 'meta':meta or {}}
+        header = json.dumps(header).encode('utf-8')
+        self._f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._buffer = []
+        self._blocks = []  # <offset, doc_ids>
+        self.num_records = 0
+
+    def write(self, doc_id, toks):
+        self._buffer.append((doc_id, toks))
+        self.num_records += 1
+        if len(self._buffer) >= self.block_size:
+            self._flush_block()
+
+    def write_object(self, obj):
+        self._write_block(encode_object(obj, self.schema), [])
+
+    def _flush_block(self):
+        if len(self._buffer) > 0:
+            self._write_block(encode_toks_block(self._buffer), [doc_id for doc_id, _ in self._buffer])
+            self._buffer = []
+
+    def _write_block(self, data, doc_ids):
+        data = compress(data, self.codec)
+        self._blocks.append((self._f.tell(), doc_ids))
+        self._f.write(struct.pack('<I', len(data)) + data)
+
+    def close(self):
+        self._flush_block()
+        index = compress(json.dumps({'blocks':self._blocks}).encode('utf-8'), self.codec)
+        index_offset = self._f.tell()
+        self._f.write(index + struct.pack('<Q', index_offset) + INDEX_MAGIC)
+        self._f.close()
+        os.replace(self._tmp_path, self.path)  # readers never see a partial artifact
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            os.remove(self._tmp_path)
+        return False
+
+'''
+    This class reads an artifact. Iterating over it streams the records block by
+    block; get() reads only the block that holds a document. If a doc ID occurs in
+    several records (e.g. one record per sentence), get_all() returns all of them.
+'''
+class ArtifactReader:
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+        if self._f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not an artifact: {}'.format(path))
+        header_len, = struct.unpack('<I', self._f.read(4))
+        self.header = json.loads(self._f.read(header_len).decode('utf-8'))
+        self.schema = self.header['schema']
+        self.codec = self.header['codec']
+        if self.header['schema_version'] > SCHEMAS.get(self.schema, 0):
+            raise ValueError('Unsupported {} schema version: {}'.format(self.schema, self.header['schema_version']))
+        self._f.seek(-(8 + len(INDEX_MAGIC)), os.SEEK_END)
+        index_offset, = struct.unpack('<Q', self._f.read(8))
+        if self._f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError('Artifact has no index (was it written completely?): {}'.format(path))
+        index_end = self._f.seek(-(8 + len(INDEX_MAGIC)), os.SEEK_END)
+        self._f.seek(index_offset)
+        self.blocks = json.loads(decompress(self._f.read(index_end - index_offset), self.codec).decode('utf-8'))['blocks']
+        self._locations = None
+
+    def __len__(self):
+        return sum(len(doc_ids) for _, doc_ids in self.blocks)
+
+    def _read_block(self, offset):
+        self._f.seek(offset)
+        length, = struct.unpack('<I', self._f.read(4))
+        return decompress(self._f.read(length), self.codec)
+
+    def __iter__(self):
+        for offset, _ in self.blocks:
+            for record in decode_toks_block(self._read_block(offset)):
+                yield record
+
+    def ids(self):
+        return [doc_id for _, doc_ids in self.blocks for doc_id in doc_ids]
+
+    def _find(self, doc_id):
+        if self._locations is None:
+            self._locations = {}
+            for b, (_, doc_ids) in enumerate(self.blocks):
+                for doc in doc_ids:
+                    blocks = self._locations.setdefault(doc, [])
+                    if len(blocks) == 0 or blocks[-1] != b:
+                        blocks.append(b)
+        return self._locations.get(doc_id, [])
+
+    def get_all(self, doc_id):
+        return [record[1] for b in self._find(doc_id)
+                for record in decode_toks_block(self._read_block(self.blocks[b][0])) if record[0] == doc_id]
+
+    def get(self, doc_id):
+        """
+        Returns the tokens of the first record with this doc ID, or None.
+        """
+        records = self.get_all(doc_id)
+        return records[0] if len(records) > 0 else None
+
+    def load(self):
+        """
+        Returns the whole artifact as the object it was saved from.
+        """
+        if self.schema == 'toks':
+            return list(self)
+        return decode_object(self._read_block(self.blocks[0][0]), self.schema)
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+def save_artifact(path, obj, schema, codec=None, block_size=BLOCK_SIZE):
+    with ArtifactWriter(path, schema, codec=codec, block_size=block_size) as writer:
+        if schema == 'toks':
+            for doc_id, toks in obj:
+                writer.write(doc_id, toks)
+        else:
+            writer.write_object(obj)
+
+def load_artifact(path):
+    with ArtifactReader(path) as reader:
+        return reader.load()
+
+def is_artifact(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def artifact_path_for(pkl_path):
+    return (pkl_path[:-len('.pkl')] if pkl_path.endswith('.pkl') else pkl_path) + ARTIFACT_EXT
+
+def processed_exists(pkl_path):
+    """
+    Returns whether a processed file exists, as a pickle or as its artifact.
+    """
+    return os.path.isfile(pkl_path) or os.path.isfile(artifact_path_for(pkl_path))
+
+def load_processed(pkl_path):
+    """
+    Loads a processed file given its pickle path, from its artifact instead if that
+    exists and is at least as recent as the pickle.
+    """
+    art_path = artifact_path_for(pkl_path)
+    if os.path.isfile(art_path) and (not os.path.isfile(pkl_path) or os.path.getmtime(art_path) >= os.path.getmtime(pkl_path)):
+        return load_artifact(art_path)
+    return pickle.load(open(pkl_path, 'rb'))
+
+def save_processed(pkl_path, obj, schema):
+    """
+    Saves a processed file given its pickle path, in PROCESSED_FORMAT. Either way the
+    file is written under a temporary name and then renamed, so readers (e.g. the
+    next pipeline stage, or lexicon_service) never see a partial file.
+    """
+    if PROCESSED_FORMAT == 'artifact':
+        save_artifact(artifact_path_for(pkl_path), obj, schema)
+    else:
+        tmp_path = pkl_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f)
+        os.replace(tmp_path, pkl_path)
+
+def guess_schema(obj):
+    if isinstance(obj, list) and len(obj) > 0 and isinstance(obj[0], tuple) and len(obj[0]) == 2 and isinstance(obj[0][1], list):
+        return 'toks'
+    if isinstance(obj, tuple) and len(obj) == 2 and all(isinstance(a, list) for a in obj) and \
+            all(len(a) == 0 or (isinstance(a[0], tuple) and len(a[0]) == 4 and isinstance(a[0][0], tuple)) for a in obj):
+        return 'lex'
+    if isinstance(obj, tuple) and len(obj) == 2 and all(isinstance(c, dict) for c in obj):
+        return 'counts'
+    return 'json'
+
+def migrate_pickle(pkl_path, schema=None, codec=None, remove=False):
+    """
+    Converts a pickle to an artifact next to it, and checks that the artifact loads
+    back to an equal object. Returns the artifact path. If remove is True, the pickle
+    is deleted, but only for the processed schemas (toks, lex, and counts), whose
+    artifacts load_processed reads in its place: a json artifact (e.g. of crawler
+    state) may not round-trip exactly (tuples come back as lists), and its pickle
+    is still read directly, so it is always kept.
+    """
+    obj = pickle.load(open(pkl_path, 'rb'))
+    schema = schema or guess_schema(obj)
+    art_path = artifact_path_for(pkl_path)
+    save_artifact(art_path, obj, schema, codec=codec)
+    matches = load_artifact(art_path) == (list(obj) if schema == 'toks' else obj)
+    if schema != 'json':
+        assert(matches), 'Artifact does not match {}'.format(pkl_path)
+    elif not matches:
+        print('Warning: {} does not load back to an equal object (e.g. tuples become lists)'.format(art_path))
+    print('{} -> {} ({}, {:.1f} MB -> {:.1f} MB)'.format(pkl_path, art_path, schema, os.path.getsize(pkl_path) / 2**20,
+                                                         os.path.getsize(art_path) / 2**20))
+    if remove and schema == 'json':
+        print('Kept {}: json artifacts do not replace their pickles'.format(pkl_path))
+    elif remove:
+        os.remove(pkl_path)
+    return art_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate pickles to compressed, versioned artifacts.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate')
+    migrate_parser.add_argument('paths', nargs='+')
+    migrate_parser.add_argument('--schema', choices=sorted(SCHEMAS), default=None, help='guessed if not given')
+    migrate_parser.add_argument('--codec', choices=['zstd', 'zlib'], default=None)
+    migrate_parser.add_argument('--remove', action='store_true',
+                                help='delete each pickle once migrated and verified (never for the json schema)')
+    info_parser = subparsers.add_parser('info')
+    info_parser.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        for path in args.paths:
+            migrate_pickle(path, schema=args.schema, codec=args.codec, remove=args.remove)
+    else:
+        for path in args.paths:
+            with ArtifactReader(path) as reader:
+                print('{}: {} v{}, {}, {} blocks, {} records'.format(path, reader.schema, reader.header['schema_version'],
+                                                                     reader.codec, len(reader.blocks), len(reader)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Benchmarks the create_datasets crawlers offline, against a local mock server (see
+mock_server.py) that serves synthetic or recorded People, UsWeekly, E!Online,
+Wikipedia, and Rate My Professors pages with configurable latency, server errors,
+and throttling.
+
+Each stage runs one crawler entry point (the URL scrapers, make_corpus, _find_wiki,
+parse_professor_page, and build_corpus), and its wall time, CPU time, pages/sec, CPU
+time per page, and peak memory are written to a JSON results file, along with the
+server's reply counts, so that concurrency and parsing changes come with numbers.
+The server runs in its own process, so its CPU time is not counted.
+
+    python benchmarks/bench_crawl.py --num-pages 50 --num-articles 200 --latency-ms 20 --out crawl_results.json
+    python benchmarks/bench_crawl.py --error-rate 0.05 --max-rps 100 --compare crawl_results.json
+"""
+import argparse
+from collections import Counter
+from contextlib import redirect_stdout
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'create_datasets'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_pipeline import StageTimer, compare_results
+import instrumentation
+from mock_server import SITES, add_server_args, listing_urls, server_from_args
+
+STAGES = ['discover', 'make_corpus', 'find_wiki', 'rmp_pages', 'rmp_build_corpus']
+
+def _requests_since(server, before):
+    """
+    Returns the replies the server sent since the stats snapshot before, as
+    '<site>_<kind> <status>' counts.
+    """
+    after = Counter(server.stats())
+    after.subtract(Counter(before))
+    return {key:n for key, n in after.items() if n > 0}
+
+'''
+    This class wraps StageTimer for crawl stages: the stage's items are the pages the
+    server replied to while it ran, and the replies by status and CPU time per page
+    are added to its results. The crawlers' own printing is silenced unless verbose.
+    A crawler that raises (e.g. on an error page it does not expect) ends its stage,
+    and the error is recorded instead of stopping the benchmark.
+'''
+class CrawlStage(StageTimer):
+    def __init__(self, name, results, server, verbose=False, trace_memory=False):
+        super().__init__(name, results, trace_memory)
+        self.server = server
+        self.verbose = verbose
+
+    def __enter__(self):
+        self._stats = self.server.stats()
+        self._quiet = None if self.verbose else redirect_stdout(open(os.devnull, 'w'))
+        if self._quiet is not None:
+            print('Running stage: {}'.format(self.name))
+            self._quiet.__enter__()
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        cpu = time.process_time() - self._cpu
+        if self._quiet is not None:
+            self._quiet.__exit__(exc_type, exc, tb)
+        replies = _requests_since(self.server, self._stats)
+        self.items = sum(replies.values())
+        statuses = Counter()
+        for key, n in replies.items():
+            statuses[key.rsplit(' ', 1)[1]] += n
+        self.extra.update({'replies':replies, 'statuses':dict(statuses),
+                           'cpu_ms_per_page':1000 * cpu / self.items if self.items > 0 else None})
+        if exc is not None:
+            self.extra['error'] = repr(exc)
+            print('  stopped by {}'.format(repr(exc)))
+        super().__exit__(exc_type, exc, tb)
+        return exc_type is not None and issubclass(exc_type, Exception)
+
+def run_benchmarks(server, work_dir, num_pages, num_articles, num_profs, workers, stages=None, verbose=False,
+                   trace_memory=False):
+    import celeb_builder
+    import celeb_extractor
+    import rmp_extractor
+    stages = stages or STAGES
+    results = []
+    base_url = server.base_url
+    # make_corpus and build_corpus read and write relative to the working directory
+    crawl_dir = os.path.join(work_dir, 'crawl', 'create_datasets')
+    os.makedirs(crawl_dir, exist_ok=True)
+    for site in SITES:
+        os.makedirs(os.path.join(work_dir, 'data', 'celeb', site), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, 'data', 'professor'), exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(crawl_dir)
+    try:
+        if 'discover' in stages:
+            listing = listing_urls(base_url)
+            with CrawlStage('discover_people', results, server, verbose, trace_memory) as t:
+                urls = celeb_extractor.people_scrape_urls(num_pages + 10, listing_url=listing['people'], workers=workers)
+                t.extra = {'urls':len(urls)}
+            with CrawlStage('discover_usweekly', results, server, verbose, trace_memory) as t:
+                urls = celeb_extractor.usweekly_scrape_urls(None, listing_url=listing['usweekly'], workers=workers)
+                t.extra = {'urls':len(urls)}
+            with CrawlStage('discover_eonline', results, server, verbose, trace_memory) as t:
+                urls = celeb_extractor.eonline_scrape_urls(1, num_pages + 10, continue_work=False,
+                                                           listing_url=listing['eonline'], workers=workers)
+                t.extra = {'urls':len(urls)}
+
+        if 'make_corpus' in stages or 'find_wiki' in stages:
+            celeb_builder.WIKI_SEARCH_URL = base_url + '/wiki/search?search={}'
+        if 'make_corpus' in stages:
+            for site in SITES:
+                urls = ['{}/{}/article/{}'.format(base_url, site, i) for i in range(num_articles)]
+                pickle.dump(urls, open(site + '_urls.pkl', 'wb'))
+                with CrawlStage('make_corpus_' + site, results, server, verbose, trace_memory) as t:
+                    celeb_builder.make_corpus(site, startover=True, workers=workers)
+                    failed = pickle.load(open(site + '_failed_urls.pkl', 'rb'))
+                    skipped = pickle.load(open(site + '_skipped_urls.pkl', 'rb'))
+                    t.extra = {'articles':len(urls), 'failed':len(failed), 'skipped':len(skipped)}
+
+        if 'find_wiki' in stages:
+            with CrawlStage('find_wiki', results, server, verbose, trace_memory) as t:
+                builder = celeb_builder.CelebBuilder('people')
+                names = server.celebs() + ['Nobody Number{}'.format(i) for i in range(20)]  # some searches find nothing
+                found = 0
+                for name in names:
+                    soup, found_bio = builder._find_wiki(name)
+                    found += found_bio
+                t.extra = {'lookups':len(names), 'found_bio':found}
+
+        rmp_extractor.PATH_TO_CORPUS = os.path.join(work_dir, 'data', 'professor') + '/'
+        prof_urls = ['{}/rmp/ShowRatings.jsp?tid={}'.format(base_url, 100000 + i) for i in range(num_profs)]
+        if 'rmp_pages' in stages:
+            with CrawlStage('rmp_pages', results, server, verbose, trace_memory) as t:
+                num_reviews = 0
+                for url in prof_urls:
+                    num_reviews += len(rmp_extractor.parse_professor_page(url)[1])
+                t.extra = {'profs':len(prof_urls), 'reviews':num_reviews}
+
+        if 'rmp_build_corpus' in stages:
+            school2info = {}
+            for i in range(0, len(prof_urls), 10):
+                prof_pages = [('Prof Number{}'.format(j), prof_urls[j]) for j in range(i, min(i + 10, len(prof_urls)))]
+                school2info['Synthetic University {}'.format(i // 10)] = (i // 10, len(prof_pages), prof_pages)
+            rmp_extractor.SCHOOL2INFO_FNAME = os.path.join(crawl_dir, 'school2info.pkl')
+            pickle.dump(school2info, open(rmp_extractor.SCHOOL2INFO_FNAME, 'wb'))
+            with CrawlStage('rmp_build_corpus', results, server, verbose, trace_memory) as t:
+                rmp_extractor.build_corpus(0, len(school2info), workers=workers)
+                t.extra = {'profs':len(prof_urls), 'written':len(os.listdir(rmp_extractor.PATH_TO_CORPUS))}
+    finally:
+        os.chdir(cwd)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the crawlers against a local mock server.')
+    add_server_args(parser)
+    parser.add_argument('--num-articles', type=int, default=200, help='number of articles per site for make_corpus')
+    parser.add_argument('--num-profs', type=int, default=200, help='number of professor pages to crawl')
+    parser.add_argument('--workers', type=int, default=8, help='fetch threads of the crawlers')
+    parser.add_argument('--stages', nargs='+', default=None, help='subset of: ' + ' '.join(STAGES))
+    parser.add_argument('--work-dir', default=None, help='where the crawlers write (default: a temp dir)')
+    parser.add_argument('--verbose', action='store_true', help='show the crawlers\' output')
+    parser.add_argument('--trace-memory', action='store_true', help='also record peak Python allocations (slower)')
+    parser.add_argument('--out', default='crawl_results.json')
+    parser.add_argument('--compare', default=None, help='baseline results file to compare against')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        instrumentation.configure(enabled=False)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_crawl_')
+    server = server_from_args(args)
+    print('Mock server on', server.start())
+    try:
+        results = run_benchmarks(server, os.path.abspath(work_dir), args.num_pages, args.num_articles, args.num_profs,
+                                 args.workers, stages=args.stages, verbose=args.verbose, trace_memory=args.trace_memory)
+    finally:
+        server.stop()
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+    output = {'config':vars(args), 'python':platform.python_version(), 'platform':platform.platform(),
+              'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'), 'stages':results}
+    json.dump(output, open(args.out, 'w'), indent=2)
+    print('Saved results to', args.out)
+    if args.compare:
+        compare_results(results, args.compare)
+
+if __name__ == '__main__':
+    main()
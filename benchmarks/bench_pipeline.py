@@ -0,0 +1,163 @@
+"""
+Benchmarks the loading, preprocessing, and scoring pipeline on synthetic corpora.
+
+Each stage (load, tag, count, score, filter) is timed separately, and its wall time,
+CPU time, throughput, and peak memory are written to a JSON results file so that
+runs can be compared for regressions. Everything runs offline on CPU; the tag stage
+only needs the spaCy model that preprocessing already loads.
+
+    python benchmarks/bench_pipeline.py --num-docs 10000 --out results.json
+    python benchmarks/bench_pipeline.py --num-docs 10000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from synthetic import SyntheticCorpus
+
+'''
+    This class times one benchmark stage. It records wall and CPU time, the number
+    of items processed, and the peak memory (the process's max RSS, and the peak of
+    Python allocations during the stage if trace_memory is True).
+'''
+class StageTimer:
+    def __init__(self, name, results, trace_memory=False):
+        self.name = name
+        self.results = results
+        self.trace_memory = trace_memory
+        self.items = 0
+        self.extra = {}
+
+    def __enter__(self):
+        print('Running stage: {}'.format(self.name))
+        if self.trace_memory:
+            tracemalloc.start()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        result = {'stage':self.name, 'wall_sec':wall, 'cpu_sec':cpu, 'items':self.items,
+                  'items_per_sec':self.items / wall if wall > 0 else None,
+                  'max_rss_mb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+        if self.trace_memory:
+            result['peak_alloc_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        result.update(self.extra)
+        self.results.append(result)
+        print('  {:.2f}s, {} items, {:.1f} items/sec'.format(wall, self.items, result['items_per_sec'] or 0))
+        return False
+
+def run_benchmarks(num_docs, num_nlp_docs, vocab_size, seed, data_dir, trace_memory=False, stages=None):
+    from data_loader import CelebDataLoader, ProfDataLoader
+    stages = stages or ['load', 'tag', 'count', 'score', 'filter']
+    results = []
+    corpus = SyntheticCorpus(vocab_size=vocab_size, seed=seed)
+    celeb_path = os.path.join(data_dir, 'celeb') + '/'
+    prof_path = os.path.join(data_dir, 'professor') + '/'
+    print('Generating {} synthetic articles and professors in {}...'.format(num_docs, data_dir))
+    start = time.perf_counter()
+    corpus.write_celeb_corpus(celeb_path, num_docs)
+    corpus.write_prof_corpus(prof_path, num_docs)
+    print('  {:.2f}s'.format(time.perf_counter() - start))
+
+    if 'load' in stages or 'tag' in stages:
+        with StageTimer('load_celeb', results, trace_memory) as t:
+            celeb_dl = CelebDataLoader(celeb_path)
+            t.items = len(celeb_dl.female_corpus) + len(celeb_dl.male_corpus) + len(celeb_dl.unk_corpus)
+        with StageTimer('load_prof', results, trace_memory) as t:
+            prof_dl = ProfDataLoader(prof_path)
+            t.items = len(prof_dl.female_corpus) + len(prof_dl.male_corpus) + len(prof_dl.unk_corpus)
+
+    if 'tag' in stages:
+        from preprocessing import texts_to_pos_toks
+        entries = (celeb_dl.get_female_entries() + celeb_dl.get_male_entries())[:num_nlp_docs]
+        with StageTimer('tag_celeb', results, trace_memory) as t:
+            toks_per_text, toks_per_sent, _ = texts_to_pos_toks([e['id'] for e in entries], [e['text'] for e in entries])
+            t.items = len(toks_per_text)
+            t.extra = {'sents':len(toks_per_sent), 'toks':sum(len(toks) for toks in toks_per_text)}
+        reviews = (prof_dl.get_female_reviews() + prof_dl.get_male_reviews())[:num_nlp_docs]
+        with StageTimer('tag_prof', results, trace_memory) as t:
+            toks_per_text, toks_per_sent, _ = texts_to_pos_toks(list(range(len(reviews))), reviews)
+            t.items = len(toks_per_text)
+            t.extra = {'sents':len(toks_per_sent), 'toks':sum(len(toks) for toks in toks_per_text)}
+
+    if 'count' in stages or 'score' in stages or 'filter' in stages:
+        import score_words
+        # counting and scoring run on synthetic tokens at full scale, so they do not depend on the tag stage
+        f_toks_w_id, m_toks_w_id = corpus.make_toks_per_text(num_docs)
+        with StageTimer('count', results, trace_memory) as t:
+            f_toks, m_toks = score_words.balance_toks_per_text(f_toks_w_id, m_toks_w_id)
+            f_counts = score_words.compute_lemma_pos_counts(f_toks)
+            m_counts = score_words.compute_lemma_pos_counts(m_toks)
+            t.items = len(f_toks) + len(m_toks)
+            t.extra = {'toks':sum(f_counts.values()) + sum(m_counts.values())}
+        del f_toks_w_id, m_toks_w_id
+
+    if 'score' in stages or 'filter' in stages:
+        with StageTimer('score', results, trace_memory) as t:
+            f_ass, m_ass = score_words.beta_scoring_from_counts(f_counts, m_counts, sort=False)
+            t.items = len(f_counts + m_counts)
+
+    if 'filter' in stages:
+        with StageTimer('filter', results, trace_memory) as t:
+            t.items = len(f_ass) + len(m_ass)
+            f_ass = score_words.filter_associations_on_lemma_and_pos(f_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
+            m_ass = score_words.filter_associations_on_lemma_and_pos(m_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
+            alpha = 0.05 / max(1, len(f_ass) + len(m_ass))
+            sig_f_ass = score_words.filter_associations_on_p(f_ass, p_thresh=alpha)
+            sig_m_ass = score_words.filter_associations_on_p(m_ass, p_thresh=alpha)
+            t.extra = {'num_sig':len(sig_f_ass) + len(sig_m_ass)}
+    return results
+
+def compare_results(results, path_to_baseline):
+    """
+    Prints each stage's wall time relative to the same stage in a baseline results file.
+    """
+    baseline = json.load(open(path_to_baseline, 'r'))
+    baseline_by_stage = {r['stage']:r for r in baseline['stages']}
+    print('\nStage        baseline(s)   current(s)   ratio')
+    for r in results:
+        if r['stage'] in baseline_by_stage:
+            old = baseline_by_stage[r['stage']]['wall_sec']
+            print('{:12} {:11.3f} {:12.3f} {:7.2f}x'.format(r['stage'], old, r['wall_sec'], r['wall_sec'] / old if old > 0 else float('nan')))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic corpora.')
+    parser.add_argument('--num-docs', type=int, default=1000, help='number of articles and of professors to generate')
+    parser.add_argument('--num-nlp-docs', type=int, default=1000, help='max number of texts to run through the tagger')
+    parser.add_argument('--vocab-size', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', default=None, help='subset of: load tag count score filter')
+    parser.add_argument('--data-dir', default=None, help='where to write the synthetic corpora (default: a temp dir)')
+    parser.add_argument('--trace-memory', action='store_true', help='also record peak Python allocations (slower)')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help='baseline results file to compare against')
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='bench_')
+    try:
+        results = run_benchmarks(args.num_docs, args.num_nlp_docs, args.vocab_size, args.seed, data_dir,
+                                 trace_memory=args.trace_memory, stages=args.stages)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir)
+    output = {'config':vars(args), 'python':platform.python_version(), 'platform':platform.platform(),
+              'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'), 'stages':results}
+    json.dump(output, open(args.out, 'w'), indent=2)
+    print('Saved results to', args.out)
+    if args.compare:
+        compare_results(results, args.compare)
+
+if __name__ == '__main__':
+    main()
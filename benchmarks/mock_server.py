@@ -0,0 +1,447 @@
+"""
+A local stand-in for the sites that create_datasets crawls (People, UsWeekly,
+E!Online, Wikipedia search, and Rate My Professors), so that the crawlers can be
+benchmarked and regression-tested offline. Pages are synthetic, in the HTML
+structure each extractor expects, or recorded fixtures if a fixture folder is given.
+Latency, server errors, and throttling (429 with Retry-After) are configurable.
+
+    python benchmarks/mock_server.py --port 8000 --latency-ms 50 --error-rate 0.01 --max-rps 200
+    python benchmarks/mock_server.py record --site people --kind article --fixture-dir fixtures/ <url> [<url> ...]
+
+Routes (N is a page number or ID):
+    /people/tag?page=N  /usweekly/celebrity-news/N  /eonline/news/page/N      listing pages
+    /people/article/N   /usweekly/article/N         /eonline/article/N        articles
+    /wiki/search?search=<name>                                                Wikipedia search
+    /rmp/ShowRatings.jsp?tid=N                                                professor pages
+    /_stats  /_celebs                                                         request counts, celebrity names (JSON)
+
+A fixture folder holds <site>/<kind>/*.html (kind is listing, article, search, or
+professor); page N of a kind is served from its (N mod number of files)-th file, in
+sorted order, and a search for a name from the file chosen by the CRC-32 of the name.
+"""
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import multiprocessing
+import numpy as np
+import os
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import urllib.request
+import zlib
+
+from synthetic import MONTHNAMES, RATINGS, RMP_TAGS, SyntheticCorpus
+
+SITES = ['people', 'usweekly', 'eonline']
+KINDS = ['listing', 'article', 'search', 'professor']
+WEEKDAYS = ['Mon.', 'Tue.', 'Wed.', 'Thu.', 'Fri.', 'Sat.', 'Sun.']
+ROUTES = [(re.compile(r'^/people/tag$'), 'people', 'listing'),
+          (re.compile(r'^/usweekly/celebrity-news/(\d+)$'), 'usweekly', 'listing'),
+          (re.compile(r'^/eonline/news/page/(\d+)$'), 'eonline', 'listing'),
+          (re.compile(r'^/(people|usweekly|eonline)/article/(\d+)$'), None, 'article'),
+          (re.compile(r'^/wiki/search$'), 'wiki', 'search'),
+          (re.compile(r'^/rmp/ShowRatings\.jsp$'), 'rmp', 'professor')]
+
+def listing_urls(base_url):
+    """
+    Returns the listing URL templates of the mock sites, to pass to the URL scrapers
+    as their listing_url.
+    """
+    return {'people':base_url + '/people/tag?page={}',
+            'usweekly':base_url + '/usweekly/celebrity-news/{}',
+            'eonline':base_url + '/eonline/news/page/{}'}
+
+'''
+    This class generates the synthetic pages. Each page is generated from its own
+    seed (derived from the corpus seed and the page's path), so a page is the same
+    no matter when or in which order it is requested, and it is cached after the
+    first request so that generation does not count towards later ones.
+'''
+class PageGenerator:
+    def __init__(self, num_pages=50, links_per_page=20, num_celebs=200, reviews_per_prof=10, vocab_size=5000, seed=0,
+                 fixture_dir=None):
+        self.num_pages = num_pages
+        self.links_per_page = links_per_page
+        self.reviews_per_prof = reviews_per_prof
+        self.seed = seed
+        self.corpus = SyntheticCorpus(vocab_size=vocab_size, seed=seed)
+        self.celebs = ['{} {}'.format(self.corpus.words[2*i].capitalize(), self.corpus.words[2*i+1].capitalize())
+                       for i in range(num_celebs)]  # the names articles are tagged with
+        self.fixtures = self._load_fixtures(fixture_dir)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_fixtures(fixture_dir):
+        fixtures = {}
+        if fixture_dir is None:
+            return fixtures
+        for site in SITES + ['wiki', 'rmp']:
+            for kind in KINDS:
+                folder = os.path.join(fixture_dir, site, kind)
+                if os.path.isdir(folder):
+                    fns = sorted(fn for fn in os.listdir(folder) if fn.endswith('.html'))
+                    if len(fns) > 0:
+                        fixtures[(site, kind)] = [open(os.path.join(folder, fn), 'rb').read() for fn in fns]
+        return fixtures
+
+    def page(self, site, kind, key):
+        """
+        Returns the body of a page; listing pages past num_pages are empty.
+        """
+        with self._lock:
+            if (site, kind, key) not in self._cache:
+                if kind == 'listing' and not 1 <= int(key) <= self.num_pages:
+                    body = self._empty_page()
+                elif (site, kind) in self.fixtures:
+                    files = self.fixtures[(site, kind)]
+                    index = int(key) if str(key).isdigit() else zlib.crc32(str(key).encode('utf-8'))
+                    body = files[index % len(files)]
+                else:
+                    page_seed = zlib.crc32('{}/{}/{}'.format(site, kind, key).encode('utf-8'))
+                    self.corpus.rng = np.random.default_rng([self.seed, page_seed])
+                    body = getattr(self, '_{}_{}'.format(site, kind))(key).encode('utf-8')
+                self._cache[(site, kind, key)] = body
+            return self._cache[(site, kind, key)]
+
+    def _empty_page(self):
+        return b'<html><head><title>Page not found</title></head><body></body></html>'
+
+    def _html(self, title, body, head='', body_attrs=''):
+        return '<html><head><title>{}</title>{}</head><body{}>\n{}\n</body></html>'.format(title, head, body_attrs, body)
+
+    def _article_ids(self, page_num):
+        start = (int(page_num) - 1) * self.links_per_page
+        return range(start, start + self.links_per_page)
+
+    def _gender(self, key):
+        return 'F' if zlib.crc32(str(key).encode('utf-8')) % 2 == 0 else 'M'
+
+    def _tags(self):
+        idx = self.corpus.rng.choice(len(self.celebs), size=self.corpus.rng.integers(0, 4), replace=False)
+        return [self.celebs[i] for i in idx]
+
+    def _author(self):
+        return 'Jane {}'.format(self.corpus.rng.choice(self.corpus.words).capitalize())
+
+    def _date(self, key):
+        key = int(key)
+        return 2010 + key % 9, 1 + (key // 9) % 12, 1 + key % 28, 1 + key % 12, key % 60
+
+    def _paragraphs(self, gender, num):
+        return [self.corpus.text(gender, min_sents=1, max_sents=5) for _ in range(num)]
+
+    # ---------- listing pages ----------
+    def _people_listing(self, page_num):
+        links = ['<div class="card"><a class="category-page-item-image-link" href="/people/article/{}">'
+                 '<img src="x.jpg"></a></div>'.format(i) for i in self._article_ids(page_num)]
+        return self._html('Movie Celebrities | PEOPLE.com', '\n'.join(links))
+
+    def _usweekly_listing(self, page_num):
+        links = ['<a class="content-card-link" href="/usweekly/article/{}">Story {}</a>'.format(i, i)
+                 for i in self._article_ids(page_num)]
+        return self._html('Celebrity News - Us Weekly', '\n'.join(links))
+
+    def _eonline_listing(self, page_num):
+        links = []
+        for j, i in enumerate(self._article_ids(page_num)):
+            content_type = 'Photos' if j % 10 == 9 else 'News'  # the scraper only keeps news
+            cls = 'category-landing__hero-link' if j == 0 else 'category-landing__content-link'
+            links.append('<a class="{}" href="/eonline/article/{}"><span class="category-landing__textbox-type">{}'
+                         '</span></a>'.format(cls, i, content_type))
+        return self._html('News | E! News', '\n'.join(links))
+
+    # ---------- article pages ----------
+    def _people_article(self, key):
+        year, month, date, hour, minute = self._date(key)
+        gender = self._gender(key)
+        body = '<a class="bold author-name">{}</a>\n'.format(self._author())
+        body += '<div class="timestamp published-date">{} {}, {} {}:{:02d} PM</div>\n'.format(MONTHNAMES[month-1], date, year, hour, minute)
+        body += '\n'.join('<a class="tag-link">{}</a>'.format(t) for t in self._tags()) + '\n'
+        body += '\n'.join('<p>{}</p>'.format(p) for p in self._paragraphs(gender, self.corpus.rng.integers(3, 12)))
+        body += '\n<p>RELATED: Another story</p>'
+        return self._html('Synthetic Story {} | PEOPLE.com'.format(key), body)
+
+    def _usweekly_article(self, key):
+        year, month, date, hour, minute = self._date(key)
+        gender = self._gender(key)
+        tags = self._tags()
+        head = '<meta property="article:published_time" content="{}-{:02d}-{:02d}T{:02d}:{:02d}:00+00:00">'.format(
+            year, month, date, hour + 12, minute)
+        head += '<script>var utag_data = {};</script>'.format(json.dumps({'celebrity':tags if tags else 'none'}))
+        body = '<a rel="author">{}</a>\n'.format(self._author())
+        body += '\n'.join('<p>{}</p>'.format(p) for p in self._paragraphs(gender, self.corpus.rng.integers(3, 12)))
+        body += '\n<p>Sign up now for the Us Weekly newsletter</p>'
+        body_attrs = ' class="single-format-gallery"' if int(key) % 20 == 19 else ''  # galleries are skipped
+        return self._html('Synthetic Story {} - Us Weekly'.format(key), body, head=head, body_attrs=body_attrs)
+
+    def _eonline_article(self, key):
+        year, month, date, hour, minute = self._date(key)
+        gender = self._gender(key)
+        body = '<span class="entry-meta__author">by\n{}</span>\n'.format(self._author().upper())
+        body += '<span class="entry-meta__time">{}, {}. {}, {} {}:{:02d} PM</span>\n'.format(
+            WEEKDAYS[int(key) % 7], MONTHNAMES[month-1][:3], date, year, hour, minute)
+        body += '\n'.join('<a class="categories__link">{}</a>'.format(t) for t in self._tags()) + '\n'
+        body += '\n'.join('<section data-textblock-tracking="{}"><p>{}</p></section>'.format(i, p)
+                          for i, p in enumerate(self._paragraphs(gender, self.corpus.rng.integers(3, 12))))
+        body_attrs = ' class="single-format-gallery"' if int(key) % 20 == 19 else ''
+        return self._html('Synthetic Story {} | E! News'.format(key), body, body_attrs=body_attrs)
+
+    # ---------- Wikipedia and RMP ----------
+    def _wiki_search(self, name):
+        if name not in self.celebs or zlib.crc32(name.encode('utf-8')) % 10 == 0:
+            body = '<h1 class="firstHeading">Search results</h1>\n<p>There were no results matching the query.</p>'
+            return self._html('Search results - Wikipedia', body)
+        gender = self._gender(name)
+        pronoun, possessive = ('She', 'her') if gender == 'F' else ('He', 'his')
+        body = '<h1 class="firstHeading">{}</h1>\n'.format(name)
+        body += '<table class="infobox"><tr><th scope="row">Born</th><td>1980</td></tr>'
+        body += '<tr><th scope="row">Occupation</th><td>Actor</td></tr></table>\n<p></p>\n'
+        for p in self._paragraphs(gender, 3):
+            body += '<p>{} is known for {} work. {} {}</p>\n'.format(name, possessive, pronoun, p)
+        return self._html('{} - Wikipedia'.format(name), body)
+
+    def _rmp_professor(self, tid):
+        if int(tid) % 20 == 0:  # professors without reviews have no ratings heading
+            return self._html('Professor | Rate My Professors', '<div class="header">No ratings yet</div>')
+        gender = self._gender(tid)
+        num_reviews = int(self.corpus.rng.integers(1, self.reviews_per_prof + 1))
+        rows = ['<tr><th>Rating</th><th>Class</th><th>Comments</th></tr>']
+        for j in range(num_reviews):
+            tags = self.corpus.rng.choice(RMP_TAGS, size=self.corpus.rng.integers(0, 4), replace=False)
+            rows.append('<tr id="{}"><td><span class="rating-type">{}</span></td><td>CS101</td>'
+                        '<td class="comments"><div class="tagbox">{}</div><p class="commentsParagraph">"{}"</p></td></tr>'.format(
+                        j, self.corpus.rng.choice(RATINGS), ''.join('<span>{}</span>'.format(t) for t in tags),
+                        self.corpus.text(gender, min_sents=1, max_sents=6)))
+            if j % 5 == 4:
+                rows.append('<tr class="ad-placement"><td>Advertisement</td></tr>')  # ads have no id
+        body = '<div data-table="rating-filter">{} Student Ratings</div>\n'.format(num_reviews)
+        body += '<table class="tftable">\n{}\n</table>'.format('\n'.join(rows))
+        return self._html('Professor {} | Rate My Professors'.format(tid), body)
+
+'''
+    This class handles one request: it routes the path to a page, then applies the
+    server's faults (latency, throttling, and random server errors) before replying.
+'''
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real sites
+    wbufsize = 1 << 16  # send headers and body together, or keep-alive clients wait on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate the benchmark's output
+
+    def _reply(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, url):
+        query = parse_qs(url.query)
+        for pattern, site, kind in ROUTES:
+            match = pattern.match(url.path)
+            if match is None:
+                continue
+            if kind == 'article':
+                return match.group(1), kind, match.group(2)
+            if kind == 'listing':
+                return site, kind, match.group(1) if match.groups() else query.get('page', ['1'])[0]
+            if kind == 'search':
+                return site, kind, query.get('search', [''])[0]
+            return site, kind, query.get('tid', ['0'])[0]
+        return None
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        if url.path == '/_stats':
+            self._reply(200, json.dumps(server.stats_snapshot()).encode('utf-8'))
+            return
+        if url.path == '/_celebs':
+            self._reply(200, json.dumps(server.pages.celebs).encode('utf-8'))
+            return
+        route = self._route(url)
+        if route is None:
+            server.record('unknown', 404)
+            self._reply(404, b'Not found')
+            return
+        site, kind, key = route
+        label = '{}_{}'.format(site, kind)
+        if server.latency > 0:
+            time.sleep(server.delay())
+        if server.throttled():
+            server.record(label, 429)
+            self._reply(429, b'Too many requests', headers=[('Retry-After', str(server.retry_after))])
+            return
+        if server.fail():
+            server.record(label, 500)
+            self._reply(500, b'<html><body>Internal server error</body></html>')
+            return
+        body = server.pages.page(site, kind, key)
+        server.record(label, 200)
+        self._reply(200, body)
+
+'''
+    This class is the threaded HTTP server with its fault settings and request counts.
+    Throttling allows max_rps requests per one-second window; the rest get a 429 with
+    a Retry-After of retry_after seconds.
+'''
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pages, latency_ms=0, jitter_ms=0, error_rate=0, max_rps=None, retry_after=1, seed=0):
+        super().__init__(address, MockHandler)
+        self.pages = pages
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.counts = Counter()
+        self._window = (0, 0)  # <second, requests in it>
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            return max(0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    def throttled(self):
+        if self.max_rps is None:
+            return False
+        with self._lock:
+            second = int(time.monotonic())
+            window_second, num = self._window
+            num = num + 1 if second == window_second else 1
+            self._window = (second, num)
+            return num > self.max_rps
+
+    def record(self, label, status):
+        with self._lock:
+            self.counts['{} {}'.format(label, status)] += 1
+
+    def stats_snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+def _serve(config, port_queue):
+    pages = PageGenerator(**config['pages'])
+    server = MockHTTPServer(('127.0.0.1', config['port']), pages, **config['faults'])
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+'''
+    This class runs the mock server in a separate process, so that its CPU time does
+    not count towards the crawler being benchmarked.
+'''
+class MockServer:
+    def __init__(self, port=0, latency_ms=0, jitter_ms=0, error_rate=0, max_rps=None, retry_after=1, seed=0, **page_kwargs):
+        page_kwargs.setdefault('seed', seed)
+        self.config = {'port':port, 'pages':page_kwargs,
+                       'faults':{'latency_ms':latency_ms, 'jitter_ms':jitter_ms, 'error_rate':error_rate,
+                                 'max_rps':max_rps, 'retry_after':retry_after, 'seed':seed}}
+        self._process = None
+        self.base_url = None
+
+    def start(self):
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve, args=(self.config, port_queue), daemon=True)
+        self._process.start()
+        self.base_url = 'http://127.0.0.1:{}'.format(port_queue.get(timeout=60))
+        return self.base_url
+
+    def _get_json(self, path):
+        with urllib.request.urlopen(self.base_url + path) as r:
+            return json.loads(r.read().decode('utf-8'))
+
+    def stats(self):
+        """
+        Returns the number of requests served so far, per '<site>_<kind> <status>'.
+        """
+        return self._get_json('/_stats')
+
+    def celebs(self):
+        return self._get_json('/_celebs')
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+def record_fixtures(urls, site, kind, fixture_dir):
+    """
+    Saves live pages as fixtures for the given site and kind of page.
+    """
+    import requests
+    folder = os.path.join(fixture_dir, site, kind)
+    os.makedirs(folder, exist_ok=True)
+    for i, url in enumerate(urls):
+        r = requests.get(url)
+        r.raise_for_status()
+        with open(os.path.join(folder, '{:04d}.html'.format(i)), 'wb') as f:
+            f.write(r.content)
+        print('Saved {} ({} bytes)'.format(url, len(r.content)))
+
+def add_server_args(parser):
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay before each reply')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random +/- variation of the delay')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with a 500')
+    parser.add_argument('--max-rps', type=int, default=None, help='requests per second before replying 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of throttled replies, in seconds')
+    parser.add_argument('--num-pages', type=int, default=50, help='number of listing pages per site')
+    parser.add_argument('--links-per-page', type=int, default=20)
+    parser.add_argument('--fixture-dir', default=None, help='folder of recorded pages to serve instead of synthetic ones')
+    parser.add_argument('--seed', type=int, default=0)
+
+def server_from_args(args, port=0):
+    return MockServer(port=port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                      max_rps=args.max_rps, retry_after=args.retry_after, seed=args.seed, num_pages=args.num_pages,
+                      links_per_page=args.links_per_page, fixture_dir=args.fixture_dir)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        parser = argparse.ArgumentParser(description='Record live pages as mock server fixtures.')
+        parser.add_argument('command', choices=['record'])
+        parser.add_argument('--site', choices=SITES + ['wiki', 'rmp'], required=True)
+        parser.add_argument('--kind', choices=KINDS, required=True)
+        parser.add_argument('--fixture-dir', required=True)
+        parser.add_argument('urls', nargs='+')
+        args = parser.parse_args()
+        record_fixtures(args.urls, args.site, args.kind, args.fixture_dir)
+        return
+    parser = argparse.ArgumentParser(description='Serve synthetic or recorded crawl pages locally.')
+    parser.add_argument('--port', type=int, default=8000)
+    add_server_args(parser)
+    args = parser.parse_args()
+    server = server_from_args(args, port=args.port)
+    print('Serving on', server.start())
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import numpy as np
+import os
+
+SITES = ['eonline', 'people', 'usweekly']
+MONTHNAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+              'October', 'November', 'December']
+POS_TAGS = ['NOUN', 'VERB', 'ADJ', 'ADV', 'PRON', 'DET', 'ADP', 'PROPN']
+RATINGS = ['AWESOME', 'GOOD', 'AVERAGE', 'POOR', 'AWFUL']
+RMP_TAGS = ['Tough Grader', 'Gives good feedback', 'Respected', 'Lots of homework', 'Accessible outside class',
+            'Hilarious', 'Caring', 'Lecture heavy', 'Clear grading criteria', 'Inspirational']
+
+'''
+    This class generates synthetic celeb articles and professor reviews in the same
+    on-disk formats that CelebBuilder.write_to_file and rmp_extractor.write_reviews_to_file
+    produce, so that the loaders, preprocessing, and scoring can be benchmarked offline
+    at any scale. Words are drawn from a Zipfian vocabulary, and each gender gets a
+    slightly different word distribution so that scoring finds associations.
+'''
+class SyntheticCorpus:
+    def __init__(self, vocab_size=20000, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.vocab = self._make_vocab(vocab_size)
+        self.vocab_pos = self.rng.choice(POS_TAGS, size=vocab_size)
+        ranks = np.arange(1, vocab_size + 1)
+        probs = 1 / ranks ** 1.1
+        self.cdfs = {'F': np.cumsum(self._skew(probs, 0)), 'M': np.cumsum(self._skew(probs, 1))}
+        self.words = self.vocab.tolist()
+        self.word_pos = self.vocab_pos.tolist()
+
+    def _make_vocab(self, vocab_size):
+        letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+        vocab = set()
+        while len(vocab) < vocab_size:
+            length = self.rng.integers(3, 10)
+            vocab.add(''.join(self.rng.choice(letters, size=length)))
+        return np.array(sorted(vocab))
+
+    def _skew(self, probs, offset):
+        probs = probs.copy()
+        probs[offset::7] *= 1.5  # every 7th word is boosted for one gender
+        return probs / probs.sum()
+
+    def _draw(self, gender, size):
+        # inverse-cdf sampling; much faster than rng.choice with p for many small draws
+        idx = np.searchsorted(self.cdfs[gender], self.rng.random(size) * self.cdfs[gender][-1])
+        return np.minimum(idx, len(self.words) - 1)
+
+    def sentence(self, gender, min_len=5, max_len=25):
+        words = [self.words[i] for i in self._draw(gender, self.rng.integers(min_len, max_len))]
+        words[0] = words[0].capitalize()
+        return ' '.join(words) + '.'
+
+    def text(self, gender, min_sents=3, max_sents=20):
+        return ' '.join(self.sentence(gender) for _ in range(self.rng.integers(min_sents, max_sents)))
+
+    def toks(self, gender, min_len=20, max_len=400):
+        """
+        Returns a synthetic pre-processed text: a list of <original_form, lemma, pos> tuples.
+        """
+        idx = self._draw(gender, self.rng.integers(min_len, max_len))
+        return [(self.words[i], self.words[i], self.word_pos[i]) for i in idx]
+
+    def _gender(self):
+        return 'F' if self.rng.random() < 0.5 else 'M'
+
+    def write_celeb_corpus(self, path_to_corpus, num_docs):
+        """
+        Writes num_docs articles split across the three site folders.
+        """
+        for site in SITES:
+            os.makedirs(os.path.join(path_to_corpus, site), exist_ok=True)
+        for i in range(num_docs):
+            site = SITES[i % len(SITES)]
+            gender = self._gender()
+            label = self.rng.choice([1, 0, -1], p=[0.45, 0.45, 0.1]) if gender == 'F' else self.rng.choice([0, 1, -1], p=[0.45, 0.45, 0.1])
+            year = 2010 + i % 9
+            month = 1 + (i // 9) % 12
+            date = 1 + i % 28
+            last_name = 'Writer{}'.format(i % 97)
+            article_id = '{}-{:02d}-{}_{}.{:02d}{}_{}'.format(year, month, date, 1 + i % 12, i % 60, 'PM', last_name + str(i))
+            with open(os.path.join(path_to_corpus, site, article_id + '.txt'), 'w') as f:
+                f.write('Synthetic Title {}\n'.format(i))
+                f.write('Jane {}\n'.format(last_name))
+                f.write('{} {}, {} {}:{:02d} PM\n'.format(MONTHNAMES[month-1], date, year, 1 + i % 12, i % 60))
+                f.write('https://{}.example.com/{}\n\n'.format(site, i))
+                f.write('TAGS: {}\n'.format(', '.join(['Celeb {}'.format(i % 500), 'Celeb {}'.format(i % 31)])))
+                f.write('LABEL: {}\n\n'.format(label))
+                f.write(self.text(gender))
+
+    def write_prof_corpus(self, path_to_corpus, num_docs, reviews_per_prof=10):
+        """
+        Writes num_docs professor files, each with up to reviews_per_prof reviews.
+        """
+        os.makedirs(path_to_corpus, exist_ok=True)
+        for i in range(num_docs):
+            gender = self._gender()
+            prof_name = 'Prof Number{}'.format(i)
+            fn = os.path.join(path_to_corpus, '{}__{}.txt'.format('_'.join(prof_name.split()), 100000 + i))
+            num_reviews = int(self.rng.integers(1, reviews_per_prof + 1))
+            with open(fn, 'w') as f:
+                f.write(prof_name + '\n')
+                f.write('School: Synthetic University {}\n'.format(i % 250))
+                f.write('URL: https://www.ratemyprofessors.com/ShowRatings.jsp?tid={}\n'.format(100000 + i))
+                f.write('Num reviews: {}\n'.format(num_reviews))
+                f.write('Gender: {}\n'.format(gender))
+                f.write('\n')
+                for j in range(num_reviews):
+                    tags = self.rng.choice(RMP_TAGS, size=self.rng.integers(0, 4), replace=False)
+                    f.write('Review #{}\n'.format(j+1))
+                    f.write('Rating: {}\n'.format(self.rng.choice(RATINGS)))
+                    f.write('Tags: {}\n'.format(', '.join(tags)))
+                    f.write('Text: {}\n'.format(self.text(gender, min_sents=1, max_sents=6)))
+                    f.write('\n')
+
+    def make_toks_per_text(self, num_docs, min_len=20, max_len=400):
+        """
+        Returns synthetic female and male pre-processed texts, in the
+        <text_id, toks> form that preprocessing pickles.
+        """
+        toks_per_text = {'F':[], 'M':[]}
+        genders = np.where(self.rng.random(num_docs) < 0.5, 'F', 'M')
+        lengths = self.rng.integers(min_len, max_len, size=num_docs)
+        for gender in ['F', 'M']:
+            is_gender = genders == gender
+            # draw all of this gender's word indices at once, then cut them into texts
+            idx = self._draw(gender, int(lengths[is_gender].sum()))
+            start = 0
+            for i in np.flatnonzero(is_gender):
+                text_idx = idx[start:start+lengths[i]]
+                start += lengths[i]
+                toks = [(self.words[j], self.words[j], self.word_pos[j]) for j in text_idx]
+                toks_per_text[gender].append(('synthetic_{}'.format(i), toks))
+        return toks_per_text['F'], toks_per_text['M']
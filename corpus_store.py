@@ -0,0 +1,200 @@
+import os
+import zlib
+
+'''
+    A packed corpus is a single data file holding many records (e.g., one celeb
+    article or one professor's reviews, in the same text format as the per-document
+    .txt files) back to back, plus an index file with one line per record:
+        <record_id>\t<offset>\t<length>
+    The index's first line is a header that records the format version and whether
+    the records are zlib-compressed. Both files are only ever appended to, so a crawl
+    can add records for days; if a crawl dies mid-write, reopening the writer drops
+    any bytes past the last indexed record. Loading a packed corpus is one sequential
+    read instead of one open per document.
+'''
+
+PACK_EXT = '.pack'
+INDEX_EXT = '.idx'
+VERSION = 1
+
+def pack_path_for(txt_dir):
+    """
+    Returns the packed corpus path that stands in for a folder of .txt files,
+    e.g. ../data/celeb/people/ -> ../data/celeb/people.pack
+    """
+    return txt_dir.rstrip('/') + PACK_EXT
+
+def pack_exists(path):
+    return os.path.isfile(path) and os.path.isfile(path + INDEX_EXT)
+
+def _read_index(path, start=0):
+    """
+    Returns the compression flag, the list of <record_id, offset, length> entries in
+    the index of a packed corpus, and the byte position where its last complete line
+    ends (anything after it is a partially written line). If start is a position
+    returned by an earlier call, only the entries indexed since then are returned.
+    """
+    entries = []
+    with open(path + INDEX_EXT, 'rb') as f:
+        header_line = f.readline()
+        header = header_line.decode('utf-8').split()
+        if len(header) < 3 or header[0] != '#corpus-pack':
+            raise ValueError('Not a packed corpus index: {}'.format(path + INDEX_EXT))
+        if int(header[1].lstrip('v')) > VERSION:
+            raise ValueError('Unsupported packed corpus version: {}'.format(header[1]))
+        compress = header[2] == 'compress=zlib'
+        end = max(len(header_line), start)
+        f.seek(end)
+        for line in f:
+            if not line.endswith(b'\n'):  # partially written line
+                break
+            record_id, offset, length = line.decode('utf-8').rstrip('\n').rsplit('\t', 2)
+            entries.append((record_id, int(offset), int(length)))
+            end += len(line)
+    return compress, entries, end
+
+'''
+    This class appends records to a packed corpus, creating it if it does not exist.
+'''
+class CorpusWriter:
+    def __init__(self, path, compress=False):
+        self.path = path
+        if pack_exists(path):
+            self.compress, entries, index_end = _read_index(path)
+            self.ids = set(record_id for record_id, _, _ in entries)
+            end = max([offset + length for _, offset, length in entries], default=0)
+            self._data = open(path, 'r+b')
+            self._data.truncate(end)  # drop a record that was not fully indexed
+            self._data.seek(end)
+            with open(path + INDEX_EXT, 'r+b') as f:
+                f.truncate(index_end)  # drop a partially written index line
+        else:
+            self.compress = compress
+            self.ids = set()
+            self._data = open(path, 'wb')
+            with open(path + INDEX_EXT, 'w') as f:
+                f.write('#corpus-pack v{} compress={}\n'.format(VERSION, 'zlib' if compress else 'none'))
+        self._index = open(path + INDEX_EXT, 'a')
+
+    def write(self, record_id, content):
+        """
+        Appends one record. If a record with this ID already exists, the new one
+        supersedes it.
+        """
+        assert('\t' not in record_id and '\n' not in record_id)
+        payload = content.encode('utf-8')
+        if self.compress:
+            payload = zlib.compress(payload)
+        offset = self._data.tell()
+        self._data.write(payload)
+        self._data.flush()
+        self._index.write('{}\t{}\t{}\n'.format(record_id, offset, len(payload)))
+        self._index.flush()
+        self.ids.add(record_id)
+
+    def __contains__(self, record_id):
+        return record_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+'''
+    This class reads a packed corpus, either sequentially (iterating yields
+    <record_id, content> in the order the records were written) or by record ID.
+'''
+class CorpusReader:
+    def __init__(self, path):
+        self.path = path
+        self.compress, entries, _ = _read_index(path)
+        self.index = {}
+        for record_id, offset, length in entries:
+            self.index[record_id] = (offset, length)  # later records supersede earlier ones
+
+    def ids(self):
+        return list(self.index.keys())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, record_id):
+        return record_id in self.index
+
+    def _decode(self, payload):
+        if self.compress:
+            payload = zlib.decompress(payload)
+        return payload.decode('utf-8')
+
+    def get(self, record_id):
+        offset, length = self.index[record_id]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return self._decode(f.read(length))
+
+    def __iter__(self):
+        entries = sorted((offset, length, record_id) for record_id, (offset, length) in self.index.items())
+        with open(self.path, 'rb', buffering=1 << 20) as f:
+            position = 0
+            for offset, length, record_id in entries:
+                if offset != position:
+                    f.seek(offset)  # only needed to skip superseded records
+                payload = f.read(length)
+                position = offset + length
+                yield record_id, self._decode(payload)
+
+def read_new_records(path, index_pos=0):
+    """
+    Returns an iterator over the <record_id, content> records appended to a packed
+    corpus since index_pos, in the order they were written, and the index position
+    to pass next time. index_pos is a position in the index file (0 for every
+    record), so a caller that follows a growing corpus only reads what is new.
+    """
+    if os.path.getsize(path + INDEX_EXT) <= index_pos:
+        return iter([]), index_pos
+    compress, entries, end = _read_index(path, start=index_pos)
+    return _iter_entries(path, entries, compress), end
+
+def _iter_entries(path, entries, compress):
+    with open(path, 'rb') as f:
+        for record_id, offset, length in entries:
+            f.seek(offset)
+            payload = f.read(length)
+            yield record_id, (zlib.decompress(payload) if compress else payload).decode('utf-8')
+
+def convert_directory(txt_dir, path=None, compress=False, verbose=True):
+    """
+    Packs every .txt file in txt_dir into a packed corpus (by default, the one that
+    pack_path_for(txt_dir) names). Record IDs are the filenames without '.txt'. Files
+    that are already in the packed corpus are skipped, so this can be rerun as the
+    folder grows.
+    """
+    if path is None:
+        path = pack_path_for(txt_dir)
+    num_added = 0
+    with CorpusWriter(path, compress=compress) as writer:
+        for fn in sorted(os.listdir(txt_dir)):
+            if fn.endswith('.txt'):
+                record_id = fn[:-len('.txt')]
+                if record_id not in writer:
+                    with open(os.path.join(txt_dir, fn), 'r') as f:
+                        writer.write(record_id, f.read())
+                    num_added += 1
+        if verbose:
+            print('Packed {} new files from {} -> {} ({} records)'.format(num_added, txt_dir, path, len(writer)))
+    return path
+
+if __name__ == '__main__':
+    from data_loader import CELEB_PATH, PROF_PATH
+    for dataset in ['eonline', 'people', 'usweekly']:
+        convert_directory(CELEB_PATH + dataset + '/')
+    convert_directory(PROF_PATH)
@@ -1,35 +1,58 @@
 from bs4 import BeautifulSoup
 from celeb_extractor import CelebExtractor, monthname_to_monthnum
 from collections import Counter
+from fetcher import CircuitOpenError, FetchError, default_fetcher
 import os
 import pickle
-import requests
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus_store import CorpusReader, CorpusWriter, pack_exists, pack_path_for
+from instrumentation import Progress, report
+
+WIKI_SEARCH_URL = 'https://en.wikipedia.org/w/index.php?search={}'
 
 class CelebBuilder:
-    def __init__(self, dataset, verbose=False):
+    def __init__(self, dataset, verbose=False, fetcher=None):
         self.ext = CelebExtractor(dataset)
         self.verbose = verbose
+        self.fetcher = fetcher or default_fetcher()
 
     def want_to_parse(self, soup):
         return self.ext.want_to_parse(soup)
 
-    def write_to_file(self, dir, url, soup):
+    def write_to_file(self, dir, url, soup, writer=None):
+        """
+        Writes the article to <dir>/<ID>.txt or, if a CorpusWriter is given, appends
+        it to that packed corpus as record <ID>.
+        """
+        ID, content = self.format_article(url, soup)
+        if writer is not None:
+            writer.write(ID, content)
+        else:
+            filename = dir + '{}.txt'.format(ID)
+            with open(filename, 'w') as f:
+                f.write(content)
+
+    def format_article(self, url, soup):
+        """
+        Extracts the article and returns its ID and its contents in the corpus file format.
+        """
         title, author, timestamp, tags, text = self.ext.extract_all(soup)
         ID = self._make_id(author, timestamp)
         print('ID: {} | Title: {}'.format(ID, title))
-        filename = dir + '{}.txt'.format(ID)
-        with open(filename, 'w') as f:
-            f.write('{}\n'.format(title))
-            f.write('{}\n'.format(author))
-            f.write('{}\n'.format(timestamp))
-            f.write('{}\n\n'.format(url))
-            f.write('TAGS: {}\n'.format(', '.join(tags)))
-            if len(tags) > 0:
-                label = self._determine_label(tags)
-            else:
-                label = -1
-            f.write('LABEL: {}\n\n'.format(str(label)))
-            f.write(' '.join(text))
+        content = '{}\n'.format(title)
+        content += '{}\n'.format(author)
+        content += '{}\n'.format(timestamp)
+        content += '{}\n\n'.format(url)
+        content += 'TAGS: {}\n'.format(', '.join(tags))
+        if len(tags) > 0:
+            label = self._determine_label(tags)
+        else:
+            label = -1
+        content += 'LABEL: {}\n\n'.format(str(label))
+        content += ' '.join(text)
+        return ID, content
 
     def _make_id(self, author, timestamp):
         last_name = author.split()[-1]
@@ -64,12 +87,15 @@ class CelebBuilder:
 
     def _find_wiki(self, text):
         text = text.split()
-        r = requests.get('https://en.wikipedia.org/w/index.php?search=' + '+'.join(text))
+        r = self.fetcher.fetch(WIKI_SEARCH_URL.format('+'.join(text)), latency_name='http_wikipedia')
         soup = BeautifulSoup(r.content, 'html.parser')
-        page_name = soup.find('h1', attrs={'class':'firstHeading'}).text
+        heading = soup.find('h1', attrs={'class':'firstHeading'})
+        page_name = heading.text if heading is not None else None
         found_bio = False
         report = '{} -> Wiki page \'{}\' -> '.format(text, page_name)
-        if page_name != 'Search results':
+        if page_name is None:
+            report += 'IGNORE (NOT A WIKI PAGE)'
+        elif page_name != 'Search results':
             rows = soup.find_all('th', attrs={'scope':'row'})
             row_labels = [r.text for r in rows]
             if 'Born' in row_labels:
@@ -99,8 +125,17 @@ def predict_gender(texts):
         return 'M'
     return 'UNK'
 
-def make_corpus(dataset, startover=False, max_to_process=None):
-    builder = CelebBuilder(dataset=dataset)
+def make_corpus(dataset, startover=False, max_to_process=None, packed=False, workers=8, fetcher=None):
+    """
+    Crawls the dataset's article URLs and writes each parsed article to the corpus,
+    as one .txt file per article or, if packed is True, into the dataset's packed
+    corpus (see corpus_store). Articles are fetched by up to workers threads through
+    the fetcher (which retries and throttles per host), and processed in order. If a
+    host's circuit opens, the crawl stops there, so a later run resumes from the first
+    unprocessed URL instead of recording the rest as failed.
+    """
+    fetcher = fetcher or default_fetcher()
+    builder = CelebBuilder(dataset=dataset, fetcher=fetcher)
     urls_fn = dataset + '_urls.pkl'
     urls_to_process = pickle.load(open(urls_fn, 'rb'))
     failed_fn = dataset + '_failed_urls.pkl'
@@ -123,30 +158,54 @@ def make_corpus(dataset, startover=False, max_to_process=None):
     if max_to_process:
         urls_to_process = urls_to_process[:max_to_process]
     print('Num already processed: {}. Num to process: {}'.format(num_processed, len(urls_to_process)))
+    writer = CorpusWriter(pack_path_for(text_dir)) if packed else None
 
-    for i, url in enumerate(urls_to_process):
-        r = requests.get(url)
+    progress = Progress('make_corpus_' + dataset, total=len(urls_to_process), every_sec=60, stall_sec=600)
+    responses = fetcher.fetch_all(urls_to_process, workers=workers, latency_name='http_' + dataset)
+    for url, r in responses:
+        if isinstance(r, CircuitOpenError):
+            print('Stopping: {} keeps failing. Rerun to resume from {}'.format(r.url, url))
+            break
+        if isinstance(r, FetchError):
+            print('Could not fetch:', url, r)
+            failed.add(url)
+            progress.update(docs=1, failed=1)
+            continue
         soup = BeautifulSoup(r.content, 'html.parser')
         if not builder.want_to_parse(soup):  # quick check of whether this type of page should be parsed
             print('Skipping:', url)
             skipped.add(url)
+            progress.update(docs=1, skipped=1)
         else:
             try:
-                builder.write_to_file(text_dir, url, soup)
+                builder.write_to_file(text_dir, url, soup, writer=writer)
                 num_parsed += 1
-            except ValueError:
+                progress.update(docs=1, parsed=1)
+            except CircuitOpenError as e:  # Wikipedia keeps failing, so the article cannot be labeled
+                print('Stopping: {} keeps failing. Rerun to resume from {}'.format(e.url, url))
+                break
+            except (ValueError, FetchError):
                 print('Could not parse:', url)
                 failed.add(url)
-        num_done = i+1
-        if num_done % 50 == 0:
-            print('DONE WITH {} ARTICLES!'.format(num_done))
+                progress.update(docs=1, failed=1)
+    responses.close()
+    progress.finish()
+    report()
+    if writer is not None:
+        writer.close()
     pickle.dump(failed, open(failed_fn, 'wb'))
     pickle.dump(skipped, open(skipped_fn, 'wb'))
     print('Overall status: parsed {}, failed on {}, skipped {}'.format(num_parsed, len(failed), len(skipped)))
 
 def get_num_parsed(text_dir):
-    fns = [fn for fn in os.listdir(text_dir) if fn.endswith('.txt')]
-    return len(fns)
+    """
+    Counts the parsed articles, whether they are .txt files in text_dir or records
+    in its packed corpus.
+    """
+    ids = set(fn[:-len('.txt')] for fn in os.listdir(text_dir) if fn.endswith('.txt'))
+    if pack_exists(pack_path_for(text_dir)):
+        ids.update(CorpusReader(pack_path_for(text_dir)).ids())
+    return len(ids)
 
 if __name__ == '__main__':
     make_corpus('people', startover=False, max_to_process=300000)
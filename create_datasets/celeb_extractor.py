@@ -1,8 +1,10 @@
 from bs4 import BeautifulSoup
 import json
+import os
 import pickle
 import re
 import requests
+from url_discovery import DiscoveryEngine, UrlStore
 
 # Filenames of the pickle files with the People/UsWeekly/E!Online articles will be stored
 PEOPLE_URLS_FNAME = 'people_urls.pkl'
@@ -14,91 +16,98 @@ USWEEKLY_SAMPLE = 'https://www.usmagazine.com/stylish/news/golden-globes-2019-mi
 EONLINE_SAMPLE = 'https://www.eonline.com/news/1011002/pete-davidson-and-kate-beckinsale-reunite-and-show-pda-after-comedy-show'
 
 # ========== SCRAPE URLS ==========
+PEOPLE_LISTING_URL = 'https://people.com/tag/movie-celebrities/?page={}'
+USWEEKLY_LISTING_URL = 'https://www.usmagazine.com/celebrity-news/{}'
+EONLINE_LISTING_URL = 'https://www.eonline.com/news/page/{}'
+EONLINE_DOMAIN = 'https://www.eonline.com'
+
+def people_parse_links(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    links = soup.find_all('a', attrs={'class':'category-page-item-image-link'})
+    if len(links) == 0:
+        return None
+    return [link['href'] for link in links]
+
+def usweekly_parse_links(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    links = soup.find_all('a', attrs={'class':'content-card-link'})
+    if len(links) == 0:
+        return None
+    return [link['href'] for link in links]
+
+def eonline_parse_links(content, domain=EONLINE_DOMAIN):
+    soup = BeautifulSoup(content, 'html.parser')
+    links = soup.find_all('a', attrs={'class':'category-landing__hero-link'})
+    links += soup.find_all('a', attrs={'class':'category-landing__content-link'})
+    if len(links) == 0:
+        return None
+    urls = []
+    for link in links:
+        content_type = link.find('span', attrs={'class':'category-landing__textbox-type'})
+        if content_type is None:
+            content_type = link.find('div', attrs={'class':'content-item__type'})
+        if content_type is not None and content_type.text.lower().strip() == 'news':
+            urls.append(domain + link['href'])
+    return urls
+
+def _make_engine(listing_url, parse_links, urls_fname, workers, fetch):
+    store = UrlStore(urls_fname + '.log')
+    kwargs = {} if fetch is None else {'fetch':fetch}
+    return DiscoveryEngine(listing_url.format, parse_links, store, workers=workers, **kwargs)
+
 '''
     This function scrapes the URLs of all articles tagged 'movie-celebrities' on the
     People website. max_pages limits the number of pages to scrape; it is mostly used
-    for testing.
+    for testing. Listing pages are fetched concurrently (see url_discovery), and found
+    URLs are logged to <PEOPLE_URLS_FNAME>.log as they come in.
 '''
-def people_scrape_urls(max_pages):
-    urls = []
-    for page_num in range(1, max_pages+1):
-        print('PAGE #{}'.format(page_num))
-        page_url = 'https://people.com/tag/movie-celebrities/?page=' + str(page_num)
-        r = requests.get(page_url)
-        soup = BeautifulSoup(r.content, 'html.parser')
-        links = soup.find_all('a', attrs={'class':'category-page-item-image-link'})
-        if len(links) == 0:
-            print('Breaking loop on page {}'.format(page_num))
-            break
-        for link in links:
-            print(link['href'])
-            urls.append(link['href'])
+def people_scrape_urls(max_pages, listing_url=PEOPLE_LISTING_URL, workers=8, fetch=None):
+    engine = _make_engine(listing_url, people_parse_links, PEOPLE_URLS_FNAME, workers, fetch)
+    last_page = engine.find_last_page(1, max_page=max_pages)
+    print('Last page: {}'.format(last_page))
+    engine.discover(1, last_page)
+    urls = engine.store.urls()
+    engine.store.close()
     pickle.dump(urls, open(PEOPLE_URLS_FNAME, 'wb'))
+    return urls
 
 '''
     This function scrapes the URLs of all articles tagged 'celebrity-news' on the
     UsWeekly website. max_urls limits the number of urls to scrape; it is mostly used
     for testing.
 '''
-def usweekly_scrape_urls(max_urls):
-    urls = []
-    page_num = 1
-    while True:
-        page_url = 'https://www.usmagazine.com/celebrity-news/' + str(page_num)
-        r = requests.get(page_url)
-        soup = BeautifulSoup(r.content, 'html.parser')
-        links = soup.find_all('a', attrs={'class':'content-card-link'})
-        print('Page {}: adding {} links'.format(page_num, len(links)))
-        if len(links) == 0:
-            print('No more links -> breaking loop')
-            break
-        for link in links:
-            urls.append(link['href'])
-            if len(urls) % 100 == 0: # save every 100
-                print('SAVING...')
-                pickle.dump((urls, page_num), open(USWEEKLY_URLS_FNAME, 'wb'))
-        if len(urls) >= max_urls:
-            print('Reached max links -> breaking loop')
-            break
-        page_num += 1
+def usweekly_scrape_urls(max_urls, listing_url=USWEEKLY_LISTING_URL, workers=8, fetch=None):
+    engine = _make_engine(listing_url, usweekly_parse_links, USWEEKLY_URLS_FNAME, workers, fetch)
+    last_page = engine.find_last_page(1)
+    print('Last page: {}'.format(last_page))
+    engine.discover(1, last_page, max_urls=max_urls)
+    urls = engine.store.urls()
+    engine.store.close()
     print('Found {} urls'.format(len(urls)))
-    pickle.dump((urls, page_num), open(USWEEKLY_URLS_FNAME, 'wb'))
+    pickle.dump((urls, last_page), open(USWEEKLY_URLS_FNAME, 'wb'))
+    return urls
 
 '''
     This function scrapes the URLs of all articles tagged 'news' on the E!Online website.
     min_page and max_page limit the number of pages to scrape; they are mostly used
-    for testing.
+    for testing. If continue_work is True, URLs found by earlier runs are kept.
 '''
-def eonline_scrape_urls(min_page, max_page, continue_work=True):
+def eonline_scrape_urls(min_page, max_page, continue_work=True, listing_url=EONLINE_LISTING_URL, workers=8, fetch=None):
     assert(min_page <= max_page)
-    if continue_work:
-        urls = pickle.load(open(EONLINE_URLS_FNAME, 'rb'))
-        print('Already have {} urls'.format(len(urls)))
-    else:
-        urls = []
-    for page_num in range(min_page, max_page+1):
-        print('PAGE #{}'.format(page_num))
-        page_url = 'https://www.eonline.com/news/page/' + str(page_num)
-        r = requests.get(page_url)
-        soup = BeautifulSoup(r.content, 'html.parser')
-        links = soup.find_all('a', attrs={'class':'category-landing__hero-link'})
-        links += soup.find_all('a', attrs={'class':'category-landing__content-link'})
-        if len(links) == 0:
-            print('Breaking loop on page {}'.format(page_num))
-            break
-        for link in links:
-            content_type = link.find('span', attrs={'class':'category-landing__textbox-type'})
-            if content_type is None:
-                content_type = link.find('div', attrs={'class':'content-item__type'})
-            if content_type is not None:
-                content_type = content_type.text.lower().strip()
-                if content_type == 'news':
-                    urls.append('https://www.eonline.com' + link['href'])
-                    print(urls[-1])
-                elif content_type != 'videos':
-                    print(content_type)
+    if not continue_work and os.path.isfile(EONLINE_URLS_FNAME + '.log'):
+        os.remove(EONLINE_URLS_FNAME + '.log')
+    engine = _make_engine(listing_url, eonline_parse_links, EONLINE_URLS_FNAME, workers, fetch)
+    if continue_work and len(engine.store) == 0 and os.path.isfile(EONLINE_URLS_FNAME):
+        for url in pickle.load(open(EONLINE_URLS_FNAME, 'rb')):  # urls saved before the log existed
+            engine.store.add(url)
+    print('Already have {} urls'.format(len(engine.store)))
+    last_page = engine.find_last_page(min_page, max_page=max_page)
+    engine.discover(min_page, last_page)
+    urls = engine.store.urls()
+    engine.store.close()
     print('Done. Saving {} urls'.format(len(urls)))
     pickle.dump(urls, open(EONLINE_URLS_FNAME, 'wb'))
+    return urls
 
 # ========== EXTRACT DATA ==========
 '''
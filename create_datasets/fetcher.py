@@ -0,0 +1,296 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+import itertools
+import os
+import random
+import requests
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instrumentation import emit, get_meter, observe_latency
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # worth retrying, and a sign that the host is overloaded
+LATENCY_FACTOR = 4  # without a latency target, a smoothed latency above this times the fastest one is congestion
+LATENCY_SMOOTHING = 0.2  # weight of the newest latency in the moving average
+LATENCY_DECREASE = 0.8  # concurrency multiplier on congestion
+FAILURE_DECREASE = 0.5  # concurrency multiplier on a 429, 5xx, or connection error
+
+class FetchError(Exception):
+    """
+    Raised when a URL cannot be fetched: a non-retryable status (e.g. 404), or a
+    retryable one that persisted through every retry.
+    """
+    def __init__(self, url, status=None, reason=None):
+        super().__init__('{} ({})'.format(url, status if status is not None else reason))
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+class CircuitOpenError(FetchError):
+    """
+    Raised without fetching when the URL's host has failed persistently, so that a
+    crawl can stop and be resumed later instead of marking every URL as failed.
+    """
+
+def parse_retry_after(value):
+    """
+    Returns the number of seconds a Retry-After header asks to wait (it is either a
+    number of seconds or an HTTP date), or None if there is none.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+'''
+    This class controls the requests to one host. Its concurrency limit follows AIMD:
+    it grows by about one per window of limit completed requests while the host
+    answers quickly, and is cut multiplicatively (at most once per window) when its
+    moving average latency rises above the target, or on a 429, 5xx, or connection error. A
+    Retry-After pauses every request to the host until it has passed. Throttling is
+    the host pacing us rather than failing, so 429s do not count towards the circuit
+    breaker: after breaker_threshold consecutive 5xx or connection errors, it opens for breaker_cooldown
+    seconds, during which requests fail fast with CircuitOpenError; then a single
+    trial request is let through, which closes the circuit if it succeeds and reopens
+    it (with twice the cooldown) if it fails.
+'''
+class HostController:
+    def __init__(self, host, initial_concurrency=4, min_concurrency=1, max_concurrency=32, latency_target=None,
+                 breaker_threshold=10, breaker_cooldown=60):
+        self.host = host
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.in_flight = 0
+        self.min_latency = None
+        self.latency = None  # moving average
+        self.paused_until = 0
+        self.failures = 0  # consecutive
+        self.open_until = None  # set while the circuit is open or half-open
+        self._cooldown = breaker_cooldown
+        self._trial_in_flight = False
+        self._completions = 0
+        self._last_decrease = -1
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Blocks until a request to the host may start. Returns whether it is the trial
+        request of a half-open circuit; raises CircuitOpenError while the circuit is open.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.open_until is not None and now < self.open_until:
+                    raise CircuitOpenError(self.host, reason='circuit open')
+                elif now < self.paused_until:  # a Retry-After also holds back the trial request
+                    self._cond.wait(self.paused_until - now)
+                elif self.open_until is not None:
+                    if not self._trial_in_flight:
+                        self._trial_in_flight = True
+                        self.in_flight += 1
+                        return True
+                    self._cond.wait(1)
+                elif self.in_flight < max(1, int(self.limit)):
+                    self.in_flight += 1
+                    return False
+                else:
+                    self._cond.wait(1)
+
+    def release(self, ok, latency=None, throttled=False, retry_after=None, trial=False):
+        """
+        Records the outcome of a request started with acquire. ok is False for a
+        429 (which is also throttled), 5xx, or connection error.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._completions += 1
+            if trial:
+                self._trial_in_flight = False
+            if ok:
+                self.failures = 0
+                if self.open_until is not None and trial:
+                    self.open_until = None
+                    self._cooldown = self.breaker_cooldown
+                    emit('circuit_close', host=self.host)
+                if self.latency is None:
+                    self.min_latency = self.latency = latency
+                self.min_latency = min(self.min_latency, latency)
+                self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+                target = self.latency_target or LATENCY_FACTOR * self.min_latency
+                if self.latency > target:
+                    self._decrease(LATENCY_DECREASE, 'latency')
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif throttled:
+                self._decrease(FAILURE_DECREASE, 'throttled')
+                if retry_after is not None:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                emit('fetch_throttled', host=self.host, retry_after=retry_after)
+                if trial:  # the host is up again; let the next request be the trial
+                    self.open_until = time.monotonic()
+            else:
+                self.failures += 1
+                self._decrease(FAILURE_DECREASE, 'failure')
+                if retry_after is not None:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                if trial:
+                    self._cooldown *= 2
+                if trial or (self.open_until is None and self.failures >= self.breaker_threshold):
+                    self.open_until = time.monotonic() + self._cooldown
+                    emit('circuit_open', host=self.host, failures=self.failures, cooldown=self._cooldown)
+            self._cond.notify_all()
+
+    def _decrease(self, factor, cause):
+        if self._completions - self._last_decrease < self.limit:
+            return  # already decreased in this window
+        self._last_decrease = self._completions
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        emit('fetch_concurrency', host=self.host, limit=round(self.limit, 2), cause=cause)
+
+'''
+    This class fetches URLs for the crawlers through one HostController per host, and
+    retries 429s, 5xxs, and connection errors with jittered exponential backoff (or
+    the Retry-After, if longer). fetch() is thread-safe; fetch_all() fetches a list of
+    URLs concurrently and yields the results in order, so a crawl that stops early
+    has processed exactly a prefix of its URLs and can be resumed from there.
+'''
+class Fetcher:
+    def __init__(self, initial_concurrency=4, min_concurrency=1, max_concurrency=32, latency_target=None, max_retries=4,
+                 backoff_base=0.5, backoff_max=60, timeout=30, breaker_threshold=10, breaker_cooldown=60):
+        self.host_kwargs = {'initial_concurrency':initial_concurrency, 'min_concurrency':min_concurrency,
+                            'max_concurrency':max_concurrency, 'latency_target':latency_target,
+                            'breaker_threshold':breaker_threshold, 'breaker_cooldown':breaker_cooldown}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.hosts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def host(self, url):
+        name = urlparse(url).netloc
+        with self._lock:
+            if name not in self.hosts:
+                self.hosts[name] = HostController(name, **self.host_kwargs)
+            return self.hosts[name]
+
+    def _session(self):
+        # one session (and connection pool) per thread, for keep-alive
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+    def fetch(self, url, latency_name=None):
+        """
+        Returns the response to a GET of url, or raises FetchError.
+        """
+        host = self.host(url)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                trial = host.acquire()
+            except CircuitOpenError:
+                raise CircuitOpenError(url, reason='circuit open for ' + host.host)
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                if latency_name is not None:
+                    with observe_latency(latency_name):
+                        r = self._session().get(url, timeout=self.timeout)
+                else:
+                    r = self._session().get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                host.release(False, trial=trial)
+                error = FetchError(url, reason=repr(e))
+            else:
+                if r.status_code in RETRY_STATUSES:
+                    retry_after = parse_retry_after(r.headers.get('Retry-After'))
+                    host.release(False, throttled=r.status_code == 429, retry_after=retry_after, trial=trial)
+                    error = FetchError(url, status=r.status_code)
+                else:
+                    host.release(True, latency=time.perf_counter() - start, trial=trial)
+                    if r.status_code >= 400:
+                        raise FetchError(url, status=r.status_code)
+                    return r
+            if attempt < self.max_retries:
+                delay = self.backoff(attempt, retry_after)
+                emit('fetch_retry', url=url, attempt=attempt + 1, error=str(error), delay=round(delay, 3))
+                get_meter('fetch').add(retries=1)
+                time.sleep(delay)
+        raise error
+
+    def _fetch_or_error(self, url, latency_name):
+        try:
+            return self.fetch(url, latency_name=latency_name)
+        except FetchError as e:
+            return e
+
+    def fetch_all(self, urls, workers=8, latency_name=None):
+        """
+        Yields <url, response or FetchError> for every URL, in order, with up to
+        workers fetches in flight (and no more per host than its concurrency limit).
+        Closing the generator early cancels the fetches that have not started.
+        """
+        urls = iter(urls)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            pending = deque((url, executor.submit(self._fetch_or_error, url, latency_name))
+                            for url in itertools.islice(urls, 2 * workers))
+            while len(pending) > 0:
+                url, future = pending.popleft()
+                result = future.result()
+                for next_url in itertools.islice(urls, 1):
+                    pending.append((next_url, executor.submit(self._fetch_or_error, next_url, latency_name)))
+                yield url, result
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self):
+        """
+        Returns each host's concurrency limit, in-flight requests, average latency, and
+        circuit state.
+        """
+        with self._lock:
+            hosts = list(self.hosts.values())
+        return {h.host:{'limit':round(h.limit, 2), 'in_flight':h.in_flight, 'latency':h.latency, 'failures':h.failures,
+                        'circuit':'closed' if h.open_until is None else 'open'} for h in hosts}
+
+_default = {'fetcher':None}
+_default_lock = threading.Lock()
+
+def default_fetcher():
+    """
+    Returns the fetcher shared by the crawlers, so that requests to the same host
+    from different crawlers share one concurrency limit and circuit.
+    """
+    with _default_lock:
+        if _default['fetcher'] is None:
+            _default['fetcher'] = Fetcher()
+        return _default['fetcher']
+
+def configure_fetcher(**kwargs):
+    """
+    Replaces the shared fetcher with one built with the given Fetcher arguments.
+    """
+    with _default_lock:
+        _default['fetcher'] = Fetcher(**kwargs)
+        return _default['fetcher']
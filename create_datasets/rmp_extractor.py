@@ -1,14 +1,19 @@
 from bs4 import BeautifulSoup
 import os
 import pickle
-import requests
 import numpy as np
-from selenium import webdriver
 from collections import Counter
+from fetcher import CircuitOpenError, FetchError, default_fetcher
+import sys
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus_store import CorpusReader, CorpusWriter, pack_exists, pack_path_for
+from instrumentation import Progress, report
+
 DOMAIN = 'https://www.ratemyprofessors.com'
 PATH_TO_CORPUS = '../../data/professor/'
+SCHOOL2INFO_FNAME = '../1.rate_my_prof/school2info.pkl'
 COLUMBIA_ID = 278
 
 def prep_query_by_school_driver():
@@ -16,6 +21,7 @@ def prep_query_by_school_driver():
     Prepares a Chrome driver that puts the searches into query-by-school mode with the
     department set to Computer Science.
     """
+    from selenium import webdriver  # only the driver functions need selenium
     driver = webdriver.Chrome(os.path.join(os.getcwd(), 'chromedriver'))
     columbia_url = 'https://www.ratemyprofessors.com/search.jsp?queryBy=schoolId&schoolID={}&queryoption=TEACHER'.format(COLUMBIA_ID)
     driver.get(columbia_url)
@@ -80,12 +86,20 @@ def extract_prof_id(url):
             return value
     return None
 
-def parse_professor_page(url):
+def parse_professor_page(url, fetcher=None):
     """
     Parses the professor page and their reviews.
     """
-    r = requests.get(url)
-    soup = BeautifulSoup(r.content, 'html.parser')
+    fetcher = fetcher or default_fetcher()
+    r = fetcher.fetch(url, latency_name='http_rmp_professor')
+    return parse_professor_content(r.content)
+
+def parse_professor_content(content):
+    """
+    Parses the contents of a professor page; returns the number of reviews and the
+    parsed reviews.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
     reviews_heading = soup.find('div', attrs={'data-table':'rating-filter'})
     if reviews_heading is None:
         return 0, []
@@ -165,35 +179,45 @@ def predict_gender_from_reviews(reviews):
         return 'F'
     return 'UNK'
 
-def write_reviews_to_file(fn, prof_name, school_name, prof_url, num_reviews, gender, reviews):
+def write_reviews_to_file(fn, prof_name, school_name, prof_url, num_reviews, gender, reviews, writer=None):
     """
-    Writes the information for a professor to file.
+    Writes the information for a professor to file or, if a CorpusWriter is given,
+    appends it to that packed corpus as a record named after the file.
     """
-    with open(fn, 'w') as f:
-        f.write(prof_name + '\n')
-        f.write('School: {}\n'.format(school_name))
-        f.write('URL: {}\n'.format(prof_url))
-        f.write('Num reviews: {}\n'.format(num_reviews))
-        f.write('Gender: {}\n'.format(gender))
-        f.write('\n')
-        for i, rev in enumerate(reviews):
-            f.write('Review #{}\n'.format(i+1))
-            f.write('Rating: {}\n'.format(rev['rating']))
-            f.write('Tags: {}\n'.format(', '.join(rev['tags'])))
-            f.write('Text: {}\n'.format(rev['text']))
-            f.write('\n')
+    content = prof_name + '\n'
+    content += 'School: {}\n'.format(school_name)
+    content += 'URL: {}\n'.format(prof_url)
+    content += 'Num reviews: {}\n'.format(num_reviews)
+    content += 'Gender: {}\n'.format(gender)
+    content += '\n'
+    for i, rev in enumerate(reviews):
+        content += 'Review #{}\n'.format(i+1)
+        content += 'Rating: {}\n'.format(rev['rating'])
+        content += 'Tags: {}\n'.format(', '.join(rev['tags']))
+        content += 'Text: {}\n'.format(rev['text'])
+        content += '\n'
+    if writer is not None:
+        writer.write(os.path.basename(fn)[:-len('.txt')], content)
+    else:
+        with open(fn, 'w') as f:
+            f.write(content)
 
 def get_current_corpus():
     """
-    Reviews all of the filenames in the current corpus.
+    Reviews all of the filenames in the current corpus, including the professors
+    in the packed corpus (named by the filename they would have had).
     """
     corpus = set()
     for fn in os.listdir(PATH_TO_CORPUS):
         if fn.endswith('.txt'):
             corpus.add(PATH_TO_CORPUS + fn)
+    if pack_exists(pack_path_for(PATH_TO_CORPUS)):
+        for record_id in CorpusReader(pack_path_for(PATH_TO_CORPUS)).ids():
+            corpus.add(PATH_TO_CORPUS + record_id + '.txt')
     return corpus
 
 def prep_query_by_professor_driver():
+    from selenium import webdriver
     driver = webdriver.Chrome(os.path.join(os.getcwd(), 'chromedriver'))
     columbia_url = 'https://www.ratemyprofessors.com/search.jsp?queryBy=schoolId&schoolID={}&queryoption=TEACHER'.format(COLUMBIA_ID)
     driver.get(columbia_url)
@@ -223,7 +247,15 @@ def collect_schools():
     for offset in np.arange(MIN_OFFSET, MAX_OFFSET+STEP_SIZE, step=STEP_SIZE):
         if offset % 100 == 0: print(offset)
         url = DOMAIN + '/search.jsp?query=&queryoption=HEADER&stateselect=&country=united+states&dept=&queryBy=schoolName&facetSearch=&schoolName=&offset={}&max=20'.format(offset)
-        r = requests.get(url)
+        try:
+            r = default_fetcher().fetch(url, latency_name='http_rmp_schools')
+        except CircuitOpenError as e:
+            print('Stopping at offset {}: {}'.format(offset, e))
+            break
+        except FetchError as e:
+            print('Failed on offset {}: {}'.format(offset, e))
+            num_failed += 1
+            continue
         soup = BeautifulSoup(r.content, 'html.parser')
         schools = soup.find_all('li', attrs={'class':'listing SCHOOL'})
         for s in schools:
@@ -275,7 +307,7 @@ def edit_professors_per_school():
     more than 20 CS professors.
     """
     driver = prep_query_by_school_driver()
-    fn = '../1.rate_my_prof/school2info.pkl'
+    fn = SCHOOL2INFO_FNAME
     school2info = pickle.load(open(fn, 'rb'))
     missing_before = 0
     missing_now = 0
@@ -293,18 +325,25 @@ def edit_professors_per_school():
     print('Missing {} profs before, missing {} profs now'.format(missing_before, missing_now))
     pickle.dump(school2info, open(fn, 'wb'))
 
-def build_corpus(start_idx, num_schools_to_process):
+def build_corpus(start_idx, num_schools_to_process, packed=False, workers=8, fetcher=None):
     """
     Builds the text corpus, where there is one text file per professor, and the
-    text file consists of all of that professor's reviews.
+    text file consists of all of that professor's reviews. If packed is True, the
+    professors are appended to the packed corpus instead of separate files. The pages
+    of a school's professors are fetched by up to workers threads through the fetcher;
+    if a host's circuit opens, the build stops, and can be resumed from that school.
     """
+    fetcher = fetcher or default_fetcher()
     current_corpus = get_current_corpus()
-    school2info = pickle.load(open('../1.rate_my_prof/school2info.pkl', 'rb'))
+    school2info = pickle.load(open(SCHOOL2INFO_FNAME, 'rb'))
     sorted_schools = sorted(list(school2info.keys()))
     print('Total num schools:', len(sorted_schools))
     end_idx = min(len(sorted_schools), start_idx + num_schools_to_process)
     print('Processing schools from idx {} to {} ({} schools)'.format(start_idx, end_idx-1, end_idx-start_idx))
     total_num_new_reviews = 0
+    writer = CorpusWriter(pack_path_for(PATH_TO_CORPUS)) if packed else None
+    progress = Progress('build_corpus', total=end_idx-start_idx, every_sec=60, stall_sec=600)
+    stopped = False
     for i in range(start_idx, end_idx):
         school = sorted_schools[i]
         sid, num_profs, prof_pages = school2info[school]
@@ -312,19 +351,40 @@ def build_corpus(start_idx, num_schools_to_process):
             print('{}. {} -> no data on CS professors'.format(i, school))
         else:
             school_num_new_reviews = 0
-            for prof_name, prof_url in prof_pages:
-                fn = make_filename(prof_name, prof_url)
-                if fn not in current_corpus:
-                    try:
-                        num_reviews, processed_reviews = parse_professor_page(prof_url)
-                        if len(processed_reviews) > 0:
-                            gender = predict_gender_from_reviews(processed_reviews)
-                            write_reviews_to_file(fn, prof_name, school, prof_url, num_reviews, gender, processed_reviews)
-                            school_num_new_reviews += len(processed_reviews)
-                            total_num_new_reviews += len(processed_reviews)
-                    except:
-                        print('Warning: failed on Prof. {} (id:{})'.format(prof_name, extract_prof_id(prof_url)))
+            new_pages = [(prof_name, prof_url) for prof_name, prof_url in prof_pages
+                         if make_filename(prof_name, prof_url) not in current_corpus]
+            url_to_name = dict((prof_url, prof_name) for prof_name, prof_url in new_pages)
+            for prof_url, r in fetcher.fetch_all([prof_url for _, prof_url in new_pages], workers=workers,
+                                                 latency_name='http_rmp_professor'):
+                prof_name = url_to_name[prof_url]
+                if isinstance(r, CircuitOpenError):
+                    print('Stopping: {} keeps failing. Rerun with start_idx={}'.format(r.url, i))
+                    stopped = True
+                    break
+                if isinstance(r, FetchError):
+                    print('Warning: could not fetch Prof. {} (id:{}): {}'.format(prof_name, extract_prof_id(prof_url), r))
+                    progress.update(failed=1)
+                    continue
+                try:
+                    num_reviews, processed_reviews = parse_professor_content(r.content)
+                    if len(processed_reviews) > 0:
+                        gender = predict_gender_from_reviews(processed_reviews)
+                        fn = make_filename(prof_name, prof_url)
+                        write_reviews_to_file(fn, prof_name, school, prof_url, num_reviews, gender, processed_reviews, writer=writer)
+                        school_num_new_reviews += len(processed_reviews)
+                        total_num_new_reviews += len(processed_reviews)
+                        progress.update(profs=1, reviews=len(processed_reviews))
+                except Exception:
+                    print('Warning: failed on Prof. {} (id:{})'.format(prof_name, extract_prof_id(prof_url)))
+                    progress.update(failed=1)
             print('{}. {} -> num prof pages = {}, num new reviews = {}'.format(i, school, len(prof_pages), school_num_new_reviews))
+        if stopped:
+            break
+        progress.update(docs=1)
+    progress.finish()
+    report()
+    if writer is not None:
+        writer.close()
     print('\nFINISHED!')
     new_corpus = get_current_corpus()
     print('Num profs before: {}. Num profs now: {}.'.format(len(current_corpus), len(new_corpus)))
@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+from fetcher import CircuitOpenError, default_fetcher
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instrumentation import emit
+
+MAX_PROBE_FAILURES = 5  # failed probes of the last page before discovery gives up
+
+'''
+    This class is a set-backed store of discovered URLs that persists to an
+    append-only log (one URL per line), so discovery can be interrupted and resumed
+    without re-pickling the whole list. URLs keep the order they were first found in.
+'''
+class UrlStore:
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._urls = []
+        self._seen = set()
+        self._log = None
+        if log_path is not None:
+            if os.path.isfile(log_path):
+                with open(log_path, 'r') as f:
+                    for line in f:
+                        if line.endswith('\n'):  # skip a partially written last line
+                            self._add(line.rstrip('\n'))
+            self._log = open(log_path, 'a')
+
+    def _add(self, url):
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        self._urls.append(url)
+        return True
+
+    def add(self, url):
+        """
+        Adds a URL if it is new, and returns whether it was.
+        """
+        is_new = self._add(url)
+        if is_new and self._log is not None:
+            self._log.write(url + '\n')
+        return is_new
+
+    def flush(self):
+        if self._log is not None:
+            self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def urls(self):
+        return list(self._urls)
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __contains__(self, url):
+        return url in self._seen
+
+_FAILED = object()
+
+def fetch_content(url):
+    """
+    Fetches a listing page through the shared fetcher, which retries and throttles per
+    host; a page that still fails raises, so it is recorded as failed instead of being
+    taken for the end of the listing.
+    """
+    return default_fetcher().fetch(url, latency_name='http_listing').content
+
+'''
+    This class discovers article URLs from a site's numbered listing pages. It finds
+    the last listing page by exponential probing followed by binary search, fetches
+    page ranges concurrently, and adds the links to a UrlStore in page order (so the
+    URL list is the same as a sequential crawl would give). page_url maps a page
+    number to its URL, and parse_links maps a page's content to its article URLs, or
+    to None if it is not a listing page (i.e., it is past the last page). fetch can
+    be replaced, e.g. to go through a rate-limited scheduler or a local mock server.
+'''
+class DiscoveryEngine:
+    def __init__(self, page_url, parse_links, store, workers=8, fetch=fetch_content):
+        self.page_url = page_url
+        self.parse_links = parse_links
+        self.store = store
+        self.workers = workers
+        self.fetch = fetch
+        self.failed_pages = set()
+        self.failed_probes = set()
+
+    def fetch_links(self, page_num):
+        """
+        Returns the article URLs on a listing page, or None if it is past the last page.
+        """
+        return self.parse_links(self.fetch(self.page_url(page_num)))
+
+    def _fetch_links_or_fail(self, page_num):
+        try:
+            return self.fetch_links(page_num)
+        except Exception as e:
+            emit('discovery_error', page=page_num, error=repr(e))
+            return _FAILED
+
+    def _has_links(self, page_num):
+        """
+        Returns whether a listing page has links. A probe that fails (after the
+        fetcher's retries) is recorded in failed_probes and taken to have links, so the
+        search goes on past it; discover fetches that page again, and stops at the
+        first page without links. An open circuit, or MAX_PROBE_FAILURES failed
+        probes, stops the search by raising.
+        """
+        try:
+            return self.fetch_links(page_num) is not None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            emit('discovery_error', page=page_num, error=repr(e), probe=True)
+            self.failed_probes.add(page_num)
+            if len(self.failed_probes) >= MAX_PROBE_FAILURES:
+                raise
+            return True
+
+    def find_last_page(self, first_page=1, max_page=None):
+        """
+        Returns the last listing page with links (or first_page - 1 if there is none),
+        with O(log n) fetches: double the page number until a page is empty, then
+        binary search between the last full page and that empty page.
+        """
+        if not self._has_links(first_page):
+            return first_page - 1
+        low = first_page
+        step = 1
+        high = None
+        while high is None:
+            probe = low + step
+            if max_page is not None and probe > max_page:
+                if self._has_links(max_page):
+                    return max_page
+                high = max_page
+            elif self._has_links(probe):
+                low = probe
+                step *= 2
+            else:
+                high = probe
+        while high - low > 1:  # low has links, high does not
+            mid = (low + high) // 2
+            if self._has_links(mid):
+                low = mid
+            else:
+                high = mid
+        emit('discovery_last_page', last_page=low)
+        return low
+
+    def discover(self, first_page=1, last_page=None, max_urls=None, batch_pages=None):
+        """
+        Fetches the listing pages from first_page to last_page (found by probing if
+        not given) concurrently, in batches of batch_pages, and adds their links to
+        the store. Stops after the batch in which the store reaches max_urls. Returns
+        the number of new URLs.
+        """
+        if last_page is None:
+            last_page = self.find_last_page(first_page)
+        batch_pages = batch_pages or self.workers * 4
+        num_new = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch_start in range(first_page, last_page + 1, batch_pages):
+                pages = list(range(batch_start, min(batch_start + batch_pages, last_page + 1)))
+                reached_end = False
+                for page_num, links in zip(pages, executor.map(self._fetch_links_or_fail, pages)):  # in page order
+                    if links is _FAILED:
+                        self.failed_pages.add(page_num)
+                        continue
+                    if links is None:
+                        reached_end = True
+                        break
+                    for link in links:
+                        num_new += self.store.add(link)
+                self.store.flush()
+                print('Pages {}-{}: {} urls in total'.format(pages[0], pages[-1], len(self.store)))
+                if reached_end or (max_urls is not None and len(self.store) >= max_urls):
+                    break
+        if len(self.failed_pages) > 0:
+            print('Failed on {} pages: {}'.format(len(self.failed_pages), sorted(self.failed_pages)[:20]))
+        return num_new
@@ -1,8 +1,71 @@
+from corpus_store import CorpusReader, pack_exists, pack_path_for
+from instrumentation import get_meter, timed
+from metadata_table import build_celeb_table, build_review_table
+import io
 import os
 
 PROF_PATH = '../data/professor/'  # relative path to the professor data folder
 CELEB_PATH = '../data/celeb/'  # relative path of the celeb data folder
 
+def iter_corpus_files(txt_dir):
+    """
+    Yields <filename, lines> for every document in a corpus folder. If the folder has
+    been packed (see corpus_store), the packed documents are read in one sequential
+    pass; then each .txt file in the folder that is not in the packed corpus (e.g.
+    crawled after the folder was packed) is opened in turn.
+    """
+    pack_path = pack_path_for(txt_dir)
+    packed_ids = set()
+    if pack_exists(pack_path):
+        for record_id, content in CorpusReader(pack_path):
+            packed_ids.add(record_id)
+            yield record_id + '.txt', io.StringIO(content).readlines()  # same split as reading the file
+    if os.path.isdir(txt_dir):
+        for fn in os.listdir(txt_dir):
+            if fn.endswith('.txt') and fn[:-len('.txt')] not in packed_ids:
+                with open(txt_dir + fn, 'r') as f:
+                    yield fn, f.readlines()
+
+def parse_celeb_lines(lines):
+    """
+    Parses the lines of one celeb article file into a dictionary of its title,
+    author(s), timestamp, URL, tag(s), predicted gender label, and text.
+    """
+    LINE_KEY = {'title':0, 'author':1, 'ts':2, 'url':3, 'tags':5, 'label':6, 'text':8}
+    parsed = {}
+    for key,line_num in LINE_KEY.items():
+        if line_num < len(lines):
+            val = lines[line_num].strip()
+            if key == 'tags':
+                val = val.strip('TAGS: ').split(',')
+            elif key == 'label':
+                val = int(val.strip('LABEL: '))
+        else:
+            val = None
+        parsed[key] = val
+    return parsed
+
+def parse_prof_lines(lines):
+    """
+    Parses the lines of one professor file into a dictionary of the professor's
+    metadata, predicted gender, and <rating, tags, text> reviews.
+    """
+    name = lines[0].strip()
+    school = lines[1].lstrip('School:').strip()
+    url = lines[2].lstrip('URL:').strip()
+    num_reviews = int(lines[3].lstrip('Num reviews:').strip())
+    metadata = {'name':name, 'school':school, 'url':url, 'num_reviews':num_reviews}
+    gender = lines[4].strip().lstrip('Gender: ')
+    i = 6  # index of first review
+    reviews = []
+    while i+3 < len(lines) and lines[i].startswith('Review #'):  # traverse through info
+        rating = lines[i+1].lstrip('Rating:').strip()
+        tags = lines[i+2].lstrip('Tags:').strip()
+        text = lines[i+3].lstrip('Text: ').strip()
+        reviews.append((rating, tags, text))
+        i += 5
+    return {'reviews':reviews, 'metadata':metadata, 'gender':gender}
+
 '''
     This class parses the text files in the celebrity dataset (all three subfolders:
     eonline, people, and usweekly). During parsing, the celeb articles are divided into
@@ -24,43 +87,39 @@ class CelebDataLoader:
         self._load_data(self.path_to_corpus + 'usweekly/', min_samples)
 
     def _load_data(self, txt_dir, min_samples):
-        all_files = os.listdir(txt_dir)
-        for fn in all_files:
-            if fn.endswith('.txt'):
-                path_to_file = txt_dir + fn
-                try:
-                    parsed = self._parse_file(path_to_file)
-                    article_id = fn.strip('.txt')
-                    parsed['id'] = article_id
-                    if parsed['label'] == 1:
-                        self.female_corpus[article_id] = parsed
-                    elif parsed['label'] == 0:
-                        self.male_corpus[article_id] = parsed
-                    else:
-                        self.unk_corpus[article_id] = parsed
-                    if min_samples is not None and len(self.female_corpus) >= min_samples and len(self.male_corpus) >= min_samples:
-                        break
-                except:
-                    if self.verbose:
-                        print('Failed on', fn)
+        with timed('load_celeb', path=txt_dir):
+            self._load_files(txt_dir, min_samples)
         print('After parsing {} -> {} female, {} male, {} unk'.format(txt_dir, len(self.female_corpus), len(self.male_corpus), len(self.unk_corpus)))
 
+    def _load_files(self, txt_dir, min_samples):
+        meter = get_meter('load_celeb')
+        site = os.path.basename(txt_dir.rstrip('/'))
+        for fn, lines in iter_corpus_files(txt_dir):
+            try:
+                parsed = self._parse_lines(lines)
+                meter.add(docs=1)
+                article_id = fn.strip('.txt')
+                parsed['id'] = article_id
+                parsed['site'] = site
+                if parsed['label'] == 1:
+                    self.female_corpus[article_id] = parsed
+                elif parsed['label'] == 0:
+                    self.male_corpus[article_id] = parsed
+                else:
+                    self.unk_corpus[article_id] = parsed
+                if min_samples is not None and len(self.female_corpus) >= min_samples and len(self.male_corpus) >= min_samples:
+                    break
+            except:
+                meter.add(failed=1)
+                if self.verbose:
+                    print('Failed on', fn)
+
     def _parse_file(self, path_to_file):
-        LINE_KEY = {'title':0, 'author':1, 'ts':2, 'url':3, 'tags':5, 'label':6, 'text':8}
-        parsed = {}
         with open(path_to_file, 'r') as f:
-            lines = f.readlines()
-            for key,line_num in LINE_KEY.items():
-                if line_num < len(lines):
-                    val = lines[line_num].strip()
-                    if key == 'tags':
-                        val = val.strip('TAGS: ').split(',')
-                    elif key == 'label':
-                        val = int(val.strip('LABEL: '))
-                else:
-                    val = None
-                parsed[key] = val
-        return parsed
+            return self._parse_lines(f.readlines())
+
+    def _parse_lines(self, lines):
+        return parse_celeb_lines(lines)
 
     def get_female_ids(self):
         return sorted(self.female_corpus.keys())
@@ -76,6 +135,16 @@ class CelebDataLoader:
         mids = self.get_male_ids()
         return [self.male_corpus[mid] for mid in mids]
 
+    def to_table(self, include_unk=True):
+        """
+        Returns a columnar CorpusTable over the loaded articles (see metadata_table),
+        e.g. table.where(site='people', tags=['Taylor Swift'], ts=('2018-01-01', None)).
+        """
+        entries = self.get_female_entries() + self.get_male_entries()
+        if include_unk:
+            entries += [self.unk_corpus[uid] for uid in sorted(self.unk_corpus.keys())]
+        return build_celeb_table(entries)
+
 '''
     This class parses the text files in the professor dataset. During parsing, the
     professor reviews are divided into those that are labeled as female, as male, and
@@ -96,48 +165,39 @@ class ProfDataLoader:
         self.female_corpus = {}
         self.male_corpus = {}
         self.unk_corpus = {}
-        all_files = os.listdir(self.path_to_corpus)
+        with timed('load_prof', path=self.path_to_corpus):
+            self._load_files(min_samples)
+
+    def _load_files(self, min_samples):
+        meter = get_meter('load_prof')
         num_text_files = 0
         num_male_reviews = 0
         num_female_reviews = 0
-        for fn in all_files:
-            if fn.endswith('.txt'):
-                num_text_files += 1
-                path_to_file = self.path_to_corpus + fn
-                parsed = self._parse_file(path_to_file)
-                teacher_id = fn.rstrip('.txt')
-                parsed['id'] = teacher_id
-                num_reviews = len(parsed['reviews'])
-                if parsed['gender'] == 'F':
-                    self.female_corpus[teacher_id] = parsed
-                    num_female_reviews += num_reviews
-                elif parsed['gender'] == 'M':
-                    self.male_corpus[teacher_id] = parsed
-                    num_male_reviews += num_reviews
-                else:
-                    self.unk_corpus[teacher_id] = parsed
-                if min_samples and len(self.female_corpus) >= min_samples and len(self.male_corpus) >= min_samples:
-                    break
+        for fn, lines in iter_corpus_files(self.path_to_corpus):
+            num_text_files += 1
+            parsed = self._parse_lines(lines)
+            teacher_id = fn.rstrip('.txt')
+            parsed['id'] = teacher_id
+            num_reviews = len(parsed['reviews'])
+            meter.add(docs=1, reviews=num_reviews)
+            if parsed['gender'] == 'F':
+                self.female_corpus[teacher_id] = parsed
+                num_female_reviews += num_reviews
+            elif parsed['gender'] == 'M':
+                self.male_corpus[teacher_id] = parsed
+                num_male_reviews += num_reviews
+            else:
+                self.unk_corpus[teacher_id] = parsed
+            if min_samples and len(self.female_corpus) >= min_samples and len(self.male_corpus) >= min_samples:
+                break
         print('Finished parsing RMP corpus. {} files in total -> M: {} files, {} reviews, F: {} files, {} reviews'.format(num_text_files, len(self.male_corpus), num_male_reviews, len(self.female_corpus), num_female_reviews))
 
     def _parse_file(self, path_to_file):
         with open(path_to_file, 'r') as f:
-            lines = f.readlines()
-            name = lines[0].strip()
-            school = lines[1].lstrip('School:').strip()
-            url = lines[2].lstrip('URL:').strip()
-            num_reviews = int(lines[3].lstrip('Num reviews:').strip())
-            metadata = {'name':name, 'school':school, 'url':url, 'num_reviews':num_reviews}
-            gender = lines[4].strip().lstrip('Gender: ')
-            i = 6  # index of first review
-            reviews = []
-            while i+3 < len(lines) and lines[i].startswith('Review #'):  # traverse through info
-                rating = lines[i+1].lstrip('Rating:').strip()
-                tags = lines[i+2].lstrip('Tags:').strip()
-                text = lines[i+3].lstrip('Text: ').strip()
-                reviews.append((rating, tags, text))
-                i += 5
-            return {'reviews':reviews, 'metadata':metadata, 'gender':gender}
+            return self._parse_lines(f.readlines())
+
+    def _parse_lines(self, lines):
+        return parse_prof_lines(lines)
 
     def get_female_ids(self):
         return sorted(self.female_corpus.keys())
@@ -167,6 +227,16 @@ class ProfDataLoader:
                 reviews.append(text)
         return reviews
 
+    def to_table(self, include_unk=True):
+        """
+        Returns a columnar CorpusTable with one row per review (see metadata_table),
+        e.g. table.where(school='Columbia University', gender='F', rating=(4, None)).
+        """
+        entries = self.get_female_entries() + self.get_male_entries()
+        if include_unk:
+            entries += [self.unk_corpus[uid] for uid in sorted(self.unk_corpus.keys())]
+        return build_review_table(entries)
+
     def get_unk_reviews(self):
         reviews = []
         for entry in self.unk_corpus.values():
@@ -0,0 +1,171 @@
+from multiprocessing import Pool
+import numpy as np
+import os
+import pickle
+import zlib
+
+NUM_PERM = 128  # number of hash functions per MinHash signature
+SHINGLE_SIZE = 5  # number of words per shingle
+MIN_DEDUP_WORDS = 10  # shorter texts (e.g. "Great professor!") are too common to be near-duplicates by copying
+
+def make_hash_params(num_perm=NUM_PERM, seed=1):
+    """
+    Returns the multipliers (odd) and offsets of num_perm multiply-shift hash
+    functions over 32-bit values.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    """
+    Returns the distinct 32-bit hashes of the text's lowercased word shingles.
+    """
+    words = text.lower().split()
+    if len(words) < shingle_size:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[i:i+shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    return np.unique(np.array([zlib.crc32(s.encode('utf-8')) for s in shingles], dtype=np.uint64))
+
+def minhash_signature(text, a, b, shingle_size=SHINGLE_SIZE):
+    """
+    Returns the MinHash signature of a text: for each hash function, the smallest
+    hash over the text's shingles.
+    """
+    hashes = shingle_hashes(text, shingle_size)
+    # multiply-shift hashing: the uint64 products wrap around on purpose
+    with np.errstate(over='ignore'):
+        permuted = (np.outer(hashes, a) + b) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+def _signatures_for_chunk(args):
+    texts, num_perm, seed, shingle_size = args
+    a, b = make_hash_params(num_perm, seed)
+    return np.array([minhash_signature(t, a, b, shingle_size) for t in texts], dtype=np.uint32).reshape(-1, num_perm)
+
+def compute_signatures(texts, num_perm=NUM_PERM, seed=1, shingle_size=SHINGLE_SIZE, processes=1, chunk_size=1000):
+    """
+    Returns an array with the MinHash signature of each text, computed in parallel
+    over chunks of texts if processes > 1.
+    """
+    chunks = [(texts[i:i+chunk_size], num_perm, seed, shingle_size) for i in range(0, len(texts), chunk_size)]
+    if len(chunks) == 0:
+        return np.zeros((0, num_perm), dtype=np.uint32)
+    if processes > 1:
+        with Pool(processes) as pool:
+            results = pool.map(_signatures_for_chunk, chunks)
+    else:
+        results = [_signatures_for_chunk(c) for c in chunks]
+    return np.concatenate(results)
+
+def choose_bands(num_perm, threshold):
+    """
+    Returns the number of bands (and rows per band) whose LSH threshold,
+    (1/bands)^(1/rows), is closest to the desired Jaccard threshold.
+    """
+    best = None
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands == 0:
+            rows = num_perm // bands
+            err = abs((1 / bands) ** (1 / rows) - threshold)
+            if best is None or err < best[0]:
+                best = (err, bands, rows)
+    return best[1], best[2]
+
+'''
+    This class is a MinHash LSH index over documents. Each signature is cut into
+    bands, and documents whose signatures agree on every row of some band land in
+    the same bucket and become candidate duplicates; candidates are then verified
+    by their estimated Jaccard similarity (the fraction of equal signature entries).
+    This finds near-duplicates without comparing every pair. The index can be saved,
+    loaded, and updated with new documents incrementally.
+'''
+class MinHashLSHIndex:
+    def __init__(self, threshold=0.8, num_perm=NUM_PERM, seed=1, shingle_size=SHINGLE_SIZE):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.seed = seed
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.signatures
+
+    def _band_keys(self, signature):
+        return [signature[i*self.rows:(i+1)*self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, doc_id, signature):
+        self.signatures[doc_id] = signature
+        for band, key in zip(self.buckets, self._band_keys(signature)):
+            band.setdefault(key, []).append(doc_id)
+
+    def query(self, signature):
+        """
+        Returns the <doc_id, estimated_jaccard> of the indexed documents that are
+        near-duplicates of this signature, most similar first.
+        """
+        candidates = set()
+        for band, key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(band.get(key, []))
+        matches = []
+        for doc_id in candidates:
+            sim = float(np.mean(self.signatures[doc_id] == signature))
+            if sim >= self.threshold:
+                matches.append((doc_id, sim))
+        return sorted(matches, key=lambda x:-x[1])
+
+    def save(self, path):
+        pickle.dump(self, open(path, 'wb'), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        return pickle.load(open(path, 'rb'))
+
+def load_or_create_index(path, threshold=0.8):
+    if path is not None and os.path.isfile(path):
+        return MinHashLSHIndex.load(path)
+    return MinHashLSHIndex(threshold=threshold)
+
+def dedup_texts(text_ids, texts, index=None, threshold=0.8, processes=1, action='drop', min_words=MIN_DEDUP_WORDS):
+    """
+    Finds the texts that are near-duplicates of an earlier text (in this list or
+    already in the index), and adds the rest to the index. Texts of fewer than
+    min_words words are always kept and never indexed, since independent short texts
+    are often identical. If action is 'drop', returns the kept ids and texts; if
+    'flag', returns all of them. Either way, also returns a dictionary of each
+    duplicate's id to the id of the text it duplicates.
+    """
+    assert(action in {'drop', 'flag'})
+    if index is None:
+        index = MinHashLSHIndex(threshold=threshold)
+    signatures = compute_signatures(texts, num_perm=index.num_perm, seed=index.seed,
+                                    shingle_size=index.shingle_size, processes=processes)
+    kept_ids = []
+    kept_texts = []
+    duplicates = {}
+    num_short = 0
+    for tid, text, signature in zip(text_ids, texts, signatures):
+        if len(text.split()) < min_words:
+            num_short += 1
+            kept_ids.append(tid)
+            kept_texts.append(text)
+            continue
+        matches = [m for m in index.query(signature) if m[0] != tid]
+        if len(matches) > 0:
+            duplicates[tid] = matches[0][0]
+            if action == 'drop':
+                continue
+        elif tid not in index:
+            index.add(tid, signature)
+        kept_ids.append(tid)
+        kept_texts.append(text)
+    print('Dedup: {} of {} texts are near-duplicates, {} too short to check (index has {} texts)'.format(
+        len(duplicates), len(texts), num_short, len(index)))
+    return kept_ids, kept_texts, duplicates
@@ -0,0 +1,222 @@
+from collections import Counter
+import heapq
+import itertools
+from instrumentation import Progress, emit, timed
+import os
+import pickle
+import shutil
+import tempfile
+
+MEMORY_MB = 4096  # default memory budget of one counter's in-memory table
+BYTES_PER_ENTRY = 250  # rough size of one <lemma>,<pos> entry in a Counter, with its strings
+MAX_FAN_IN = 64  # most runs merged at once; more are first merged into intermediate runs
+RUN_CHUNK_SIZE = 10000  # <key, count> pairs pickled together in a run file
+
+def iter_pickled_chunks(path):
+    """
+    Yields the objects pickled one after the other in a file. A token shard is a file
+    of pickled lists of <text_id, toks>, so it can be appended to chunk by chunk and
+    read back without loading the whole shard.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+def append_token_shard(path, toks_per_text_w_id):
+    with open(path, 'ab') as f:
+        pickle.dump(toks_per_text_w_id, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def iter_toks_per_text(shard_paths, max_texts=None):
+    """
+    Yields the tokens of each text in the shards, in order, stopping after max_texts.
+    """
+    num_texts = 0
+    for path in shard_paths:
+        for chunk in iter_pickled_chunks(path):
+            for text_id, toks in chunk:
+                if max_texts is not None and num_texts >= max_texts:
+                    return
+                yield toks
+                num_texts += 1
+
+def count_texts(shard_paths):
+    return sum(len(chunk) for path in shard_paths for chunk in iter_pickled_chunks(path))
+
+'''
+    This class counts keys with a bounded in-memory table. When the table exceeds
+    max_entries, it is spilled to disk as a run sorted by key (pickled chunks of <key,
+    count> pairs, so that lemmas may hold any characters, e.g. the whitespace lemmas
+    that spaCy emits) and cleared. Iterating over the counter merges the runs and the
+    in-memory table with a k-way heap merge, summing the counts of equal keys, and
+    yields <key, count> without ever holding all keys in memory. Keys are <lemma>,<pos>
+    tuples.
+'''
+class ExternalCounter:
+    def __init__(self, max_entries=None, memory_mb=MEMORY_MB, spill_dir=None, name='counts'):
+        self.max_entries = max_entries or (memory_mb * 2**20) // BYTES_PER_ENTRY
+        self.name = name
+        self._own_dir = spill_dir is None
+        self.spill_dir = tempfile.mkdtemp(prefix='spill_') if spill_dir is None else spill_dir
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.table = Counter()
+        self.runs = []
+        self._num_runs = 0
+        self.total = 0
+
+    def update(self, keys):
+        for key in keys:
+            self.table[key] += 1
+            self.total += 1
+        if len(self.table) > self.max_entries:
+            self.spill()
+
+    def spill(self):
+        if len(self.table) == 0:
+            return
+        path = self._next_run_path()
+        self._write_run(path, sorted(self.table.items()))
+        emit('spill', name=self.name, run=len(self.runs), entries=len(self.table))
+        self.runs.append(path)
+        self.table = Counter()
+
+    def _next_run_path(self):
+        self._num_runs += 1
+        return os.path.join(self.spill_dir, '{}_run{}.pkl'.format(self.name, self._num_runs))
+
+    def _write_run(self, path, items):
+        items = iter(items)
+        with open(path, 'wb') as f:
+            while True:
+                chunk = list(itertools.islice(items, RUN_CHUNK_SIZE))
+                if len(chunk) == 0:
+                    break
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _read_run(path):
+        for chunk in iter_pickled_chunks(path):
+            yield from chunk
+
+    def _merge(self, iters):
+        """
+        Merges sorted <key, count> iterators, summing the counts of equal keys.
+        """
+        last_key = None
+        last_count = 0
+        for key, count in heapq.merge(*iters, key=lambda x:x[0]):
+            if key == last_key:
+                last_count += count
+            else:
+                if last_key is not None:
+                    yield last_key, last_count
+                last_key, last_count = key, count
+        if last_key is not None:
+            yield last_key, last_count
+
+    def _reduce_runs(self):
+        # merge runs in groups until few enough are left to open at once
+        while len(self.runs) > MAX_FAN_IN:
+            group, self.runs = self.runs[:MAX_FAN_IN], self.runs[MAX_FAN_IN:]
+            path = self._next_run_path()
+            self._write_run(path, self._merge([self._read_run(p) for p in group]))
+            for p in group:
+                os.remove(p)
+            self.runs.append(path)
+
+    def items(self):
+        """
+        Yields <key, count> for every key, in key order, which is the order runs are
+        merged in.
+        """
+        self._reduce_runs()
+        in_memory = sorted(self.table.items())
+        return self._merge([self._read_run(p) for p in self.runs] + [iter(in_memory)])
+
+    def close(self):
+        self.table = Counter()
+        if self._own_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        else:
+            for path in self.runs:
+                if os.path.isfile(path):
+                    os.remove(path)
+        self.runs = []
+
+def count_lemma_pos_external(toks_per_text, counter):
+    """
+    Counts the <lemma>,<pos> tuples of a stream of token lists into an ExternalCounter.
+    """
+    progress = Progress('external_count_' + counter.name, every_sec=60)
+    for toks in toks_per_text:
+        counter.update((lemma, pos) for word, lemma, pos in toks)
+        progress.update(docs=1, toks=len(toks))
+    progress.finish()
+    return counter
+
+def merge_gendered_counts(f_counter, m_counter, min_count=1):
+    """
+    Merges two ExternalCounters in key order, and returns the female and male Counters
+    of the words with at least min_count occurrences in total, plus the total number of
+    female and male tokens. Words below min_count can never be scored, so pruning them
+    while merging keeps the result small; pass the totals to beta_scoring_from_counts
+    so that the scores are the same as with unpruned counts.
+    """
+    fcounts = Counter()
+    mcounts = Counter()
+    f_items = ((key, count, 0) for key, count in f_counter.items())
+    m_items = ((key, 0, count) for key, count in m_counter.items())
+    for key, group in itertools.groupby(heapq.merge(f_items, m_items, key=lambda x:x[0]), key=lambda x:x[0]):
+        group = list(group)
+        f_count = sum(x[1] for x in group)
+        m_count = sum(x[2] for x in group)
+        if f_count + m_count >= min_count:
+            if f_count > 0:
+                fcounts[key] = f_count
+            if m_count > 0:
+                mcounts[key] = m_count
+    return fcounts, mcounts, (f_counter.total, m_counter.total)
+
+def get_external_tok_counts(f_shard_paths, m_shard_paths, balance=True, min_count=1, memory_mb=MEMORY_MB, spill_dir=None):
+    """
+    Counts the <lemma>,<pos> tuples of female and male token shards out of core. If
+    balance is True, the larger group is truncated to the number of texts of the
+    smaller one (as score_words does without a seed), which needs one extra pass to
+    count the texts. Returns fcounts, mcounts, and the <female, male> token totals.
+    """
+    max_texts = None
+    if balance:
+        num_f, num_m = count_texts(f_shard_paths), count_texts(m_shard_paths)
+        max_texts = min(num_f, num_m)
+        print('Original lengths:', num_f, num_m)
+        print('Balanced lengths:', max_texts, max_texts)
+    counters = []
+    with timed('external_count', memory_mb=memory_mb):
+        try:
+            for name, paths in [('f', f_shard_paths), ('m', m_shard_paths)]:
+                counter = ExternalCounter(memory_mb=memory_mb, spill_dir=spill_dir, name=name)
+                counters.append(counter)
+                count_lemma_pos_external(iter_toks_per_text(paths, max_texts=max_texts), counter)
+                counter.spill()  # free the table before counting the other group
+            fcounts, mcounts, totals = merge_gendered_counts(counters[0], counters[1], min_count=min_count)
+        finally:
+            for counter in counters:
+                counter.close()
+    print('Counted {} female and {} male tokens; kept {} and {} words'.format(totals[0], totals[1], len(fcounts), len(mcounts)))
+    return fcounts, mcounts, totals
+
+if __name__ == '__main__':
+    import sys
+    from score_words import beta_scoring_from_counts, filter_associations_on_lemma_and_pos, filter_associations_on_p, \
+        print_top_n_per_pos
+    # usage: python external_count.py <f_shard> [<f_shard> ...] -- <m_shard> [<m_shard> ...]
+    split = sys.argv.index('--')
+    fcounts, mcounts, totals = get_external_tok_counts(sys.argv[1:split], sys.argv[split+1:], min_count=5)
+    f_ass, m_ass = beta_scoring_from_counts(fcounts, mcounts, sort=False, totals=totals)
+    f_ass = filter_associations_on_lemma_and_pos(f_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
+    m_ass = filter_associations_on_lemma_and_pos(m_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
+    alpha = 0.05 / max(len(f_ass) + len(m_ass), 1)  # Bonferroni correction
+    print('Adjusted alpha:', round(alpha, 10))
+    print_top_n_per_pos(filter_associations_on_p(f_ass, alpha), filter_associations_on_p(m_ass, alpha), top_n=100)
@@ -0,0 +1,240 @@
+import cProfile
+from contextlib import contextmanager
+import json
+import math
+import sys
+import threading
+import time
+import tracemalloc
+
+'''
+    Shared instrumentation for the data loaders, preprocessing, scoring, and the
+    create_datasets crawlers. Every measurement is emitted as one JSON object per
+    line (to stderr by default, or to a log file set with configure), so that long
+    runs can be followed live and analyzed afterwards. Counters and histograms are
+    kept in a registry so that a run can end with a summary of all of them.
+'''
+
+_config = {'stream':sys.stderr, 'enabled':True}
+_lock = threading.Lock()
+_registry = {}
+
+def configure(log_path=None, stream=None, enabled=True):
+    """
+    Sets where the JSON events go. If log_path is given, events are appended to
+    that file; otherwise they go to stream (stderr by default).
+    """
+    if log_path is not None:
+        stream = open(log_path, 'a')
+    _config['stream'] = stream if stream is not None else sys.stderr
+    _config['enabled'] = enabled
+
+def emit(event, **fields):
+    """
+    Writes one structured event as a JSON line.
+    """
+    if not _config['enabled']:
+        return
+    record = {'ts':round(time.time(), 3), 'event':event}
+    record.update(fields)
+    line = json.dumps(record, default=str)
+    with _lock:
+        _config['stream'].write(line + '\n')
+        _config['stream'].flush()
+
+'''
+    This class counts items of several kinds (e.g., docs, sents, toks) and reports
+    their totals and per-second rates since it was created.
+'''
+class Meter:
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, n in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + n
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def rates(self):
+        elapsed = self.elapsed()
+        return {'{}_per_sec'.format(key):(n / elapsed if elapsed > 0 else None) for key, n in self.counts.items()}
+
+    def snapshot(self):
+        snap = {'name':self.name, 'elapsed_sec':round(self.elapsed(), 3)}
+        snap.update(self.counts)
+        snap.update({key:round(rate, 2) for key, rate in self.rates().items() if rate is not None})
+        return snap
+
+'''
+    This class records a distribution of values (e.g., HTTP latencies in seconds) in
+    log-spaced buckets, and reports its count, mean, max, and approximate quantiles.
+'''
+class Histogram:
+    def __init__(self, name, min_value=1e-3, max_value=1e3, buckets_per_decade=10):
+        self.name = name
+        self.min_value = min_value
+        self.buckets_per_decade = buckets_per_decade
+        self.num_buckets = int(math.ceil(math.log10(max_value / min_value) * buckets_per_decade)) + 2
+        self.bucket_counts = [0] * self.num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _bucket(self, value):
+        if value < self.min_value:
+            return 0
+        b = int(math.log10(value / self.min_value) * self.buckets_per_decade) + 1
+        return min(b, self.num_buckets - 1)
+
+    def _bucket_upper(self, b):
+        return self.min_value * 10 ** (b / self.buckets_per_decade)
+
+    def observe(self, value):
+        with self._lock:
+            self.bucket_counts[self._bucket(value)] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for b, n in enumerate(self.bucket_counts):
+            seen += n
+            if seen >= rank:
+                return min(self._bucket_upper(b), self.max)
+        return self.max
+
+    def snapshot(self):
+        snap = {'name':self.name, 'count':self.count}
+        if self.count > 0:
+            snap.update({'mean':self.total / self.count, 'max':self.max, 'p50':self.quantile(0.5),
+                         'p90':self.quantile(0.9), 'p99':self.quantile(0.99)})
+        return snap
+
+def get_meter(name):
+    """
+    Returns the registered meter with this name, creating it if needed.
+    """
+    with _lock:
+        if name not in _registry:
+            _registry[name] = Meter(name)
+        return _registry[name]
+
+def get_histogram(name, min_value=1e-3):
+    """
+    Returns the registered histogram with this name, creating it if needed with the
+    given floor (values below it all fall in the first bucket).
+    """
+    with _lock:
+        if name not in _registry:
+            _registry[name] = Histogram(name, min_value=min_value)
+        return _registry[name]
+
+def report():
+    """
+    Emits a summary of every registered meter and histogram.
+    """
+    with _lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        emit('summary', **metric.snapshot())
+
+'''
+    This class reports the progress of a stage. Callers update it as items are
+    processed; it emits a progress event with totals and rates at most every
+    every_sec seconds. If stall_sec is given, a background watchdog emits a stall
+    event whenever no update has arrived for that long.
+'''
+class Progress:
+    def __init__(self, stage, total=None, every_sec=30, stall_sec=None):
+        self.stage = stage
+        self.total = total
+        self.every_sec = every_sec
+        self.meter = Meter(stage)
+        self._last_emit = time.perf_counter()
+        self._last_update = time.perf_counter()
+        self._done = threading.Event()
+        if stall_sec is not None:
+            self._watchdog = threading.Thread(target=self._watch, args=(stall_sec,), daemon=True)
+            self._watchdog.start()
+
+    def update(self, **counts):
+        self.meter.add(**counts)
+        now = time.perf_counter()
+        self._last_update = now
+        if now - self._last_emit >= self.every_sec:
+            self._last_emit = now
+            self._emit('progress')
+
+    def finish(self):
+        self._done.set()
+        self._emit('done')
+
+    def _emit(self, event):
+        snap = self.meter.snapshot()
+        snap['stage'] = snap.pop('name')
+        if self.total is not None and 'docs' in self.meter.counts:
+            done = self.meter.counts['docs']
+            rate = snap.get('docs_per_sec')
+            snap['total'] = self.total
+            if rate:
+                snap['eta_sec'] = round((self.total - done) / rate, 1)
+        emit(event, **snap)
+
+    def _watch(self, stall_sec):
+        while not self._done.wait(stall_sec / 2):
+            idle = time.perf_counter() - self._last_update
+            if idle >= stall_sec:
+                emit('stall', stage=self.stage, idle_sec=round(idle, 1), **self.meter.counts)
+
+@contextmanager
+def timed(stage, profile_path=None, trace_memory=False, **fields):
+    """
+    Times a block and emits its wall and CPU time. If profile_path is given, the block
+    is run under cProfile and the stats are dumped there; if trace_memory is True, the
+    peak of Python allocations during the block is reported too.
+    """
+    profiler = None
+    if profile_path is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if trace_memory:
+        tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    emit('stage_start', stage=stage, **fields)
+    try:
+        yield
+    finally:
+        result = {'stage':stage, 'wall_sec':round(time.perf_counter() - wall, 3),
+                  'cpu_sec':round(time.process_time() - cpu, 3)}
+        if trace_memory:
+            result['peak_alloc_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.stop()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            result['profile_path'] = profile_path
+        result.update(fields)
+        emit('stage_end', **result)
+
+@contextmanager
+def observe_latency(name, min_value=1e-3):
+    """
+    Records how long a block takes (e.g., one HTTP request) in the named histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_histogram(name, min_value=min_value).observe(time.perf_counter() - start)
@@ -0,0 +1,250 @@
+"""
+Compiles the associations that score_words pickles (lex.pkl) into a lookup table,
+and applies it to new documents at scale.
+
+    python lexicon.py compile --lex prof_processed/lex.pkl --out prof_processed/lexicon.npz
+    python lexicon.py score --lexicon prof_processed/lexicon.npz --input reviews.txt --out scores.tsv --processes 8
+
+Input documents are either a text file with one document per line (optionally
+<doc_id>\\t<text>), or, with --pretokenized, a pickled list of <doc_id, toks> such as
+the f_toks_per_review.pkl that preprocessing writes.
+"""
+import argparse
+from artifacts import load_processed
+from instrumentation import Progress, timed
+from multiprocessing import Pool
+import numpy as np
+import os
+
+WEIGHTINGS = {'logp', 'binary'}
+MAX_LOGP = 300.0  # p-values that underflow to 0 are capped at this -log10(p)
+KEY_SEP = '\t'
+SCORE_COLUMNS = ['num_toks', 'num_matched', 'f_score', 'm_score', 'intensity', 'polarity']
+
+'''
+    This class is a compiled lexicon: a hash table from <lemma>,<pos> to a row in two
+    weight arrays, one for female-associated and one for male-associated words.
+    Documents are scored in batches: every token of the batch is encoded to its row
+    (or to the last row, which has zero weights, if it is not in the lexicon), and
+    the weights are then gathered and summed per document with vectorized NumPy
+    operations. A document's scores are:
+        - f_score, m_score: the summed weights of its female/male-associated tokens
+        - intensity: (f_score + m_score) / num_toks, i.e. gendered weight per token
+        - polarity: (f_score - m_score) / (f_score + m_score), from -1 (male) to 1
+          (female), or 0 if no token matched
+'''
+class Lexicon:
+    def __init__(self, keys, f_weights, m_weights):
+        self.keys = list(keys)
+        self.index = {key:i for i, key in enumerate(self.keys)}
+        # one extra row of zeros for tokens that are not in the lexicon
+        self.f_weights = np.append(np.asarray(f_weights, dtype=np.float64), 0.)
+        self.m_weights = np.append(np.asarray(m_weights, dtype=np.float64), 0.)
+        self.unknown = len(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @staticmethod
+    def from_associations(f_ass, m_ass, weighting='logp'):
+        """
+        Compiles lists of <<lemma>,<pos>, p, count, group_count> associations into a
+        Lexicon. Each word is weighted by -log10(p) (capped at MAX_LOGP) if weighting
+        is 'logp', or by 1 if 'binary'.
+        """
+        assert(weighting in WEIGHTINGS)
+        weights = {}
+        for col, ass in enumerate([f_ass, m_ass]):
+            for word, p, _, _ in ass:
+                if weighting == 'binary':
+                    w = 1.
+                else:
+                    w = MAX_LOGP if p <= 0 else min(-np.log10(p), MAX_LOGP)
+                weights.setdefault(tuple(word), [0., 0.])[col] = w
+        keys = list(weights.keys())
+        return Lexicon(keys, [weights[k][0] for k in keys], [weights[k][1] for k in keys])
+
+    def save(self, path):
+        keys = np.array([KEY_SEP.join(k) for k in self.keys], dtype=str)
+        np.savez(path, keys=keys, f_weights=self.f_weights[:-1], m_weights=self.m_weights[:-1])
+
+    @staticmethod
+    def load(path):
+        data = np.load(path, allow_pickle=False)
+        keys = [tuple(k.split(KEY_SEP, 1)) for k in data['keys'].tolist()]
+        return Lexicon(keys, data['f_weights'], data['m_weights'])
+
+    def encode(self, toks):
+        """
+        Returns the int32 lexicon rows of a list of <word, lemma, pos> (or <lemma, pos>)
+        tokens, with self.unknown for tokens that are not in the lexicon.
+        """
+        get = self.index.get
+        unknown = self.unknown
+        return np.fromiter((get((t[-2], t[-1]), unknown) for t in toks), dtype=np.int32, count=len(toks))
+
+    def score_encoded(self, rows, lengths):
+        """
+        Scores a batch of encoded documents, given all their rows concatenated and
+        the number of tokens in each document. Returns a dictionary of score name to
+        an array with one score per document.
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        doc_index = np.repeat(np.arange(len(lengths)), lengths)
+        f_score = np.bincount(doc_index, weights=self.f_weights[rows], minlength=len(lengths))
+        m_score = np.bincount(doc_index, weights=self.m_weights[rows], minlength=len(lengths))
+        num_matched = np.bincount(doc_index, weights=rows != self.unknown, minlength=len(lengths)).astype(np.int64)
+        total = f_score + m_score
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intensity = np.where(lengths > 0, total / np.maximum(lengths, 1), 0.)
+            polarity = np.where(total > 0, (f_score - m_score) / total, 0.)
+        return {'num_toks':lengths, 'num_matched':num_matched, 'f_score':f_score, 'm_score':m_score,
+                'intensity':intensity, 'polarity':polarity}
+
+    def score_toks(self, toks_per_text):
+        """
+        Scores a batch of tokenized documents (lists of <word, lemma, pos> tuples).
+        """
+        lengths = [len(toks) for toks in toks_per_text]
+        rows = np.concatenate([self.encode(toks) for toks in toks_per_text]) if toks_per_text else np.zeros(0, dtype=np.int32)
+        return self.score_encoded(rows, lengths)
+
+    def score_texts(self, texts, **preprocessing_kwargs):
+        """
+        Tags a batch of raw texts with preprocessing's NLP pipeline and scores them.
+        """
+        from preprocessing import texts_to_pos_toks
+        toks_per_text, _, _ = texts_to_pos_toks(list(range(len(texts))), texts, **preprocessing_kwargs)
+        return self.score_toks(toks_per_text)
+
+def compile_lexicon(f_ass, m_ass, alpha=0.05, valid_pos=('NOUN', 'VERB', 'ADJ'), weighting='logp'):
+    """
+    Keeps the associations that are significant as in score_words: valid lemmas with
+    a pos in valid_pos, and p below alpha with a Bonferroni correction. Returns the
+    compiled Lexicon.
+    """
+    from score_words import filter_associations_on_lemma_and_pos, filter_associations_on_p
+    f_ass = filter_associations_on_lemma_and_pos(f_ass, valid_pos=set(valid_pos))
+    m_ass = filter_associations_on_lemma_and_pos(m_ass, valid_pos=set(valid_pos))
+    adjusted_alpha = alpha / max(len(f_ass) + len(m_ass), 1)
+    sig_f_ass = filter_associations_on_p(f_ass, p_thresh=adjusted_alpha)
+    sig_m_ass = filter_associations_on_p(m_ass, p_thresh=adjusted_alpha)
+    print('Compiled {} female and {} male words (adjusted alpha={})'.format(len(sig_f_ass), len(sig_m_ass), adjusted_alpha))
+    return Lexicon.from_associations(sig_f_ass, sig_m_ass, weighting=weighting)
+
+# ========== BATCH SCORING ==========
+_worker_lexicon = None
+
+def _init_worker(lexicon_path):
+    global _worker_lexicon
+    _worker_lexicon = Lexicon.load(lexicon_path)
+
+def _score_chunk(args):
+    pretokenized, doc_ids, docs = args
+    if pretokenized:
+        scores = _worker_lexicon.score_toks(docs)
+    else:
+        scores = _worker_lexicon.score_texts(docs)
+    return doc_ids, scores
+
+def iter_chunks(docs_w_id, chunk_size):
+    """
+    Groups an iterable of <doc_id, doc> into <doc_ids, docs> chunks of chunk_size.
+    """
+    doc_ids = []
+    docs = []
+    for doc_id, doc in docs_w_id:
+        doc_ids.append(doc_id)
+        docs.append(doc)
+        if len(docs) == chunk_size:
+            yield doc_ids, docs
+            doc_ids = []
+            docs = []
+    if len(docs) > 0:
+        yield doc_ids, docs
+
+def score_documents(lexicon_path, docs_w_id, pretokenized=False, processes=1, chunk_size=1000):
+    """
+    Scores an iterable of <doc_id, doc>, where each doc is a raw text or, if
+    pretokenized, a list of tokens. Chunks of documents are scored in parallel by
+    processes workers, each of which loads the lexicon once. Yields <doc_ids, scores>
+    per chunk, in input order, so that arbitrarily many documents can be streamed
+    through with bounded memory.
+    """
+    chunks = ((pretokenized, doc_ids, docs) for doc_ids, docs in iter_chunks(docs_w_id, chunk_size))
+    progress = Progress('lexicon_score', every_sec=60)
+    if processes > 1:
+        pool = Pool(processes, initializer=_init_worker, initargs=(lexicon_path,))
+        results = pool.imap(_score_chunk, chunks)
+    else:
+        pool = None
+        _init_worker(lexicon_path)
+        results = map(_score_chunk, chunks)
+    try:
+        for doc_ids, scores in results:
+            progress.update(docs=len(doc_ids), toks=int(scores['num_toks'].sum()))
+            yield doc_ids, scores
+    finally:
+        progress.finish()
+        if pool is not None:
+            pool.close()
+
+def read_text_docs(path):
+    """
+    Yields <doc_id, text> for each non-empty line of a text file. A line is either
+    <doc_id>\\t<text> or just the text, in which case its line number is its ID.
+    """
+    with open(path, 'r') as f:
+        for i, line in enumerate(f):
+            line = line.rstrip('\n')
+            if line.strip() == '':
+                continue
+            if '\t' in line:
+                doc_id, text = line.split('\t', 1)
+                yield doc_id, text
+            else:
+                yield str(i), line
+
+def write_scores(path, scored_chunks):
+    with open(path, 'w') as f:
+        f.write('\t'.join(['doc_id'] + SCORE_COLUMNS) + '\n')
+        for doc_ids, scores in scored_chunks:
+            for i, doc_id in enumerate(doc_ids):
+                f.write('\t'.join([str(doc_id)] + [str(scores[col][i]) for col in SCORE_COLUMNS]) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile and apply gendered-language lexicons.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compile_parser = subparsers.add_parser('compile', help='compile lex.pkl into a lookup table')
+    compile_parser.add_argument('--lex', required=True, help='(f_ass, m_ass) from score_words: lex.pkl, or its artifact')
+    compile_parser.add_argument('--out', required=True, help='path of the compiled lexicon (.npz)')
+    compile_parser.add_argument('--alpha', type=float, default=0.05)
+    compile_parser.add_argument('--pos', nargs='+', default=['NOUN', 'VERB', 'ADJ'])
+    compile_parser.add_argument('--weighting', choices=sorted(WEIGHTINGS), default='logp')
+    score_parser = subparsers.add_parser('score', help='score documents with a compiled lexicon')
+    score_parser.add_argument('--lexicon', required=True, help='path of the compiled lexicon (.npz)')
+    score_parser.add_argument('--input', required=True)
+    score_parser.add_argument('--pretokenized', action='store_true', help='input is a list of <doc_id, toks> (a pickle or its artifact)')
+    score_parser.add_argument('--out', required=True, help='path of the output TSV')
+    score_parser.add_argument('--processes', type=int, default=os.cpu_count())
+    score_parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        f_ass, m_ass = load_processed(args.lex)
+        lexicon = compile_lexicon(f_ass, m_ass, alpha=args.alpha, valid_pos=args.pos, weighting=args.weighting)
+        lexicon.save(args.out)
+    else:
+        if args.pretokenized:
+            docs_w_id = load_processed(args.input)
+        else:
+            docs_w_id = read_text_docs(args.input)
+        with timed('lexicon_score', input=args.input, processes=args.processes):
+            write_scores(args.out, score_documents(args.lexicon, docs_w_id, pretokenized=args.pretokenized,
+                                                   processes=args.processes, chunk_size=args.chunk_size))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,492 @@
+"""
+A local HTTP service that answers association queries over the scored lexicons in
+milliseconds, instead of re-running score_words or unpickling lex.pkl for each
+question. Each corpus's associations (and, if available, its counts) are loaded
+once into an index sorted by p-value; query results are cached; and the files are
+polled so that a newly published lex.pkl (or counts file) is loaded in the
+background and swapped in without a restart.
+
+    python lexicon_service.py --port 8765
+    python lexicon_service.py --lex prof=../processed/professor/lex.pkl --counts prof=../processed/professor/counts.pkl
+    python lexicon_service.py --counts prof=prof_counts.npz --min-count 10     # score merged partial counts on load
+
+    curl 'localhost:8765/top?corpus=prof&gender=m&pos=ADJ&min_count=20&k=25'
+
+Routes (GET, JSON):
+    /corpora                                            loaded corpora, sizes, and versions
+    /top?corpus=C&k=25                                  the k associations with the smallest p
+    /per_pos?corpus=C&k=25&pos=NOUN,VERB,ADJ            the top k for each pos
+    /threshold?corpus=C&p=1e-6&limit=1000               every association with p <= p
+    /word?corpus=C&lemma=funny[&pos=ADJ]                a word's associations and counts
+    /stats                                              cache hit rate, query latency, reloads
+    /reload (POST)                                      check the files for changes now
+
+Every query but /word takes the filters gender (f or m; both by default), pos
+(comma-separated), min_count (of the word in both groups), and valid (1, the
+default, drops stopwords and invalid lemmas like score_words does; 0 keeps them).
+/top and /per_pos also take alpha, which keeps only the associations that are
+significant with a Bonferroni correction over the associations of both genders
+that pass the other filters, like pipeline's filter stage.
+"""
+import argparse
+from artifacts import artifact_path_for, load_processed, processed_exists
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from instrumentation import emit, get_histogram, get_meter, observe_latency
+import json
+import numpy as np
+import os
+from pipeline import CORPORA, processed_path
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+GENDERS = ['f', 'm']  # group 0 and 1, as in beta_scoring_from_counts
+DEFAULT_PORT = 8765
+CACHE_SIZE = 4096  # cached query results
+POLL_SEC = 5  # how often the files are checked for changes
+SETTLE_SEC = 2  # files modified more recently than this may still be being written
+MAX_K = 10000
+LATENCY_FLOOR_SEC = 1e-6  # cached queries take well under a millisecond
+
+'''
+    This class holds one corpus's female- and male-associated words as parallel
+    arrays sorted by p-value (genders, p-values, counts, pos codes, and whether the
+    lemma is valid), so that a query is one vectorized mask over the arrays, and its
+    top k are the first k rows that pass it. Words are also indexed by <lemma>,<pos>
+    and by lemma for lookups, along with their female and male counts if given.
+'''
+class LexiconIndex:
+    def __init__(self, f_ass, m_ass, fcounts=None, mcounts=None, version=0, source=None):
+        from score_words import STOPWORDS, is_valid_lemma
+        ass = sorted([(0, a) for a in f_ass] + [(1, a) for a in m_ass], key=lambda x:x[1][1])
+        self.words = [tuple(a[0]) for g, a in ass]
+        self.genders = np.array([g for g, a in ass], dtype=np.int8)
+        self.ps = np.array([a[1] for g, a in ass], dtype=np.float64)
+        self.counts = np.array([a[2] for g, a in ass], dtype=np.int64)
+        self.group_counts = np.array([a[3] for g, a in ass], dtype=np.int64)
+        self.pos_labels = sorted(set(pos for lemma, pos in self.words))
+        pos_to_code = {pos:i for i, pos in enumerate(self.pos_labels)}
+        self.pos_codes = np.array([pos_to_code[pos] for lemma, pos in self.words], dtype=np.int32)
+        blacklist = set(STOPWORDS)
+        self.valid = np.array([is_valid_lemma(lemma, blacklist) for lemma, pos in self.words], dtype=bool)
+        self.word_rows = {}
+        self.lemma_words = {}
+        for i, word in enumerate(self.words):
+            self.word_rows.setdefault(word, []).append(i)
+            self.lemma_words.setdefault(word[0], set()).add(word)
+        self.fcounts = fcounts
+        self.mcounts = mcounts
+        if fcounts is not None:
+            for counts in [fcounts, mcounts]:
+                for word in counts:
+                    self.lemma_words.setdefault(word[0], set()).add(word)
+        self.version = version
+        self.source = source
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.words)
+
+    def mask(self, gender=None, pos=None, min_count=None, valid=True):
+        """
+        Returns the boolean mask of the associations that pass the filters.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if gender is not None:
+            mask &= self.genders == GENDERS.index(gender)
+        if pos is not None:
+            codes = [self.pos_labels.index(p) for p in pos if p in self.pos_labels]
+            mask &= np.isin(self.pos_codes, codes)
+        if min_count is not None:
+            mask &= self.counts >= min_count
+        if valid:
+            mask &= self.valid
+        return mask
+
+    def significant(self, alpha, gender=None, **filters):
+        """
+        Returns the mask of the filtered rows whose p-value is below alpha, of the given
+        gender. Like the pipeline's filter stage, the Bonferroni correction is over the
+        filtered rows of both genders, so it does not depend on which gender is asked for.
+        """
+        mask = self.mask(**filters)
+        mask &= self.ps <= alpha / max(int(mask.sum()), 1)
+        if gender is not None:
+            mask &= self.genders == GENDERS.index(gender)
+        return mask
+
+    def top(self, k, alpha=None, **filters):
+        mask = self.mask(**filters) if alpha is None else self.significant(alpha, **filters)
+        return np.flatnonzero(mask)[:k]
+
+    def top_per_pos(self, k, pos, alpha=None, **filters):
+        """
+        Returns the top k rows for each pos; alpha is corrected over every pos at once.
+        """
+        mask = self.mask(pos=pos, **filters) if alpha is None else self.significant(alpha, pos=pos, **filters)
+        top = {}
+        for p in pos:
+            if p in self.pos_labels:
+                top[p] = np.flatnonzero(mask & (self.pos_codes == self.pos_labels.index(p)))[:k]
+            else:
+                top[p] = np.zeros(0, dtype=np.int64)
+        return top
+
+    def threshold(self, p, limit=None, **filters):
+        rows = np.flatnonzero(self.mask(**filters) & (self.ps <= p))
+        return rows if limit is None else rows[:limit]
+
+    def row(self, i):
+        return {'lemma':self.words[i][0], 'pos':self.words[i][1], 'gender':GENDERS[self.genders[i]],
+                'p':float(self.ps[i]), 'count':int(self.counts[i]), 'group_count':int(self.group_counts[i])}
+
+    def lookup(self, lemma, pos=None):
+        """
+        Returns every <lemma>,<pos> with this lemma (or just the given pos): its
+        association, if it has one, and its counts, if counts were loaded.
+        """
+        words = sorted(self.lemma_words.get(lemma, ()))
+        results = []
+        for word in words:
+            if pos is not None and word[1] != pos:
+                continue
+            result = {'lemma':word[0], 'pos':word[1], 'associations':[self.row(i) for i in self.word_rows.get(word, [])]}
+            if self.fcounts is not None:
+                result['f_count'] = int(self.fcounts.get(word, 0))
+                result['m_count'] = int(self.mcounts.get(word, 0))
+            results.append(result)
+        return results
+
+def file_fingerprint(paths):
+    """
+    Returns the <path, mtime, size> of the given files that exist, to tell when they
+    change.
+    """
+    fingerprint = []
+    for path in paths:
+        if path is not None and os.path.isfile(path):
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+def load_index(lex_path=None, counts_path=None, min_count=5, version=0):
+    """
+    Loads a LexiconIndex from the (f_ass, m_ass) that score_words pickles (or its
+    artifact) and, optionally, the counts: the (fcounts, mcounts) of the pipeline's
+    counts.pkl (or its artifact), or a partial-counts .npz from partial_counts.py. Without
+    a lex path, the associations are scored from the partial counts.
+    """
+    fcounts = mcounts = None
+    partial = None
+    if counts_path is not None and processed_exists(counts_path):
+        if counts_path.endswith('.npz'):
+            from partial_counts import PartialCounts
+            partial = PartialCounts.load(counts_path)
+            fcounts, mcounts, _ = partial.to_counters()
+        else:
+            fcounts, mcounts = load_processed(counts_path)[:2]
+    if lex_path is not None:
+        f_ass, m_ass = load_processed(lex_path)
+    elif partial is not None:
+        f_ass, m_ass = partial.score(min_count=min_count, sort=False)
+    else:
+        raise ValueError('Nothing to load: no associations and no partial counts')
+    return LexiconIndex(f_ass, m_ass, fcounts=fcounts, mcounts=mcounts, version=version,
+                        source={'lex':lex_path, 'counts':counts_path})
+
+'''
+    This class holds the loaded index of every corpus and the query cache. reload()
+    checks each corpus's files, and loads an index for the ones that changed (and have
+    not been modified for SETTLE_SEC, in case another tool writes them in place); the
+    new index replaces the old one in one assignment, so queries in flight finish on
+    the old one. A file that fails to load (e.g. one still being written) leaves the
+    old index in place, and is retried at the next check. Cached results are keyed
+    by the corpus's version, and a corpus's results are dropped when it is reloaded.
+'''
+class LexiconStore:
+    def __init__(self, sources, min_count=5, cache_size=CACHE_SIZE, settle_sec=SETTLE_SEC):
+        self.sources = sources  # name -> (lex path, counts path)
+        self.min_count = min_count
+        self.cache_size = cache_size
+        self.settle_sec = settle_sec
+        self.indexes = {}
+        self.fingerprints = {}
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def _watched_paths(self, name):
+        paths = []
+        for path in self.sources[name]:
+            if path is not None:
+                paths += [path, artifact_path_for(path)] if path.endswith('.pkl') else [path]
+        return paths
+
+    def reload(self, force=False):
+        """
+        Loads the corpora whose files changed since they were loaded (or all of them,
+        if force). Returns the names of the corpora that were reloaded.
+        """
+        reloaded = []
+        with self._reload_lock:
+            for name, (lex_path, counts_path) in self.sources.items():
+                fingerprint = file_fingerprint(self._watched_paths(name))
+                if len(fingerprint) == 0 or (not force and fingerprint == self.fingerprints.get(name)):
+                    continue
+                if not force and time.time() - max(mtime for path, mtime, size in fingerprint) / 1e9 < self.settle_sec:
+                    continue  # may still be being written
+                old = self.indexes.get(name)
+                try:
+                    start = time.time()
+                    index = load_index(lex_path, counts_path, min_count=self.min_count,
+                                       version=old.version + 1 if old is not None else 0)
+                except Exception as e:
+                    emit('lexicon_reload_failed', corpus=name, error=repr(e))
+                    continue
+                with self._lock:
+                    self.indexes[name] = index
+                    self.fingerprints[name] = fingerprint
+                    for key in [key for key in self.cache if key[0] == name]:
+                        del self.cache[key]
+                self.reloads += 1
+                reloaded.append(name)
+                emit('lexicon_loaded', corpus=name, version=index.version, words=len(index),
+                     sec=round(time.time() - start, 3))
+        return reloaded
+
+    def watch(self, poll_sec=POLL_SEC, stop_event=None):
+        """
+        Starts a daemon thread that calls reload every poll_sec seconds until
+        stop_event is set.
+        """
+        stop_event = stop_event or threading.Event()
+
+        def poll():
+            while not stop_event.wait(poll_sec):
+                self.reload()
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        return stop_event
+
+    def index(self, name):
+        with self._lock:
+            if name not in self.indexes:
+                raise KeyError(name)
+            return self.indexes[name]
+
+    def query(self, route, params):
+        """
+        Returns the JSON-encoded result of a query, from the cache if possible.
+        """
+        name = params.get('corpus')
+        index = self.index(name)
+        key = (name, index.version, route, tuple(sorted(params.items())))
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+        body = json.dumps(run_query(index, route, params)).encode('utf-8')
+        with self._lock:
+            if index is self.indexes.get(name):  # not reloaded in the meantime
+                self.cache[key] = body
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return body
+
+    def status(self):
+        with self._lock:
+            corpora = {name:{'words':len(index), 'version':index.version, 'loaded_at':index.loaded_at,
+                             'source':index.source, 'pos':index.pos_labels, 'has_counts':index.fcounts is not None}
+                       for name, index in self.indexes.items()}
+        return {'corpora':corpora, 'not_loaded':sorted(set(self.sources) - set(corpora))}
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'cache':{'size':len(self.cache), 'hits':self.hits, 'misses':self.misses,
+                             'hit_rate':self.hits / lookups if lookups > 0 else None},
+                    'reloads':self.reloads,
+                    'latency_sec':get_histogram('lexicon_query', min_value=LATENCY_FLOOR_SEC).snapshot()}
+
+def parse_params(query):
+    """
+    Parses and normalizes the query string of a request, so that equivalent queries
+    share a cache key. Raises ValueError on invalid values.
+    """
+    raw = {key:values[-1] for key, values in parse_qs(query).items()}
+    params = {}
+    for key, value in raw.items():
+        if key in {'corpus', 'lemma'}:
+            params[key] = value
+        elif key == 'gender':
+            if value.lower() not in GENDERS:
+                raise ValueError('gender must be one of: ' + ', '.join(GENDERS))
+            params[key] = value.lower()
+        elif key == 'pos':
+            params[key] = tuple(sorted(set(p.strip().upper() for p in value.split(',') if p.strip())))
+        elif key in {'k', 'limit', 'min_count'}:
+            params[key] = int(value)
+            if params[key] < 0:
+                raise ValueError('{} must not be negative'.format(key))
+        elif key in {'p', 'alpha'}:
+            params[key] = float(value)
+        elif key == 'valid':
+            params[key] = value not in {'0', 'false', 'no'}
+        else:
+            raise ValueError('Unknown parameter: ' + key)
+    if 'corpus' not in params:
+        raise ValueError('Missing parameter: corpus')
+    return params
+
+def run_query(index, route, params):
+    """
+    Answers a query against one corpus's index. Associations are listed per gender,
+    ordered by p.
+    """
+    genders = [params['gender']] if 'gender' in params else GENDERS
+    filters = {'pos':params.get('pos'), 'min_count':params.get('min_count'), 'valid':params.get('valid', True)}
+    k = min(params.get('k', 25), MAX_K)
+    result = {'corpus':params['corpus'], 'version':index.version}
+    if route == 'word':
+        if 'lemma' not in params:
+            raise ValueError('Missing parameter: lemma')
+        pos = params.get('pos')
+        if pos is not None and len(pos) != 1:
+            raise ValueError('word takes at most one pos')
+        result['words'] = index.lookup(params['lemma'], pos=pos[0] if pos is not None else None)
+        return result
+    for gender in genders:
+        if route == 'top':
+            result[gender] = [index.row(i) for i in index.top(k, alpha=params.get('alpha'), gender=gender, **filters)]
+        elif route == 'per_pos':
+            top = index.top_per_pos(k, filters['pos'] or ('ADJ', 'NOUN', 'VERB'), alpha=params.get('alpha'),
+                                    gender=gender, min_count=filters['min_count'], valid=filters['valid'])
+            result[gender] = {p:[index.row(i) for i in rows] for p, rows in top.items()}
+        elif route == 'threshold':
+            if 'p' not in params:
+                raise ValueError('Missing parameter: p')
+            rows = index.threshold(params['p'], limit=min(params.get('limit', MAX_K), MAX_K), gender=gender, **filters)
+            result[gender] = [index.row(i) for i in rows]
+        else:
+            raise KeyError(route)
+    return result
+
+class LexiconHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = 1 << 16  # send headers and body together, or keep-alive clients wait on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # queries are counted in /stats instead
+
+    def _reply(self, status, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        store = self.server.store
+        url = urlparse(self.path)
+        route = url.path.strip('/')
+        if route == 'corpora':
+            self._reply(200, store.status())
+            return
+        if route == 'stats':
+            self._reply(200, store.stats())
+            return
+        if route not in {'top', 'per_pos', 'threshold', 'word'}:
+            self._reply(404, {'error':'Unknown route: ' + url.path})
+            return
+        with observe_latency('lexicon_query', min_value=LATENCY_FLOOR_SEC):
+            try:
+                body = store.query(route, parse_params(url.query))
+            except KeyError as e:
+                self._reply(404, {'error':'Corpus not loaded: {}'.format(e.args[0])})
+                return
+            except ValueError as e:
+                self._reply(400, {'error':str(e)})
+                return
+        get_meter('lexicon_service').add(queries=1)
+        self._reply(200, body)
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip('/') != 'reload':
+            self._reply(404, {'error':'Unknown route: ' + self.path})
+            return
+        self._reply(200, {'reloaded':self.server.store.reload()})
+
+def parse_sources(lex_specs, counts_specs):
+    """
+    Returns the name -> (lex path, counts path) of the corpora, given name=path
+    specs. Without any spec, serves every corpus's lex.pkl and counts.pkl from the
+    pipeline's processed folders. A lex spec without a counts spec watches the
+    counts.pkl next to it, whether or not it exists yet.
+    """
+    sources = {}
+    if not lex_specs and not counts_specs:
+        for corpus in CORPORA:
+            sources[corpus] = (processed_path(corpus) + 'lex.pkl', processed_path(corpus) + 'counts.pkl')
+        return sources
+    for spec in lex_specs:
+        name, path = spec.split('=', 1)
+        sources[name] = (path, os.path.join(os.path.dirname(path), 'counts.pkl'))
+    for spec in counts_specs:
+        name, path = spec.split('=', 1)
+        sources[name] = (sources[name][0] if name in sources else None, path)
+    return sources
+
+def make_server(sources, host='127.0.0.1', port=DEFAULT_PORT, min_count=5, cache_size=CACHE_SIZE):
+    """
+    Returns the HTTP server with its LexiconStore (server.store), after loading every
+    corpus whose files exist.
+    """
+    store = LexiconStore(sources, min_count=min_count, cache_size=cache_size)
+    store.reload(force=True)
+    server = ThreadingHTTPServer((host, port), LexiconHandler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve association queries over the scored lexicons.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--lex', nargs='+', default=[], help='<corpus>=<path of lex.pkl>')
+    parser.add_argument('--counts', nargs='+', default=[],
+                        help='<corpus>=<path of counts.pkl or a partial-counts .npz>')
+    parser.add_argument('--min-count', type=int, default=5, help='min_count when scoring partial counts')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE)
+    parser.add_argument('--poll-sec', type=float, default=POLL_SEC, help='how often to check for new files (0: never)')
+    args = parser.parse_args()
+
+    server = make_server(parse_sources(args.lex, args.counts), host=args.host, port=args.port,
+                         min_count=args.min_count, cache_size=args.cache_size)
+    status = server.store.status()
+    for name, corpus in status['corpora'].items():
+        print('Loaded {}: {} associations (version {})'.format(name, corpus['words'], corpus['version']))
+    for name in status['not_loaded']:
+        print('Not loaded yet: {} (waiting for its files)'.format(name))
+    stop_event = server.store.watch(args.poll_sec) if args.poll_sec > 0 else None
+    print('Serving on http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if stop_event is not None:
+            stop_event.set()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
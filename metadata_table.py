@@ -0,0 +1,263 @@
+from datetime import datetime
+import numpy as np
+
+RATING_TO_SCORE = {'AWESOME':5, 'GOOD':4, 'AVERAGE':3, 'POOR':2, 'AWFUL':1}  # RMP's rating labels
+MONTH_PREFIXES = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+def parse_celeb_timestamp(ts):
+    """
+    Parses a celeb article timestamp (e.g. 'December 20, 2018 10:30 AM' or
+    'Dec. 20, 2018 10:30 PM') into a numpy datetime64 with minute precision.
+    Returns NaT if the timestamp cannot be parsed.
+    """
+    try:
+        monthname, date, year, clock_time, clock = ts.split()
+        month = MONTH_PREFIXES.index(monthname.lower()[:3]) + 1
+        hour, minute = clock_time.split(':')
+        hour = int(hour) % 12 + (12 if clock.upper() == 'PM' else 0)
+        dt = datetime(int(year), month, int(date.rstrip(',')), hour, int(minute))
+        return np.datetime64(dt, 'm')
+    except (AttributeError, ValueError):
+        return np.datetime64('NaT', 'm')
+
+def parse_rating(rating):
+    """
+    Parses a review rating, either one of RMP's labels or a number, into a float.
+    Returns NaN if the rating cannot be parsed.
+    """
+    if rating is None:
+        return np.nan
+    rating = rating.strip()
+    if rating.upper() in RATING_TO_SCORE:
+        return float(RATING_TO_SCORE[rating.upper()])
+    try:
+        return float(rating)
+    except ValueError:
+        return np.nan
+
+def split_tags(tags):
+    """
+    Splits a comma-separated tags string (or cleans a list of tags) into a list of
+    non-empty, stripped tags.
+    """
+    if tags is None:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return [t.strip() for t in tags if t.strip() != '' and t.strip() != 'None']
+
+def multi_value_bitsets(offsets, codes, num_labels):
+    """
+    Encodes a multi-valued column (CSR offsets and codes) as one bitset per row: a
+    (num_rows, ceil(num_labels / 64)) uint64 array, where bit j % 64 of word j // 64
+    is set if the row has label j. Rows can then be tested against any set of
+    labels with one bitwise AND.
+    """
+    num_rows = len(offsets) - 1
+    bits = np.zeros((num_rows, max(1, (num_labels + 63) // 64)), dtype='<u8')
+    rows = np.repeat(np.arange(num_rows), np.diff(offsets))
+    codes = np.asarray(codes, dtype=np.int64)
+    np.bitwise_or.at(bits, (rows, codes // 64), np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64)))
+    return bits
+
+def labels_to_bitset(labels, values):
+    """
+    Returns the bitset (as in multi_value_bitsets) of the given values of a column
+    with these labels; unknown values are ignored.
+    """
+    bits = np.zeros(max(1, (len(labels) + 63) // 64), dtype='<u8')
+    label_to_code = {label:i for i, label in enumerate(labels)}
+    for v in [values] if isinstance(values, str) else values:
+        if v in label_to_code:
+            code = label_to_code[v]
+            bits[code // 64] |= np.uint64(1) << np.uint64(code % 64)
+    return bits
+
+def dictionary_encode(values):
+    """
+    Returns the int32 codes of the values and the sorted list of distinct values.
+    """
+    labels, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+    return codes.astype(np.int32), labels.tolist()
+
+'''
+    This class is a NumPy-backed columnar table over a loaded corpus, with one row
+    per document (an article, or one professor review). There are three kinds of
+    columns:
+        - plain columns: one array per column (e.g. parsed timestamps, ratings, text)
+        - dictionary-encoded columns: int32 codes plus a list of labels (e.g. site,
+          school, gender)
+        - multi-valued columns: dictionary-encoded values stored as CSR offsets and
+          codes, since each row can have several (e.g. tags)
+    Secondary indexes (value -> sorted row indices) are built on first use, so
+    repeated filtered queries do not rescan the rows. where() returns the matching
+    row indices, which can be fed to texts(), ids(), or rows().
+'''
+class CorpusTable:
+    def __init__(self, columns, dict_columns=None, multi_columns=None):
+        self.columns = columns
+        self.dict_columns = dict_columns or {}  # name -> (codes, labels)
+        self.multi_columns = multi_columns or {}  # name -> (offsets, codes, labels)
+        self._indexes = {}
+        lengths = set(len(col) for col in columns.values())
+        lengths.update(len(codes) for codes, _ in self.dict_columns.values())
+        lengths.update(len(offsets) - 1 for offsets, _, _ in self.multi_columns.values())
+        assert(len(lengths) <= 1)
+        self.num_rows = lengths.pop() if lengths else 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def column(self, name, rows=None):
+        """
+        Returns a column's values (decoded, for dictionary-encoded columns), for all
+        rows or just the given ones.
+        """
+        if name in self.columns:
+            values = self.columns[name]
+            return values if rows is None else values[rows]
+        if name in self.dict_columns:
+            codes, labels = self.dict_columns[name]
+            codes = codes if rows is None else codes[rows]
+            return np.array(labels, dtype=object)[codes] if len(labels) > 0 else np.array([], dtype=object)
+        if name in self.multi_columns:
+            offsets, codes, labels = self.multi_columns[name]
+            rows = range(self.num_rows) if rows is None else rows
+            return [[labels[c] for c in codes[offsets[r]:offsets[r+1]]] for r in rows]
+        raise KeyError(name)
+
+    def labels(self, name):
+        if name in self.dict_columns:
+            return self.dict_columns[name][1]
+        return self.multi_columns[name][2]
+
+    def index(self, name):
+        """
+        Returns the secondary index of a dictionary-encoded or multi-valued column:
+        a list, over the column's labels, of sorted arrays of the rows with that label.
+        """
+        if name not in self._indexes:
+            if name in self.dict_columns:
+                codes, labels = self.dict_columns[name]
+                rows = np.arange(self.num_rows)
+            else:
+                offsets, codes, labels = self.multi_columns[name]
+                rows = np.repeat(np.arange(self.num_rows), np.diff(offsets))
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+            self._indexes[name] = [rows[order[bounds[i]:bounds[i+1]]] for i in range(len(labels))]
+        return self._indexes[name]
+
+    def rows_with(self, name, values):
+        """
+        Returns the sorted rows whose value (or any of whose values, for a multi-valued
+        column) is one of the given values.
+        """
+        if isinstance(values, str):
+            values = [values]
+        label_to_code = {label:i for i, label in enumerate(self.labels(name))}
+        index = self.index(name)
+        found = [index[label_to_code[v]] for v in values if v in label_to_code]
+        if len(found) == 0:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def mask(self, **conditions):
+        """
+        Returns a boolean mask over the rows that meet all conditions. A condition on a
+        dictionary-encoded or multi-valued column is a value or list of values; on a
+        plain column it is a value, or a (low, high) range where either end can be
+        None (low is inclusive, high is exclusive).
+        """
+        mask = np.ones(self.num_rows, dtype=bool)
+        for name, cond in conditions.items():
+            if name in self.dict_columns or name in self.multi_columns:
+                cond_mask = np.zeros(self.num_rows, dtype=bool)
+                cond_mask[self.rows_with(name, cond)] = True
+            elif isinstance(cond, tuple):
+                values = self.columns[name]
+                low, high = cond
+                cond_mask = np.ones(self.num_rows, dtype=bool)
+                if low is not None:
+                    cond_mask &= values >= np.asarray(low, dtype=values.dtype)
+                if high is not None:
+                    cond_mask &= values < np.asarray(high, dtype=values.dtype)
+            else:
+                cond_mask = self.columns[name] == cond
+            mask &= cond_mask
+        return mask
+
+    def where(self, **conditions):
+        """
+        Returns the indices of the rows that meet all conditions (see mask).
+        """
+        return np.flatnonzero(self.mask(**conditions))
+
+    def texts(self, rows=None):
+        return list(self.column('text', rows))
+
+    def ids(self, rows=None):
+        return list(self.column('id', rows))
+
+def build_celeb_table(entries):
+    """
+    Builds a CorpusTable with one row per celeb article, given loader entries. The
+    id column holds the processed article IDs (<site>_<article_id>) that
+    preprocessing uses.
+    """
+    ids = []
+    tag_offsets = [0]
+    tag_values = []
+    for e in entries:
+        ids.append('{}_{}'.format(e.get('site'), e['id']))
+        tags = split_tags(e['tags'])
+        tag_values += tags
+        tag_offsets.append(len(tag_values))
+    tag_codes, tag_labels = dictionary_encode(tag_values) if tag_values else (np.array([], dtype=np.int32), [])
+    columns = {'id':np.array(ids, dtype=object),
+               'label':np.array([e['label'] if e['label'] is not None else -1 for e in entries], dtype=np.int8),
+               'ts':np.array([parse_celeb_timestamp(e['ts']) for e in entries], dtype='datetime64[m]'),
+               'title':np.array([e['title'] for e in entries], dtype=object),
+               'url':np.array([e['url'] for e in entries], dtype=object),
+               'text':np.array([e['text'] for e in entries], dtype=object)}
+    dict_columns = {'site':dictionary_encode([e.get('site') for e in entries]),
+                    'author':dictionary_encode([e['author'] for e in entries])}
+    multi_columns = {'tags':(np.array(tag_offsets, dtype=np.int64), tag_codes, tag_labels)}
+    return CorpusTable(columns, dict_columns, multi_columns)
+
+def build_review_table(entries):
+    """
+    Builds a CorpusTable with one row per professor review, given loader entries.
+    The id column holds the processed review IDs (<teacher_id>#<review_num>) that
+    preprocessing uses, ratings are parsed into numbers, and the tag_bits column holds
+    each review's tags as a bitset over the tag labels (see multi_value_bitsets).
+    """
+    ids = []
+    teacher_ids = []
+    schools = []
+    genders = []
+    ratings = []
+    texts = []
+    tag_offsets = [0]
+    tag_values = []
+    for e in entries:
+        for i, (rating, tags, text) in enumerate(e['reviews']):
+            ids.append('{}#{}'.format(e['id'], i))
+            teacher_ids.append(e['id'])
+            schools.append(e['metadata']['school'])
+            genders.append(e['gender'])
+            ratings.append(parse_rating(rating))
+            texts.append(text)
+            tag_values += split_tags(tags)
+            tag_offsets.append(len(tag_values))
+    tag_codes, tag_labels = dictionary_encode(tag_values) if tag_values else (np.array([], dtype=np.int32), [])
+    tag_offsets = np.array(tag_offsets, dtype=np.int64)
+    columns = {'id':np.array(ids, dtype=object),
+               'rating':np.array(ratings, dtype=np.float32),
+               'tag_bits':multi_value_bitsets(tag_offsets, tag_codes, len(tag_labels)),
+               'text':np.array(texts, dtype=object)}
+    dict_columns = {'teacher':dictionary_encode(teacher_ids),
+                    'school':dictionary_encode(schools),
+                    'gender':dictionary_encode(genders)}
+    multi_columns = {'tags':(tag_offsets, tag_codes, tag_labels)}
+    return CorpusTable(columns, dict_columns, multi_columns)
@@ -0,0 +1,183 @@
+from collections import Counter
+from dedup import make_hash_params
+from instrumentation import Progress, timed
+import numpy as np
+import zlib
+
+BREAK_POS = {'PUNCT', 'SPACE', 'SYM', 'X'}  # n-grams do not span these tokens, if they are kept
+CMS_WIDTH = 2**22  # counters per Count-Min row
+CMS_DEPTH = 4  # Count-Min rows (hash functions)
+ESTIMATE_BATCH = 100000  # n-grams whose Count-Min estimates are looked up at once
+
+def iter_ngrams(toks, n=2, break_pos=BREAK_POS):
+    """
+    Yields the n-grams of a list of <word, lemma, pos> tokens as <lemma phrase, pos
+    pattern> tuples, e.g. ('office hour', 'NOUN_NOUN'), so that they can be counted and
+    scored like <lemma>,<pos> tuples. N-grams do not span break_pos tokens, but
+    preprocessing already drops punctuation, so toks should be one sentence (as in the
+    *_toks_per_sent lists), not a whole text, or n-grams will span sentence boundaries.
+    """
+    span = []
+    for word, lemma, pos in toks:
+        if pos in break_pos:
+            span = []
+            continue
+        span.append((lemma, pos))
+        if len(span) > n:
+            span.pop(0)
+        if len(span) == n:
+            yield ' '.join(t[0] for t in span), '_'.join(t[1] for t in span)
+
+def ngram_hash(ngram):
+    return zlib.crc32('{}\t{}'.format(*ngram).encode('utf-8'))
+
+'''
+    This class is a Count-Min sketch: depth rows of width counters, where each key is
+    counted in one counter per row (chosen by that row's hash function). A key's
+    estimated count is the minimum over its counters, which is never below its true
+    count, and is above it by at most 2N/width with high probability. Its memory is
+    fixed (width * depth * 8 bytes), no matter how many distinct keys there are.
+'''
+class CountMinSketch:
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, seed=1):
+        self.width = width
+        self.depth = depth
+        self.a, self.b = make_hash_params(depth, seed)
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self._pending = []  # hashes not yet added to the table, added in batches
+
+    def _cells(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        with np.errstate(over='ignore'):  # multiply-shift hashing wraps around on purpose
+            return ((np.outer(self.a, hashes) + self.b[:, None]) >> np.uint64(32)) % np.uint64(self.width)
+
+    def add_hashes(self, hashes):
+        """
+        Counts one occurrence of each key, given the keys' hashes.
+        """
+        self._pending.extend(hashes)
+        self.total += len(hashes)
+        if len(self._pending) >= self.width:
+            self.flush()
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        cells = self._cells(self._pending).astype(np.int64)
+        for row in range(self.depth):
+            self.table[row] += np.bincount(cells[row], minlength=self.width)
+        self._pending = []
+
+    def estimate_hashes(self, hashes):
+        self.flush()
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        cells = self._cells(hashes).astype(np.int64)
+        return self.table[np.arange(self.depth)[:, None], cells].min(axis=0)
+
+def _iterate(source):
+    return source() if callable(source) else iter(source)
+
+def sketch_ngrams(sources, n=2, width=CMS_WIDTH, depth=CMS_DEPTH):
+    """
+    First pass: streams the token lists of every source through a Count-Min sketch.
+    Returns the sketch and the total number of n-grams per source.
+    """
+    sketch = CountMinSketch(width, depth)
+    totals = []
+    progress = Progress('ngram_sketch', every_sec=60)
+    for source in sources:
+        total = 0
+        for toks in _iterate(source):
+            hashes = [ngram_hash(ngram) for ngram in iter_ngrams(toks, n)]
+            sketch.add_hashes(hashes)
+            total += len(hashes)
+            progress.update(docs=1, ngrams=len(hashes))
+        totals.append(total)
+    progress.finish()
+    sketch.flush()
+    return sketch, totals
+
+def count_candidate_ngrams(source, sketch, min_count=5, n=2, batch_size=ESTIMATE_BATCH):
+    """
+    Second pass: counts exactly the n-grams of a source whose Count-Min estimate (of
+    their total count over every source) is at least min_count. Estimates are never
+    below true counts, so every n-gram that occurs at least min_count times in total
+    is counted; the others are only counted if the sketch overestimates them.
+    """
+    counts = Counter()
+    batch = []
+    def count_batch():
+        estimates = sketch.estimate_hashes([ngram_hash(ngram) for ngram in batch])
+        counts.update(ngram for ngram, est in zip(batch, estimates) if est >= min_count)
+        batch.clear()
+    for toks in _iterate(source):
+        batch.extend(iter_ngrams(toks, n))
+        if len(batch) >= batch_size:
+            count_batch()
+    if len(batch) > 0:
+        count_batch()
+    return counts
+
+def get_ngram_counts(f_toks_per_sent, m_toks_per_sent, n=2, min_count=5, width=CMS_WIDTH, depth=CMS_DEPTH):
+    """
+    Counts the female and male n-grams that occur at least min_count times in total,
+    in two passes: the first builds a Count-Min sketch of every n-gram, and the second
+    counts exactly the n-grams whose estimate is at least min_count. No such n-gram is
+    missed, and memory is bounded by the sketch (width * depth counters) plus the
+    n-grams that pass it, instead of by the number of distinct n-grams. Each source is
+    a list of per-sentence token lists, or a function that returns a fresh iterator
+    over them (e.g. over token shards), so that no n-gram spans two sentences (see
+    iter_ngrams). Returns fcounts, mcounts (which may include some n-grams below
+    min_count, for beta_scoring_from_counts to drop), and the <female, male> total
+    number of n-grams, to pass to beta_scoring_from_counts as its totals.
+    """
+    with timed('ngram_count', n=n, width=width, depth=depth):
+        sketch, totals = sketch_ngrams([f_toks_per_sent, m_toks_per_sent], n=n, width=width, depth=depth)
+        fcounts = count_candidate_ngrams(f_toks_per_sent, sketch, min_count=min_count, n=n)
+        mcounts = count_candidate_ngrams(m_toks_per_sent, sketch, min_count=min_count, n=n)
+    print('Counted {} female and {} male {}-grams with an estimated count of at least {}'.format(
+        len(fcounts), len(mcounts), n, min_count))
+    return fcounts, mcounts, tuple(totals)
+
+def is_valid_ngram(ngram, blacklist):
+    """
+    Returns whether no lemma of an n-gram is a stopword or invalid, following
+    score_words.is_valid_lemma.
+    """
+    from score_words import is_valid_lemma
+    return all(is_valid_lemma(lemma, blacklist) for lemma in ngram[0].split(' '))
+
+def filter_ngram_associations(ass, valid_patterns=None, blacklist=None):
+    from score_words import STOPWORDS
+    blacklist = STOPWORDS if blacklist is None else blacklist
+    blacklist = set(blacklist)
+    return [a for a in ass if (valid_patterns is None or a[0][1] in valid_patterns) and is_valid_ngram(a[0], blacklist)]
+
+def group_sents_by_text(toks_per_sent_w_id):
+    """
+    Groups a list of <text_id, sentence toks> tuples into <text_id, list of sentence
+    toks> tuples, in order of each text's first sentence, so that texts can be
+    balanced while n-grams are still counted per sentence.
+    """
+    sents_per_text = {}
+    for text_id, toks in toks_per_sent_w_id:
+        sents_per_text.setdefault(text_id, []).append(toks)
+    return list(sents_per_text.items())
+
+if __name__ == '__main__':
+    from artifacts import load_processed
+    from preprocessing import PATH_TO_PROF_PROCESSED
+    from score_words import balance_toks_per_text, beta_scoring_from_counts, filter_associations_on_p, print_top_n
+    f_sents_per_review_w_id = group_sents_by_text(load_processed(PATH_TO_PROF_PROCESSED + 'f_toks_per_sent.pkl'))
+    m_sents_per_review_w_id = group_sents_by_text(load_processed(PATH_TO_PROF_PROCESSED + 'm_toks_per_sent.pkl'))
+    f_sents_per_review, m_sents_per_review = balance_toks_per_text(f_sents_per_review_w_id, m_sents_per_review_w_id)
+    f_toks_per_sent = [sent for sents in f_sents_per_review for sent in sents]
+    m_toks_per_sent = [sent for sents in m_sents_per_review for sent in sents]
+    fcounts, mcounts, totals = get_ngram_counts(f_toks_per_sent, m_toks_per_sent, n=2)
+    f_ass, m_ass = beta_scoring_from_counts(fcounts, mcounts, sort=False, totals=totals)
+    f_ass = filter_ngram_associations(f_ass, valid_patterns={'ADJ_NOUN', 'NOUN_NOUN', 'VERB_NOUN'})
+    m_ass = filter_ngram_associations(m_ass, valid_patterns={'ADJ_NOUN', 'NOUN_NOUN', 'VERB_NOUN'})
+    alpha = 0.05 / max(len(f_ass) + len(m_ass), 1)  # Bonferroni correction
+    print_top_n(filter_associations_on_p(f_ass, alpha), filter_associations_on_p(m_ass, alpha), top_n=50)
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import hashlib
+from instrumentation import emit
+import pickle
+import sqlite3
+
+DB_TIMEOUT_SEC = 300  # how long to wait for another process's write to the on-disk table
+
+'''
+    This class memoizes the NLP output for repeated text (syndicated paragraphs,
+    boilerplate captions, copy-pasted reviews). Keys are content hashes of the text,
+    prefixed by a namespace so that outputs of different pipelines are not mixed up.
+    It has two tiers: a bounded in-memory LRU, and an optional on-disk SQLite table
+    that persists across runs (e.g. shared by make_celeb_toks_per_text and
+    make_prof_toks_per_text). Disk hits are promoted into memory. Hits and misses
+    are counted for hit-rate reporting. The table is in WAL mode, and new entries are
+    written in one short transaction per commit_every puts, so that several processes
+    (e.g. parallel pipeline stages) can each open their own cache on the same file.
+'''
+class SentenceCache:
+    def __init__(self, max_size=200000, path=None, namespace='', commit_every=1000):
+        self.max_size = max_size
+        self.namespace = namespace
+        self.commit_every = commit_every
+        self._memory = OrderedDict()
+        self._db = None
+        self._uncommitted = []  # <key, pickled value> rows not yet written to the table
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=DB_TIMEOUT_SEC)
+            self._db.execute('PRAGMA journal_mode=WAL')  # readers do not block the writer, or each other
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, value BLOB)')
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, text, namespace=None):
+        h = hashlib.blake2b(digest_size=16)
+        h.update((self.namespace if namespace is None else namespace).encode('utf-8'))
+        h.update(b'\0')
+        h.update(text.encode('utf-8'))
+        return h.digest()
+
+    def get(self, text, namespace=None):
+        """
+        Returns the cached output for this text, or None if it has not been seen.
+        """
+        key = self._key(text, namespace)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        if self._db is not None:
+            row = self._db.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+                self._put_memory(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, text, value, namespace=None):
+        key = self._key(text, namespace)
+        self._put_memory(key, value)
+        if self._db is not None:
+            self._uncommitted.append((key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+            if len(self._uncommitted) >= self.commit_every:
+                self.commit()
+
+    def _put_memory(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def commit(self):
+        if self._db is not None and len(self._uncommitted) > 0:
+            with self._db:  # one transaction, so the write lock is held only while writing
+                self._db.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?)', self._uncommitted)
+            self._uncommitted = []
+
+    def close(self):
+        self.report()
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else None
+
+    def report(self):
+        """
+        Emits the cache's hit/miss counts and hit rate.
+        """
+        emit('cache', name='sentence_cache', hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+             hit_rate=self.hit_rate(), memory_size=len(self._memory))
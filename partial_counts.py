@@ -0,0 +1,392 @@
+"""
+Splits the counting behind score_words across processes or machines: each worker
+counts a shard of the processed tokens into a small partial-count file, partials
+are merged in a tree, and scoring runs from the merged file.
+
+    python partial_counts.py split --corpus prof --num-shards 16 --out-dir shards/
+    python partial_counts.py count --f-shards shards/prof_f_03.pkl --m-shards shards/prof_m_03.pkl --source prof:3/16 --out partials/prof_03.npz
+    python partial_counts.py count --corpus prof --shard 3 --num-shards 16 --out partials/prof_03.npz
+    python partial_counts.py merge partials/*.npz --out prof_counts.npz --fan-in 8 --processes 4
+    python partial_counts.py score prof_counts.npz --min-count 5 --out ../processed/professor/lex.pkl
+    python partial_counts.py local --corpus prof --num-shards 8 --processes 8 --out prof_counts.npz
+
+Corpus shards are strided slices of the balanced corpus (balanced as score_words
+does), so merging all num-shards of them gives the same counts as
+get_tok_counts_from_balanced_*_corpus. split balances the corpus once and writes each
+shard's texts as token shards (see external_count), so that a node only needs its
+own shard files; --f-shards/--m-shards count token shards as they are, without
+balancing. count --corpus instead loads and balances the whole processed corpus to
+count one shard of it, which is only worth it on a machine that has the corpus.
+"""
+import argparse
+from collections import Counter
+import json
+from multiprocessing import Pool
+import numpy as np
+import os
+import re
+import shutil
+import tempfile
+
+FORMAT_VERSION = 2
+KEY_SEP = '\t'  # joins a <lemma>,<pos> key in format version 1 files
+FAN_IN = 8  # partials merged at once
+
+'''
+    This class is a partial count: the female and male counts of the words of some
+    texts, as two arrays aligned with a vocabulary sorted by <lemma>,<pos> (stored as
+    separate lemma and pos arrays, so that lemmas may hold any characters), plus each group's token total and number of texts, and the names of the sources
+    (shards) it was counted from. Merging partials takes the union of their
+    vocabularies and sums the counts, so it is associative and commutative: any merge
+    order, or tree shape, gives the same result, whether it runs in local processes
+    or on many machines. A source merged twice would be double-counted, so merge
+    refuses it.
+'''
+class PartialCounts:
+    def __init__(self, lemmas, pos, counts, totals, num_texts, sources):
+        self.lemmas = np.asarray(lemmas, dtype=str)
+        self.pos = np.asarray(pos, dtype=str)
+        self.counts = np.asarray(counts, dtype=np.int64).reshape(2, len(self.lemmas))
+        self.totals = np.asarray(totals, dtype=np.int64)
+        self.num_texts = np.asarray(num_texts, dtype=np.int64)
+        self.sources = list(sources)
+
+    def __len__(self):
+        return len(self.lemmas)
+
+    @staticmethod
+    def from_counters(fcounts, mcounts, num_texts=(0, 0), source=None, totals=None):
+        """
+        Builds a partial from female and male Counters of <lemma>,<pos> tuples. totals
+        defaults to the sums of the counts.
+        """
+        vocab = sorted(set(fcounts) | set(mcounts))
+        index = {word:i for i, word in enumerate(vocab)}
+        counts = np.zeros((2, len(vocab)), dtype=np.int64)
+        for g, group_counts in enumerate([fcounts, mcounts]):
+            for word, count in group_counts.items():
+                counts[g, index[word]] = count
+        if totals is None:
+            totals = counts.sum(axis=1)
+        return PartialCounts([w[0] for w in vocab], [w[1] for w in vocab], counts, totals, num_texts,
+                             [] if source is None else [source])
+
+    @staticmethod
+    def from_toks(f_toks_per_text, m_toks_per_text, source=None):
+        """
+        Counts the <lemma>,<pos> tuples of female and male token lists (or iterators
+        over them) into a partial.
+        """
+        counters = []
+        num_texts = []
+        for toks_per_text in [f_toks_per_text, m_toks_per_text]:
+            counter = Counter()
+            n = 0
+            for toks in toks_per_text:
+                counter.update((lemma, pos) for word, lemma, pos in toks)
+                n += 1
+            counters.append(counter)
+            num_texts.append(n)
+        return PartialCounts.from_counters(counters[0], counters[1], num_texts=num_texts, source=source)
+
+    @staticmethod
+    def merge(partials):
+        partials = list(partials)
+        sources = []
+        for partial in partials:
+            sources.extend(partial.sources)
+        duplicates = sorted(s for s, n in Counter(sources).items() if n > 1)
+        if len(duplicates) > 0:
+            raise ValueError('Sources merged more than once: {}'.format(duplicates))
+        lemmas, pos, inverse = unique_words(np.concatenate([p.lemmas for p in partials]),
+                                            np.concatenate([p.pos for p in partials]))
+        counts = np.zeros((2, len(lemmas)), dtype=np.int64)
+        for g in range(2):
+            weights = np.concatenate([p.counts[g] for p in partials])
+            # float64 sums are exact for counts below 2**53
+            counts[g] = np.bincount(inverse, weights=weights, minlength=len(lemmas)).astype(np.int64)
+        totals = np.sum([p.totals for p in partials], axis=0)
+        num_texts = np.sum([p.num_texts for p in partials], axis=0)
+        return PartialCounts(lemmas, pos, counts, totals, num_texts, sorted(sources))
+
+    def prune(self, min_count):
+        """
+        Returns a partial without the words that occur fewer than min_count times in
+        both groups together, keeping the totals, so it scores the same. Only prune
+        the final merged counts: a word that is rare in every shard can still be
+        frequent overall.
+        """
+        keep = self.counts.sum(axis=0) >= min_count
+        return PartialCounts(self.lemmas[keep], self.pos[keep], self.counts[:, keep], self.totals, self.num_texts,
+                             self.sources)
+
+    def words(self):
+        return list(zip(self.lemmas.tolist(), self.pos.tolist()))
+
+    def to_counters(self):
+        """
+        Returns fcounts and mcounts as Counters, and the totals, for
+        beta_scoring_from_counts.
+        """
+        words = self.words()
+        fcounts = Counter({words[i]:int(self.counts[0, i]) for i in np.flatnonzero(self.counts[0])})
+        mcounts = Counter({words[i]:int(self.counts[1, i]) for i in np.flatnonzero(self.counts[1])})
+        return fcounts, mcounts, (int(self.totals[0]), int(self.totals[1]))
+
+    def score(self, min_count=5, sort=False):
+        from score_words import beta_scoring_from_arrays
+        return beta_scoring_from_arrays(self.words(), self.counts[0], self.counts[1], min_count=min_count, sort=sort,
+                                        totals=self.totals)
+
+    def missing_shards(self):
+        """
+        Returns, for each <name>:<i>/<n> source family, the shard indices that are
+        not in this partial, so an incomplete merge can be caught before scoring.
+        """
+        found = {}
+        for source in self.sources:
+            match = re.match(r'^(.*):(\d+)/(\d+)$', source)
+            if match is not None:
+                found.setdefault((match.group(1), int(match.group(3))), set()).add(int(match.group(2)))
+        return {'{}/{}'.format(name, n):sorted(set(range(n)) - shards) for (name, n), shards in found.items()
+                if len(shards) < n}
+
+    def save(self, path):
+        meta = {'format_version':FORMAT_VERSION, 'sources':self.sources}
+        np.savez_compressed(path, lemmas=self.lemmas, pos=self.pos, counts=self.counts, totals=self.totals,
+                            num_texts=self.num_texts, meta=np.array(json.dumps(meta)))
+
+    @staticmethod
+    def load(path):
+        data = np.load(path, allow_pickle=False)
+        meta = json.loads(str(data['meta']))
+        if meta['format_version'] == 1:  # <lemma>\t<pos> keys
+            words = [key.split(KEY_SEP, 1) for key in data['vocab'].tolist()]
+            lemmas, pos = [w[0] for w in words], [w[1] for w in words]
+        elif meta['format_version'] == FORMAT_VERSION:
+            lemmas, pos = data['lemmas'], data['pos']
+        else:
+            raise ValueError('{} has partial-count format {}, expected {}'.format(path, meta['format_version'], FORMAT_VERSION))
+        return PartialCounts(lemmas, pos, data['counts'], data['totals'], data['num_texts'], meta['sources'])
+
+def unique_words(lemmas, pos):
+    """
+    Returns the distinct <lemma>,<pos> pairs of two aligned arrays, sorted by lemma and
+    then pos, as a lemma array and a pos array, plus the index of each input pair's
+    distinct pair (like np.unique with return_inverse).
+    """
+    order = np.lexsort((pos, lemmas))
+    sorted_lemmas, sorted_pos = lemmas[order], pos[order]
+    is_new = np.ones(len(order), dtype=bool)
+    is_new[1:] = (sorted_lemmas[1:] != sorted_lemmas[:-1]) | (sorted_pos[1:] != sorted_pos[:-1])
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.cumsum(is_new) - 1
+    return sorted_lemmas[is_new], sorted_pos[is_new], inverse
+
+def shard_source(corpus, shard, num_shards):
+    return '{}:{}/{}'.format(corpus, shard, num_shards)
+
+def count_processed_shard(corpus, shard, num_shards, out_path=None, seed=None):
+    """
+    Counts shard number shard (of num_shards) of a processed corpus ('celeb' or
+    'prof'): the texts at positions shard, shard + num_shards, ... of the balanced
+    female and male texts. Saves the partial to out_path if given, and returns it.
+    """
+    from shared_counts import load_corpus_toks
+    assert(0 <= shard < num_shards)
+    f_toks_per_text, m_toks_per_text = load_corpus_toks(corpus, seed=seed)
+    partial = PartialCounts.from_toks(f_toks_per_text[shard::num_shards], m_toks_per_text[shard::num_shards],
+                                      source=shard_source(corpus, shard, num_shards))
+    print('Counted shard {} of {}: {} words, {} texts'.format(shard, num_shards, len(partial), partial.num_texts.tolist()))
+    if out_path is not None:
+        partial.save(out_path)
+    return partial
+
+def split_processed_corpus(corpus, num_shards, out_dir, seed=None):
+    """
+    Balances a processed corpus once, and writes its shards as female and male token
+    shards, <out_dir>/<corpus>_f_<shard>.pkl and <corpus>_m_<shard>.pkl, holding the
+    texts at positions shard, shard + num_shards, ... of the balanced texts. Returns
+    the <female, male> shard paths of each shard, to count with count_token_shards
+    under the source name shard_source(corpus, shard, num_shards).
+    """
+    from external_count import append_token_shard
+    from shared_counts import load_corpus_toks
+    f_toks_per_text, m_toks_per_text = load_corpus_toks(corpus, seed=seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for shard in range(num_shards):
+        shard_paths = []
+        for gender, toks_per_text in [('f', f_toks_per_text), ('m', m_toks_per_text)]:
+            path = os.path.join(out_dir, '{}_{}_{:02d}.pkl'.format(corpus, gender, shard))
+            if os.path.isfile(path):
+                os.remove(path)  # token shards are appended to
+            append_token_shard(path, [(None, toks) for toks in toks_per_text[shard::num_shards]])
+            shard_paths.append(path)
+        paths.append(tuple(shard_paths))
+    print('Wrote {} shards of {} to {}'.format(num_shards, corpus, out_dir))
+    return paths
+
+def count_token_shards(f_shard_paths, m_shard_paths, source, out_path=None):
+    """
+    Counts female and male token shards (see external_count.append_token_shard) into
+    a partial, without balancing.
+    """
+    from external_count import iter_toks_per_text
+    partial = PartialCounts.from_toks(iter_toks_per_text(f_shard_paths), iter_toks_per_text(m_shard_paths), source=source)
+    if out_path is not None:
+        partial.save(out_path)
+    return partial
+
+def merge_files(paths, out_path):
+    PartialCounts.merge(PartialCounts.load(p) for p in paths).save(out_path)
+    return out_path
+
+def tree_merge(paths, out_path, fan_in=FAN_IN, processes=1, work_dir=None):
+    """
+    Merges partial-count files fan_in at a time, level by level, until one is left,
+    which is saved to out_path and returned. The merges of a level run in parallel
+    if processes > 1. Intermediate files go to work_dir (a temp dir by default) and
+    are removed once merged.
+    """
+    assert(fan_in >= 2)
+    paths = list(paths)
+    if len(paths) == 0:
+        raise ValueError('No partials to merge')
+    own_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix='merge_') if own_dir else work_dir
+    os.makedirs(work_dir, exist_ok=True)
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        level = 0
+        intermediate = set()
+        while len(paths) > 1:
+            groups = [paths[i:i+fan_in] for i in range(0, len(paths), fan_in)]
+            if len(groups) == 1:
+                outs = [out_path]
+            else:
+                outs = [os.path.join(work_dir, 'merge_{}_{}.npz'.format(level, j)) for j in range(len(groups))]
+            jobs = list(zip(groups, outs))
+            if pool is not None:
+                paths = pool.starmap(merge_files, jobs)
+            else:
+                paths = [merge_files(group, out) for group, out in jobs]
+            for group in groups:
+                for p in group:
+                    if p in intermediate:
+                        os.remove(p)
+            intermediate = set(outs) - {out_path}
+            print('Merged level {}: {} partials left'.format(level, len(paths)))
+            level += 1
+        if paths[0] != out_path:
+            shutil.copyfile(paths[0], out_path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return PartialCounts.load(out_path)
+
+def run_local(corpus, num_shards, out_path, processes=1, fan_in=FAN_IN, work_dir=None, seed=None):
+    """
+    Runs the whole map-reduce on this machine: balances the corpus once and splits it
+    into token shards, counts every shard in a pool of processes, then tree-merges
+    the partials into out_path. Gives the same counts as running the shards and
+    merges on separate nodes.
+    """
+    own_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix='partials_') if own_dir else work_dir
+    os.makedirs(work_dir, exist_ok=True)
+    shard_paths = split_processed_corpus(corpus, num_shards, os.path.join(work_dir, 'shards'), seed=seed)
+    paths = [os.path.join(work_dir, '{}_{}.npz'.format(corpus, i)) for i in range(num_shards)]
+    jobs = [([f_path], [m_path], shard_source(corpus, i, num_shards), path)
+            for i, ((f_path, m_path), path) in enumerate(zip(shard_paths, paths))]
+    try:
+        if processes > 1:
+            with Pool(processes) as pool:
+                pool.starmap(count_token_shards, jobs)
+        else:
+            for job in jobs:
+                count_token_shards(*job)
+        return tree_merge(paths, out_path, fan_in=fan_in, processes=processes, work_dir=os.path.join(work_dir, 'merge'))
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def score_partial(partial, min_count=5, lex_path=None, top_n=25):
+    """
+    Scores merged counts like score_words does, optionally saving the associations
+    as a lex.pkl, and prints the significant words per pos.
+    """
+    from score_words import filter_associations_on_lemma_and_pos, filter_associations_on_p, print_top_n_per_pos
+    missing = partial.missing_shards()
+    if len(missing) > 0:
+        print('Warning: missing shards {}'.format(missing))
+    f_ass, m_ass = partial.score(min_count=min_count, sort=lex_path is not None)  # a saved lex.pkl is sorted by p-value
+    if lex_path is not None:
+        from artifacts import save_processed
+        save_processed(lex_path, (f_ass, m_ass), 'lex')
+    f_ass = filter_associations_on_lemma_and_pos(f_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
+    m_ass = filter_associations_on_lemma_and_pos(m_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
+    alpha = 0.05 / max(len(f_ass) + len(m_ass), 1)  # Bonferroni correction
+    print_top_n_per_pos(filter_associations_on_p(f_ass, alpha), filter_associations_on_p(m_ass, alpha), top_n=top_n)
+
+def main():
+    parser = argparse.ArgumentParser(description='Count, merge, and score partial counts.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    count_parser = subparsers.add_parser('count', help='count one shard into a partial')
+    count_parser.add_argument('--corpus', choices=['celeb', 'prof'], default=None)
+    count_parser.add_argument('--shard', type=int, default=0)
+    count_parser.add_argument('--num-shards', type=int, default=1)
+    count_parser.add_argument('--seed', type=int, default=None, help='balance with a seeded sample instead of truncating')
+    count_parser.add_argument('--f-shards', nargs='+', default=None, help='female token shards (instead of --corpus)')
+    count_parser.add_argument('--m-shards', nargs='+', default=None, help='male token shards (instead of --corpus)')
+    count_parser.add_argument('--source', default=None, help='name of the token shards\' partial')
+    count_parser.add_argument('--out', required=True)
+    split_parser = subparsers.add_parser('split', help='balance a corpus once and write its shards as token shards')
+    split_parser.add_argument('--corpus', choices=['celeb', 'prof'], required=True)
+    split_parser.add_argument('--num-shards', type=int, default=8)
+    split_parser.add_argument('--seed', type=int, default=None)
+    split_parser.add_argument('--out-dir', required=True)
+    merge_parser = subparsers.add_parser('merge', help='tree-merge partials')
+    merge_parser.add_argument('partials', nargs='+')
+    merge_parser.add_argument('--out', required=True)
+    merge_parser.add_argument('--fan-in', type=int, default=FAN_IN)
+    merge_parser.add_argument('--processes', type=int, default=1)
+    merge_parser.add_argument('--work-dir', default=None)
+    score_parser = subparsers.add_parser('score', help='score merged counts')
+    score_parser.add_argument('counts')
+    score_parser.add_argument('--min-count', type=int, default=5)
+    score_parser.add_argument('--top-n', type=int, default=25)
+    score_parser.add_argument('--out', default=None, help='where to save the associations as a lex.pkl')
+    local_parser = subparsers.add_parser('local', help='count all shards and merge them on this machine')
+    local_parser.add_argument('--corpus', choices=['celeb', 'prof'], required=True)
+    local_parser.add_argument('--num-shards', type=int, default=8)
+    local_parser.add_argument('--processes', type=int, default=1)
+    local_parser.add_argument('--fan-in', type=int, default=FAN_IN)
+    local_parser.add_argument('--seed', type=int, default=None)
+    local_parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    if args.command == 'count':
+        if args.corpus is not None:
+            count_processed_shard(args.corpus, args.shard, args.num_shards, out_path=args.out, seed=args.seed)
+        else:
+            if args.f_shards is None or args.m_shards is None or args.source is None:
+                parser.error('count needs --corpus, or --f-shards, --m-shards, and --source')
+            count_token_shards(args.f_shards, args.m_shards, args.source, out_path=args.out)
+    elif args.command == 'split':
+        split_processed_corpus(args.corpus, args.num_shards, args.out_dir, seed=args.seed)
+    elif args.command == 'merge':
+        merged = tree_merge(args.partials, args.out, fan_in=args.fan_in, processes=args.processes, work_dir=args.work_dir)
+        print('Merged {} partials: {} words, totals {}'.format(len(args.partials), len(merged), merged.totals.tolist()))
+    elif args.command == 'score':
+        score_partial(PartialCounts.load(args.counts), min_count=args.min_count, lex_path=args.out, top_n=args.top_n)
+    else:
+        merged = run_local(args.corpus, args.num_shards, args.out, processes=args.processes, fan_in=args.fan_in,
+                           seed=args.seed)
+        print('Counted {} words, totals {}'.format(len(merged), merged.totals.tolist()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+Runs the preprocess -> count -> score -> filter pipeline for the celeb and professor
+corpora, skipping the stages whose outputs are up to date.
+
+    python pipeline.py                       # run whatever is out of date
+    python pipeline.py --alpha 0.01          # only the filter stages rerun
+    python pipeline.py --corpora prof --dry-run
+    python pipeline.py --force count_prof    # rerun a stage (and everything after it)
+
+Each stage declares its input and output files, the modules its code lives in, and
+its parameters. A stage's fingerprint is a hash of all three; it is recorded in a
+manifest after the stage succeeds, and the stage is skipped on later runs as long as
+its fingerprint and the fingerprints of its outputs are unchanged. Stages whose
+dependencies are done run in parallel, except for stages that share a resource,
+which run one at a time. The preprocess stages share none: each corpus and gender
+has its own dedup index, and every stage opens its own connection to the on-disk
+NLP cache (see nlp_cache).
+"""
+import argparse
+import hashlib
+import json
+from multiprocessing import Pool
+import os
+import time
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+PATH_TO_MANIFEST = '../processed/pipeline_manifest.json'
+CORPORA = ['celeb', 'prof']
+DEFAULT_PARAMS = {'seed':None, 'stratify_by':None, 'min_count':5, 'alpha':0.05,
+                  'valid_pos':['NOUN', 'VERB', 'ADJ'], 'single_pass':False,
+                  'nlp_cache':True, 'dedup':True, 'top_n':100, 'tagger':None}
+
+# ========== FINGERPRINTS ==========
+def fingerprint_path(path, with_artifact=True):
+    """
+    Returns a cheap fingerprint of a file or folder, based on sizes and modification
+    times (of every file, for a folder), or None if it does not exist. The
+    fingerprint of a processed .pkl also covers the artifact that save_processed
+    writes instead in artifact mode, if there is one.
+    """
+    if with_artifact and path.endswith('.pkl'):
+        from artifacts import artifact_path_for
+        art_path = artifact_path_for(path)
+        if os.path.isfile(art_path):
+            return fingerprint_params([fingerprint_path(path, with_artifact=False), fingerprint_path(art_path)])
+    if not os.path.exists(path):
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fn in sorted(files):
+                st = os.stat(os.path.join(root, fn))
+                h.update('{}|{}|{}\n'.format(os.path.relpath(os.path.join(root, fn), path), st.st_size, st.st_mtime_ns).encode('utf-8'))
+    else:
+        st = os.stat(path)
+        h.update('{}|{}'.format(st.st_size, st.st_mtime_ns).encode('utf-8'))
+    return h.hexdigest()
+
+def fingerprint_code(modules):
+    h = hashlib.blake2b(digest_size=16)
+    for module in sorted(modules):
+        with open(os.path.join(CODE_DIR, module), 'rb') as f:
+            h.update(module.encode('utf-8'))
+            h.update(f.read())
+    return h.hexdigest()
+
+def fingerprint_params(params):
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+def load_manifest(path=PATH_TO_MANIFEST):
+    if os.path.isfile(path):
+        return json.load(open(path, 'r'))
+    return {}
+
+def save_manifest(manifest, path=PATH_TO_MANIFEST):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+'''
+    This class is one pipeline stage. fn is a top-level function (so it can run in a
+    worker process) that is called as fn(*args, params, incremental), where params
+    holds the stage's parameters, and incremental is True if the stage has run before
+    with the same code and parameters, so only its inputs changed (e.g. new articles
+    were crawled), and it can build on its previous outputs instead of starting over.
+'''
+class PipelineStage:
+    def __init__(self, name, fn, args=(), inputs=(), outputs=(), code=(), params=None, deps=(), resources=()):
+        self.name = name
+        self.fn = fn
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.params = params or {}
+        self.deps = list(deps)
+        self.resources = set(resources)
+
+    def recipe(self):
+        """
+        Returns the fingerprint of the stage's code and parameters.
+        """
+        return fingerprint_params({'code':fingerprint_code(self.code), 'params':self.params})
+
+    def fingerprint(self):
+        """
+        Returns the fingerprint of the stage's code, parameters, and inputs.
+        """
+        inputs = {path:fingerprint_path(path) for path in self.inputs}
+        return fingerprint_params({'recipe':self.recipe(), 'inputs':inputs})
+
+    def outputs_fingerprint(self):
+        return {path:fingerprint_path(path) for path in self.outputs}
+
+'''
+    This class runs a set of stages in dependency order. A stage is current if the
+    manifest has its fingerprint, and its outputs still exist unchanged; current stages
+    are skipped, and a stage always runs if one of its dependencies ran.
+'''
+class PipelineRunner:
+    def __init__(self, stages, manifest_path=PATH_TO_MANIFEST, processes=4):
+        self.stages = {stage.name:stage for stage in stages}
+        self.manifest_path = manifest_path
+        self.manifest = load_manifest(manifest_path)
+        self.processes = processes
+        for stage in stages:
+            for dep in stage.deps:
+                assert(dep in self.stages), 'Unknown dependency {} of {}'.format(dep, stage.name)
+
+    def is_current(self, stage):
+        record = self.manifest.get(stage.name)
+        if record is None or record['fingerprint'] != stage.fingerprint():
+            return False
+        outputs = stage.outputs_fingerprint()
+        return all(fp is not None for fp in outputs.values()) and outputs == record['outputs']
+
+    def plan(self, force=()):
+        """
+        Returns the names of the stages that need to run, in dependency order.
+        """
+        order = self._topological_order()
+        to_run = []
+        for name in order:
+            stage = self.stages[name]
+            if name in force or any(dep in to_run for dep in stage.deps) or not self.is_current(stage):
+                to_run.append(name)
+        return to_run
+
+    def _topological_order(self):
+        order = []
+        visiting = set()
+        def visit(name):
+            if name in order:
+                return
+            assert(name not in visiting), 'Cycle at stage {}'.format(name)
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def run(self, force=(), dry_run=False):
+        to_run = self.plan(force)
+        skipped = [name for name in self._topological_order() if name not in to_run]
+        for name in skipped:
+            print('Up to date: {}'.format(name))
+        if dry_run or len(to_run) == 0:
+            for name in to_run:
+                print('Would run: {}'.format(name))
+            return to_run
+        pending = list(to_run)
+        running = {}  # name -> <AsyncResult, start time>
+        done = set()
+        pool = Pool(self.processes)
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    deps_done = all(dep in done or dep not in to_run for dep in stage.deps)
+                    busy = set().union(*[self.stages[r].resources for r in running]) if running else set()
+                    if deps_done and len(stage.resources & busy) == 0:
+                        pending.remove(name)
+                        record = self.manifest.get(name)
+                        incremental = (record is not None and record.get('recipe') == stage.recipe()
+                                       and all(os.path.exists(path) for path in stage.outputs))
+                        print('Running stage: {}{}'.format(name, ' (incremental)' if incremental else ''))
+                        running[name] = (pool.apply_async(stage.fn, stage.args + (stage.params, incremental)), time.time())
+                finished = [name for name, (result, _) in running.items() if result.ready()]
+                if len(finished) == 0:
+                    time.sleep(0.1)
+                    continue
+                for name in finished:
+                    result, start = running.pop(name)
+                    result.get()  # re-raises the stage's error, which stops the pipeline
+                    stage = self.stages[name]
+                    self.manifest[name] = {'fingerprint':stage.fingerprint(), 'recipe':stage.recipe(),
+                                           'outputs':stage.outputs_fingerprint(), 'finished':time.time(),
+                                           'elapsed_sec':round(time.time() - start, 3)}
+                    save_manifest(self.manifest, self.manifest_path)
+                    done.add(name)
+                    print('Finished stage: {} ({:.1f}s)'.format(name, time.time() - start))
+        finally:
+            pool.close()
+            pool.join()
+        return to_run
+
+# ========== STAGE FUNCTIONS ==========
+def run_preprocess(corpus, gender, params, incremental):
+    from data_loader import CELEB_PATH, PROF_PATH
+    from nlp_cache import SentenceCache
+    import preprocessing
+    cache = SentenceCache(path=preprocessing.PATH_TO_NLP_CACHE) if params['nlp_cache'] else None
+    if corpus == 'celeb':
+        make_fn = preprocessing.make_celeb_toks_per_text
+        index_path = preprocessing.PATH_TO_CELEB_DEDUP_INDEX.format(gender)
+        raw_path = CELEB_PATH
+    else:
+        make_fn = preprocessing.make_prof_toks_per_text
+        index_path = preprocessing.PATH_TO_PROF_DEDUP_INDEX.format(gender)
+        raw_path = PROF_PATH
+    tagger = None
+    if params.get('tagger') is not None:
+        from taggers import get_tagger
+        tagger = get_tagger(params['tagger'])
+    make_fn(gender, continue_work=incremental, single_pass=params['single_pass'], cache=cache,
+            dedup_index_path=index_path if params['dedup'] else None, tagger=tagger, path_to_corpus=raw_path)
+    if cache is not None:
+        cache.close()
+
+def run_count(corpus, params, incremental):
+    from artifacts import save_processed
+    import score_words
+    stratify_by = params['stratify_by']
+    if corpus == 'celeb':
+        counts = score_words.get_tok_counts_from_balanced_celeb_corpus(seed=params['seed'], stratify_by=stratify_by)
+    else:
+        counts = score_words.get_tok_counts_from_balanced_prof_corpus(seed=params['seed'], stratify_by=stratify_by)
+    save_processed(processed_path(corpus) + 'counts.pkl', counts, 'counts')
+
+def run_score(corpus, params, incremental):
+    from artifacts import load_processed, save_processed
+    import score_words
+    f_counts, m_counts = load_processed(processed_path(corpus) + 'counts.pkl')
+    f_ass, m_ass = score_words.beta_scoring_from_counts(f_counts, m_counts, min_count=params['min_count'])
+    save_processed(processed_path(corpus) + 'lex.pkl', (f_ass, m_ass), 'lex')
+
+def run_filter(corpus, params, incremental):
+    from artifacts import load_processed, save_processed
+    import score_words
+    f_ass, m_ass = load_processed(processed_path(corpus) + 'lex.pkl')
+    f_ass = score_words.filter_associations_on_lemma_and_pos(f_ass, valid_pos=set(params['valid_pos']))
+    m_ass = score_words.filter_associations_on_lemma_and_pos(m_ass, valid_pos=set(params['valid_pos']))
+    alpha = params['alpha'] / max(len(f_ass) + len(m_ass), 1)  # Bonferroni correction
+    sig_f_ass = score_words.filter_associations_on_p(f_ass, p_thresh=alpha)
+    sig_m_ass = score_words.filter_associations_on_p(m_ass, p_thresh=alpha)
+    print('{}: {} sig words (adjusted alpha={})'.format(corpus, len(sig_f_ass) + len(sig_m_ass), alpha))
+    save_processed(processed_path(corpus) + 'sig_lex.pkl', (sig_f_ass, sig_m_ass), 'lex')
+    score_words.print_top_n_per_pos(sig_f_ass, sig_m_ass, top_n=params['top_n'], pos_set=tuple(params['valid_pos']))
+
+# ========== STAGES ==========
+def processed_path(corpus):
+    return '../processed/celeb/' if corpus == 'celeb' else '../processed/professor/'
+
+def make_stages(params, corpora=CORPORA):
+    """
+    Returns the stages of the pipeline for the given corpora and parameters. Each
+    stage only gets the parameters it uses, so that changing a scoring parameter
+    does not invalidate the upstream stages.
+    """
+    from data_loader import CELEB_PATH, PROF_PATH
+    preprocess_code = ['preprocessing.py', 'data_loader.py', 'dedup.py', 'nlp_cache.py', 'corpus_store.py']
+    stages = []
+    for corpus in corpora:
+        out_dir = processed_path(corpus)
+        raw_path = CELEB_PATH if corpus == 'celeb' else PROF_PATH
+        unit = 'article' if corpus == 'celeb' else 'review'
+        preprocess_params = {k:params[k] for k in ['single_pass', 'nlp_cache', 'dedup']}
+        stage_code = preprocess_code
+        if params.get('tagger') is not None:  # only then, so that default fingerprints stay the same
+            preprocess_params['tagger'] = params['tagger']
+            stage_code = preprocess_code + ['taggers.py']
+        for gender in ['f', 'm']:
+            stages.append(PipelineStage('preprocess_{}_{}'.format(corpus, gender), run_preprocess, args=(corpus, gender),
+                                        inputs=[raw_path],
+                                        outputs=[out_dir + '{}_toks_per_{}.pkl'.format(gender, unit),
+                                                 out_dir + '{}_toks_per_sent.pkl'.format(gender)],
+                                        code=stage_code, params=preprocess_params))
+        stages.append(PipelineStage('count_' + corpus, run_count, args=(corpus,),
+                                    inputs=[out_dir + '{}_toks_per_{}.pkl'.format(g, unit) for g in ['f', 'm']],
+                                    outputs=[out_dir + 'counts.pkl'], code=['score_words.py', 'sampling.py'],
+                                    params={k:params[k] for k in ['seed', 'stratify_by']},
+                                    deps=['preprocess_{}_f'.format(corpus), 'preprocess_{}_m'.format(corpus)]))
+        stages.append(PipelineStage('score_' + corpus, run_score, args=(corpus,), inputs=[out_dir + 'counts.pkl'],
+                                    outputs=[out_dir + 'lex.pkl'], code=['score_words.py'],
+                                    params={'min_count':params['min_count']}, deps=['count_' + corpus]))
+        stages.append(PipelineStage('filter_' + corpus, run_filter, args=(corpus,), inputs=[out_dir + 'lex.pkl'],
+                                    outputs=[out_dir + 'sig_lex.pkl'], code=['score_words.py'],
+                                    params={k:params[k] for k in ['alpha', 'valid_pos', 'top_n']},
+                                    deps=['score_' + corpus]))
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the pipeline, skipping up-to-date stages.')
+    parser.add_argument('--corpora', nargs='+', choices=CORPORA, default=CORPORA)
+    parser.add_argument('--seed', type=int, default=DEFAULT_PARAMS['seed'])
+    parser.add_argument('--stratify-by', nargs='+', default=DEFAULT_PARAMS['stratify_by'])
+    parser.add_argument('--min-count', type=int, default=DEFAULT_PARAMS['min_count'])
+    parser.add_argument('--alpha', type=float, default=DEFAULT_PARAMS['alpha'])
+    parser.add_argument('--valid-pos', nargs='+', default=DEFAULT_PARAMS['valid_pos'])
+    parser.add_argument('--top-n', type=int, default=DEFAULT_PARAMS['top_n'])
+    parser.add_argument('--single-pass', action='store_true')
+    parser.add_argument('--tagger', default=None, help='tagging backend of taggers.py (default: full spaCy pipeline)')
+    parser.add_argument('--no-nlp-cache', action='store_true')
+    parser.add_argument('--no-dedup', action='store_true')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--force', nargs='+', default=[], help='stages to rerun even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--manifest', default=PATH_TO_MANIFEST)
+    args = parser.parse_args()
+
+    params = dict(DEFAULT_PARAMS, seed=args.seed, stratify_by=args.stratify_by, min_count=args.min_count,
+                  alpha=args.alpha, valid_pos=args.valid_pos, top_n=args.top_n, single_pass=args.single_pass,
+                  nlp_cache=not args.no_nlp_cache, dedup=not args.no_dedup, tagger=args.tagger)
+    runner = PipelineRunner(make_stages(params, corpora=args.corpora), manifest_path=args.manifest, processes=args.processes)
+    runner.run(force=set(args.force), dry_run=args.dry_run)
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,42 @@
-from data_loader import CelebDataLoader, ProfDataLoader
+from artifacts import load_processed, save_processed
+from data_loader import CELEB_PATH, PROF_PATH, CelebDataLoader, ProfDataLoader
+from dedup import dedup_texts, load_or_create_index
+from instrumentation import Progress, timed
+from nlp_cache import SentenceCache
 from nltk import sent_tokenize
-import pickle
 import spacy
+from taggers import spacy_model_id
 
 PATH_TO_CELEB_PROCESSED = '../processed/celeb/'
 PATH_TO_PROF_PROCESSED = '../processed/professor/'
+PATH_TO_NLP_CACHE = '../processed/nlp_cache.sqlite'
+PATH_TO_CELEB_DEDUP_INDEX = PATH_TO_CELEB_PROCESSED + '{}_minhash_index.pkl'  # one index per gender
+PATH_TO_PROF_DEDUP_INDEX = PATH_TO_PROF_PROCESSED + '{}_minhash_index.pkl'
 
 nlp = spacy.load('en_core_web_sm')
+_SENT_NAMESPACE = 'sent:' + spacy_model_id(nlp)  # cached outputs of nlp are not reused by another model version
+_doc_nlps = {}  # whole-document pipelines for single-pass mode, loaded on first use
+_PENDING = object()
 
-def make_celeb_toks_per_text(gender, continue_work=True):
+def make_celeb_toks_per_text(gender, continue_work=True, single_pass=False, cache=None, dedup_index_path=None, tagger=None,
+                             path_to_corpus=CELEB_PATH):
     """
     Pre-processes the raw text data from the Celeb data loader.
     Two types of pre-processing are saved - at the article-level and at the
     sentence-level - and each pre-processed text is linked to the article ID
     that it came from. Saving article IDs also prevents repeating work (if
-    continue_work is True).
+    continue_work is True). If single_pass is True, each article is run through
+    spaCy once instead of sentence by sentence. If a SentenceCache is given,
+    repeated text is not re-parsed. If dedup_index_path is given, new articles that
+    are near-duplicates of ones in that MinHash index are dropped, and the rest are
+    added to it; each gender should have its own index (e.g.
+    PATH_TO_CELEB_DEDUP_INDEX.format(gender)), so that articles about one gender are
+    never dropped as duplicates of the other's. If a tagger is given, it is used instead of the full spaCy pipeline.
+    The articles of all three sites are read from path_to_corpus.
     """
     if continue_work:
-        old_toks_per_article = pickle.load(open(PATH_TO_CELEB_PROCESSED + '{}_toks_per_article.pkl'.format(gender), 'rb'))
-        old_toks_per_sent = pickle.load(open(PATH_TO_CELEB_PROCESSED + '{}_toks_per_sent.pkl'.format(gender), 'rb'))
+        old_toks_per_article = load_processed(PATH_TO_CELEB_PROCESSED + '{}_toks_per_article.pkl'.format(gender))
+        old_toks_per_sent = load_processed(PATH_TO_CELEB_PROCESSED + '{}_toks_per_sent.pkl'.format(gender))
         old_article_ids = set([tuple[0] for tuple in old_toks_per_article])
     else:
         old_toks_per_article = []
@@ -27,34 +45,46 @@ def make_celeb_toks_per_text(gender, continue_work=True):
     print('Already processed {} articles and {} sentences.'.format(len(old_toks_per_article), len(old_toks_per_sent)))
     articles = []
     article_ids = []
-    for dataset in ['people', 'usweekly', 'eonline']:
-        dl = CelebDataLoader(dataset)
-        entries = dl.get_female_entries() if gender == 'f' else dl.get_male_entries()
-        for e in entries:
-            article_id = dataset + '_' + e['id']
-            if article_id not in old_article_ids:
-                articles.append(e['text'])
-                article_ids.append(article_id)
+    dl = CelebDataLoader(path_to_corpus)
+    entries = dl.get_female_entries() if gender == 'f' else dl.get_male_entries()
+    for e in entries:
+        article_id = e['site'] + '_' + e['id']
+        if article_id not in old_article_ids:
+            articles.append(e['text'])
+            article_ids.append(article_id)
+    if dedup_index_path is not None:
+        index = load_or_create_index(dedup_index_path)
+        article_ids, articles, _ = dedup_texts(article_ids, articles, index=index)
+        index.save(dedup_index_path)
     print('Processing {} new articles...'.format(len(articles)))
-    toks_per_article, toks_per_sent, sent_ids = texts_to_pos_toks(article_ids, articles, verbose=True)
+    with timed('preprocess_celeb', gender=gender):
+        toks_per_article, toks_per_sent, sent_ids = texts_to_pos_toks(article_ids, articles, verbose=True, single_pass=single_pass, cache=cache, tagger=tagger)
     print('Done! {} new articles, {} new sentences.'.format(len(toks_per_article), len(toks_per_sent)))
     new_toks_per_article = list(zip(article_ids, toks_per_article))
-    pickle.dump(old_toks_per_article + new_toks_per_article, open(PATH_TO_CELEB_PROCESSED + '{}_toks_per_article.pkl'.format(gender), 'wb'))
+    save_processed(PATH_TO_CELEB_PROCESSED + '{}_toks_per_article.pkl'.format(gender), old_toks_per_article + new_toks_per_article, 'toks')
     new_toks_per_sent = list(zip(sent_ids, toks_per_sent))
-    pickle.dump(old_toks_per_sent + new_toks_per_sent, open(PATH_TO_CELEB_PROCESSED + '{}_toks_per_sent.pkl'.format(gender), 'wb'))
+    save_processed(PATH_TO_CELEB_PROCESSED + '{}_toks_per_sent.pkl'.format(gender), old_toks_per_sent + new_toks_per_sent, 'toks')
 
-def make_prof_toks_per_text(gender, continue_work=True):
+def make_prof_toks_per_text(gender, continue_work=True, single_pass=False, cache=None, dedup_index_path=None, tagger=None,
+                            path_to_corpus=PROF_PATH):
     """
     Pre-processes the raw text data from the Rate My Professor data loader.
     Two types of pre-processing are saved - at the review-level and at the
     sentence-level - and each pre-processed text is linked to the review ID
     that it came from. Saving review IDs also prevents repeating work (if
-    continue_work is True).
+    continue_work is True). If single_pass is True, each review is run through
+    spaCy once instead of sentence by sentence. If a SentenceCache is given,
+    repeated text is not re-parsed. If dedup_index_path is given, new reviews that
+    are near-duplicates of ones in that MinHash index are dropped, and the rest are
+    added to it; each gender should have its own index (e.g.
+    PATH_TO_PROF_DEDUP_INDEX.format(gender)), so that reviews of one gender are never
+    dropped as duplicates of the other's. If a tagger is given, it is used instead of the full spaCy pipeline.
+    The professor files are read from path_to_corpus.
     """
-    dl = ProfDataLoader()
+    dl = ProfDataLoader(path_to_corpus)
     if continue_work:
-        old_toks_per_review = pickle.load(open(PATH_TO_PROF_PROCESSED + '{}_toks_per_review.pkl'.format(gender), 'rb'))
-        old_toks_per_sent = pickle.load(open(PATH_TO_PROF_PROCESSED + '{}_toks_per_sent.pkl'.format(gender), 'rb'))
+        old_toks_per_review = load_processed(PATH_TO_PROF_PROCESSED + '{}_toks_per_review.pkl'.format(gender))
+        old_toks_per_sent = load_processed(PATH_TO_PROF_PROCESSED + '{}_toks_per_sent.pkl'.format(gender))
         old_review_ids = set([tuple[0] for tuple in old_toks_per_review])
     else:
         old_toks_per_review = []
@@ -71,38 +101,188 @@ def make_prof_toks_per_text(gender, continue_work=True):
             if review_id not in old_review_ids:
                 reviews.append(text)
                 review_ids.append(review_id)
+    if dedup_index_path is not None:
+        index = load_or_create_index(dedup_index_path)
+        review_ids, reviews, _ = dedup_texts(review_ids, reviews, index=index)
+        index.save(dedup_index_path)
     print('Processing {} new reviews...'.format(len(reviews)))
-    toks_per_review, toks_per_sent, sent_ids = texts_to_pos_toks(review_ids, reviews, verbose=True)
+    with timed('preprocess_prof', gender=gender):
+        toks_per_review, toks_per_sent, sent_ids = texts_to_pos_toks(review_ids, reviews, verbose=True, single_pass=single_pass, cache=cache, tagger=tagger)
     print('Done! {} new reviews, {} new sentences.'.format(len(toks_per_review), len(toks_per_sent)))
     new_toks_per_review = list(zip(review_ids, toks_per_review))
-    pickle.dump(old_toks_per_review + new_toks_per_review, open(PATH_TO_PROF_PROCESSED + '{}_toks_per_review.pkl'.format(gender), 'wb'))
+    save_processed(PATH_TO_PROF_PROCESSED + '{}_toks_per_review.pkl'.format(gender), old_toks_per_review + new_toks_per_review, 'toks')
     new_toks_per_sent = list(zip(sent_ids, toks_per_sent))
-    pickle.dump(old_toks_per_sent + new_toks_per_sent, open(PATH_TO_PROF_PROCESSED + '{}_toks_per_sent.pkl'.format(gender), 'wb'))
+    save_processed(PATH_TO_PROF_PROCESSED + '{}_toks_per_sent.pkl'.format(gender), old_toks_per_sent + new_toks_per_sent, 'toks')
 
-def texts_to_pos_toks(text_ids, texts, verbose=False):
+def texts_to_pos_toks(text_ids, texts, verbose=False, single_pass=False, sent_mode='parser', batch_size=64, cache=None,
+                      tagger=None):
     """
     Tokenizes sentences, then runs each sentence through a parser.
     Each token is represented by a tuple: <original_form, lemma, pos>
+    If verbose, progress (docs, sentences, and tokens per second) is reported.
+    If single_pass is True, each text is instead run through spaCy once and split
+    into sentences by the pipeline itself (see _texts_to_pos_toks_single_pass).
+    If a SentenceCache is given, sentences (or, in single-pass mode, whole texts)
+    that have been parsed before are looked up instead of parsed again.
+    If a tagger from taggers.py is given, sentences are tagged by it instead of by the
+    full spaCy pipeline, batch_size texts at a time (see _texts_to_pos_toks_with_tagger).
     """
+    if tagger is not None:
+        if single_pass:
+            raise ValueError('single_pass runs its own spaCy pipelines and cannot be combined with a tagger')
+        return _texts_to_pos_toks_with_tagger(text_ids, texts, tagger, verbose=verbose, batch_size=batch_size,
+                                              cache=cache)
+    if single_pass:
+        return _texts_to_pos_toks_single_pass(text_ids, texts, verbose=verbose, sent_mode=sent_mode,
+                                              batch_size=batch_size, cache=cache)
     toks_per_text = []
     toks_per_sent = []
     sent_ids = []
+    progress = Progress('texts_to_pos_toks', total=len(texts), stall_sec=600) if verbose else None
     for i, (tid, text) in enumerate(zip(text_ids, texts)):
         text_toks = []
         sents = sent_tokenize(text)
         for sent in sents:
-            sent_toks = _sent_to_pos_toks(sent)
+            sent_toks = _sent_to_pos_toks(sent, cache=cache)
             toks_per_sent.append(sent_toks)
             sent_ids.append(tid)
             text_toks += sent_toks
         toks_per_text.append(text_toks)
-        if verbose and i % 1000 == 0:
-            print(i)
+        if progress is not None:
+            progress.update(docs=1, sents=len(sents), toks=len(text_toks))
+    if progress is not None:
+        progress.finish()
+    if cache is not None:
+        cache.report()
     return toks_per_text, toks_per_sent, sent_ids
 
-def _sent_to_pos_toks(sent):
+def _texts_to_pos_toks_single_pass(text_ids, texts, verbose=False, sent_mode='parser', batch_size=64, cache=None):
+    """
+    Runs each whole text through spaCy once, in batches, and takes the sentence
+    boundaries from the pipeline: from the dependency parser if sent_mode is
+    'parser', or from the rule-based sentencizer (with the parser disabled) if
+    sent_mode is 'sentencizer'. Unused components (NER) are disabled. Returns the
+    same outputs as texts_to_pos_toks.
+    """
+    doc_nlp = _get_doc_nlp(sent_mode)
+    namespace = 'doc:{}:{}'.format(sent_mode, spacy_model_id(doc_nlp))
+    cached = [None] * len(texts)
+    to_parse = set()
+    if cache is not None:
+        for i, text in enumerate(texts):
+            if text in to_parse:
+                cached[i] = _PENDING  # repeated within this batch; parsed at its first occurrence
+            else:
+                cached[i] = cache.get(text, namespace=namespace)
+                if cached[i] is None:
+                    to_parse.add(text)
+    docs = doc_nlp.pipe((text for text, toks in zip(texts, cached) if toks is None), batch_size=batch_size)
+    parsed = {}
+    toks_per_text = []
+    toks_per_sent = []
+    sent_ids = []
+    progress = Progress('texts_to_pos_toks', total=len(texts), stall_sec=600) if verbose else None
+    for tid, text, sents_toks in zip(text_ids, texts, cached):
+        if sents_toks is _PENDING:
+            sents_toks = parsed[text]
+        elif sents_toks is None:
+            sents_toks = _doc_to_sents_toks(next(docs))
+            if cache is not None:
+                cache.put(text, sents_toks, namespace=namespace)
+                parsed[text] = sents_toks
+        text_toks = []
+        for sent_toks in sents_toks:
+            toks_per_sent.append(sent_toks)
+            sent_ids.append(tid)
+            text_toks += sent_toks
+        toks_per_text.append(text_toks)
+        if progress is not None:
+            progress.update(docs=1, sents=len(sents_toks), toks=len(text_toks))
+    if progress is not None:
+        progress.finish()
+    if cache is not None:
+        cache.report()
+    return toks_per_text, toks_per_sent, sent_ids
+
+def _texts_to_pos_toks_with_tagger(text_ids, texts, tagger, verbose=False, batch_size=64, cache=None):
+    """
+    Splits texts into sentences like texts_to_pos_toks, and tags the sentences of
+    batch_size texts at a time with one tag_sents call of the tagger. Cached
+    sentences are namespaced by the tagger's name and model, so that the outputs of
+    different taggers (or model versions) are not mixed up. Returns the same outputs as texts_to_pos_toks.
+    """
+    namespace = 'sent:{}:{}'.format(tagger.name, tagger.model_id())
+    toks_per_text = []
+    toks_per_sent = []
+    sent_ids = []
+    progress = Progress('texts_to_pos_toks', total=len(texts), stall_sec=600) if verbose else None
+    for start in range(0, len(texts), batch_size):
+        batch_sents = [sent_tokenize(text) for text in texts[start:start+batch_size]]
+        batch_toks = [[None] * len(sents) for sents in batch_sents]
+        to_tag = {}  # sentence -> positions to fill in
+        for i, sents in enumerate(batch_sents):
+            for j, sent in enumerate(sents):
+                if cache is not None and sent not in to_tag:
+                    batch_toks[i][j] = cache.get(sent, namespace=namespace)
+                if batch_toks[i][j] is None:
+                    to_tag.setdefault(sent, []).append((i, j))
+        for sent, sent_toks in zip(to_tag, tagger.tag_sents(list(to_tag))):
+            if cache is not None:
+                cache.put(sent, sent_toks, namespace=namespace)
+            for i, j in to_tag[sent]:
+                batch_toks[i][j] = sent_toks
+        for tid, sents_toks in zip(text_ids[start:start+batch_size], batch_toks):
+            text_toks = []
+            for sent_toks in sents_toks:
+                toks_per_sent.append(sent_toks)
+                sent_ids.append(tid)
+                text_toks += sent_toks
+            toks_per_text.append(text_toks)
+            if progress is not None:
+                progress.update(docs=1, sents=len(sents_toks), toks=len(text_toks))
+    if progress is not None:
+        progress.finish()
+    if cache is not None:
+        cache.report()
+    return toks_per_text, toks_per_sent, sent_ids
+
+def _doc_to_sents_toks(doc):
+    sents_toks = []
+    for span in doc.sents:
+        start, end = span.start, span.end
+        while start < end and doc[start].is_space:  # whitespace between sentences
+            start += 1
+        while end > start and doc[end-1].is_space:
+            end -= 1
+        if start < end:
+            sents_toks.append(_sent_to_pos_toks(doc[start:end]))
+    return sents_toks
+
+def _get_doc_nlp(sent_mode):
+    if sent_mode not in _doc_nlps:
+        if sent_mode == 'parser':
+            _doc_nlps[sent_mode] = spacy.load('en_core_web_sm', disable=['ner'])
+        elif sent_mode == 'sentencizer':
+            doc_nlp = spacy.load('en_core_web_sm', disable=['parser', 'ner'])
+            doc_nlp.add_pipe('sentencizer')
+            _doc_nlps[sent_mode] = doc_nlp
+        else:
+            raise ValueError('Invalid sent_mode: {}'.format(sent_mode))
+    return _doc_nlps[sent_mode]
+
+def _sent_to_pos_toks(sent, cache=None):
+    """
+    Returns the non-punctuation tokens of a sentence, given either its text or a
+    sentence span that spaCy has already processed.
+    """
+    if cache is not None and isinstance(sent, str):
+        toks = cache.get(sent, namespace=_SENT_NAMESPACE)
+        if toks is None:
+            toks = _sent_to_pos_toks(sent)
+            cache.put(sent, toks, namespace=_SENT_NAMESPACE)
+        return toks
     toks = []
-    doc = nlp(sent)
+    doc = nlp(sent) if isinstance(sent, str) else sent
     for tok in doc:
         pos = tok.pos_
         if pos != 'PUNCT':
@@ -110,8 +290,10 @@ def _sent_to_pos_toks(sent):
     return toks
 
 if __name__ == '__main__':
-    make_celeb_toks_per_text('f', continue_work=True)
-    make_celeb_toks_per_text('m', continue_work=True)
+    cache = SentenceCache(path=PATH_TO_NLP_CACHE)
+    make_celeb_toks_per_text('f', continue_work=True, cache=cache, dedup_index_path=PATH_TO_CELEB_DEDUP_INDEX.format('f'))
+    make_celeb_toks_per_text('m', continue_work=True, cache=cache, dedup_index_path=PATH_TO_CELEB_DEDUP_INDEX.format('m'))
 
-    make_prof_toks_per_text('f', continue_work=True)
-    make_prof_toks_per_text('m', continue_work=True)
\ No newline at end of file
+    make_prof_toks_per_text('f', continue_work=True, cache=cache, dedup_index_path=PATH_TO_PROF_DEDUP_INDEX.format('f'))
+    make_prof_toks_per_text('m', continue_work=True, cache=cache, dedup_index_path=PATH_TO_PROF_DEDUP_INDEX.format('m'))
+    cache.close()
\ No newline at end of file
@@ -0,0 +1,220 @@
+from artifacts import load_processed
+from instrumentation import timed
+from metadata_table import labels_to_bitset
+import numpy as np
+from preprocessing import PATH_TO_PROF_PROCESSED
+from scipy.stats import chi2_contingency
+from score_words import beta_scoring_from_arrays, filter_associations_on_p, print_top_n_per_pos
+
+GENDERS = ['F', 'M']  # group 0 and 1, as in beta_scoring_from_arrays
+RATING_BINS = [('low', 1, 3), ('mid', 3, 4), ('high', 4, None)]  # <name, low (inclusive), high (exclusive)>
+
+def rating_bin_codes(ratings, bins=RATING_BINS):
+    """
+    Returns the index of the bin that each rating falls in, or -1 if it falls in none
+    (including unparsed NaN ratings).
+    """
+    codes = np.full(len(ratings), -1, dtype=np.int64)
+    for i, (name, low, high) in enumerate(bins):
+        in_bin = np.ones(len(ratings), dtype=bool)
+        if low is not None:
+            in_bin &= ratings >= low
+        if high is not None:
+            in_bin &= ratings < high
+        codes[in_bin & (codes < 0)] = i
+    return codes
+
+'''
+    This class answers questions about the structured fields of RMP reviews (ratings
+    and tags) over a review table from ProfDataLoader.to_table, without re-parsing
+    any strings: the ratings are a float column, the tags are a bitset per review,
+    and gender is a 0 (female) / 1 (male) / -1 (other) code per review. Every
+    statistic is a vectorized pass over those arrays: tag associations by gender, the
+    rating distribution of each gender, mean ratings per tag, and word associations
+    per rating bin (counted in one pass over the processed reviews).
+'''
+class ReviewAssociations:
+    def __init__(self, table):
+        self.table = table
+        self.ratings = table.column('rating')
+        self.tag_bits = table.columns['tag_bits']
+        self.tag_labels = list(table.labels('tags'))
+        codes, labels = table.dict_columns['gender']
+        label_to_group = np.array([GENDERS.index(l) if l in GENDERS else -1 for l in labels], dtype=np.int64)
+        self.groups = label_to_group[codes] if len(codes) > 0 else np.zeros(0, dtype=np.int64)
+        self._tag_matrix = None
+
+    def __len__(self):
+        return len(self.table)
+
+    def tag_matrix(self):
+        """
+        Returns the reviews' tags as a (num_reviews, num_tags) uint8 matrix of 0s and 1s,
+        unpacked from the bitsets.
+        """
+        if self._tag_matrix is None:
+            unpacked = np.unpackbits(self.tag_bits.view(np.uint8), axis=1, bitorder='little')
+            self._tag_matrix = unpacked[:, :len(self.tag_labels)]
+        return self._tag_matrix
+
+    def rows_with_tags(self, tags, require_all=False):
+        """
+        Returns the rows of the reviews with any (or, if require_all, every) one of the
+        given tags, by testing each review's bitset against the tags' bitset.
+        """
+        query = labels_to_bitset(self.tag_labels, tags)
+        hits = self.tag_bits & query
+        if require_all:
+            return np.flatnonzero((hits == query).all(axis=1))
+        return np.flatnonzero(hits.any(axis=1))
+
+    def _group_mask(self, rows):
+        mask = self.groups >= 0
+        if rows is not None:
+            in_rows = np.zeros(len(self), dtype=bool)
+            in_rows[rows] = True
+            mask &= in_rows
+        return mask
+
+    def tag_counts(self, rows=None):
+        """
+        Returns the number of female and male reviews with each tag, and the number of
+        female and male reviews, over all reviews or just the given rows.
+        """
+        mask = self._group_mask(rows)
+        groups = self.groups[mask]
+        tags = self.tag_matrix()[mask]
+        counts = [tags[groups == g].sum(axis=0, dtype=np.int64) for g in range(len(GENDERS))]
+        totals = np.bincount(groups, minlength=len(GENDERS))
+        return counts[0], counts[1], totals
+
+    def tag_associations(self, min_count=5, rows=None, sort=True):
+        """
+        Returns the female- and male-associated tags, as <tag, p-value, number of
+        reviews with the tag, number of the group's reviews with the tag> tuples. Each
+        group's frequency of a tag is the fraction of its reviews with the tag.
+        """
+        fcounts, mcounts, totals = self.tag_counts(rows)
+        return beta_scoring_from_arrays(self.tag_labels, fcounts, mcounts, min_count=min_count, sort=sort,
+                                        totals=totals)
+
+    def rating_distribution(self, bins=RATING_BINS, rows=None):
+        """
+        Returns each gender's number of reviews per rating bin, the proportions, the
+        mean and standard deviation of the ratings, and a chi-squared test of whether
+        the bin distribution is independent of gender.
+        """
+        mask = self._group_mask(rows) & ~np.isnan(self.ratings)
+        groups = self.groups[mask]
+        ratings = self.ratings[mask].astype(np.float64)
+        bin_codes = rating_bin_codes(ratings, bins)
+        in_bin = bin_codes >= 0
+        table = np.bincount(groups[in_bin] * len(bins) + bin_codes[in_bin],
+                            minlength=len(GENDERS) * len(bins)).reshape(len(GENDERS), len(bins))
+        row_totals = table.sum(axis=1, keepdims=True)
+        dist = {'bins':[b[0] for b in bins], 'counts':{}, 'proportions':{}, 'mean':{}, 'std':{}}
+        for g, gender in enumerate(GENDERS):
+            group_ratings = ratings[groups == g]
+            dist['counts'][gender] = table[g].tolist()
+            dist['proportions'][gender] = (table[g] / max(row_totals[g, 0], 1)).tolist()
+            dist['mean'][gender] = float(group_ratings.mean()) if len(group_ratings) > 0 else None
+            dist['std'][gender] = float(group_ratings.std()) if len(group_ratings) > 0 else None
+        nonempty = table.sum(axis=0) > 0
+        if (row_totals > 0).all() and nonempty.sum() > 1:
+            chi2, p, dof, expected = chi2_contingency(table[:, nonempty])
+            dist['chi2'], dist['p'], dist['dof'] = float(chi2), float(p), int(dof)
+        else:
+            dist['chi2'], dist['p'], dist['dof'] = None, None, 0
+        return dist
+
+    def tag_mean_ratings(self, min_count=5, rows=None):
+        """
+        Returns a dictionary from each tag to the <number of reviews, mean rating> of
+        the female and male reviews with it (the mean is None for fewer than min_count
+        rated reviews).
+        """
+        mask = self._group_mask(rows) & ~np.isnan(self.ratings)
+        groups = self.groups[mask]
+        ratings = self.ratings[mask].astype(np.float64)
+        tags = self.tag_matrix()[mask].astype(np.float64)
+        means = {tag:{} for tag in self.tag_labels}
+        for g, gender in enumerate(GENDERS):
+            group_tags = tags[groups == g]
+            n = group_tags.sum(axis=0)
+            sums = ratings[groups == g] @ group_tags
+            for i, tag in enumerate(self.tag_labels):
+                means[tag][gender] = (int(n[i]), float(sums[i] / n[i]) if n[i] >= min_count else None)
+        return means
+
+    def rating_word_counts(self, toks_per_review_w_id, bins=RATING_BINS):
+        """
+        Counts the <lemma>,<pos> tuples of processed reviews per rating bin and gender,
+        in one pass: every token is encoded once, and all counts come from a single
+        bincount over <bin, gender, word>. Reviews that are not in the table, have no
+        gender, or have a rating in no bin are skipped. Returns the vocabulary and a
+        (num_bins, 2, vocab_size) count array.
+        """
+        id_to_row = {review_id:i for i, review_id in enumerate(self.table.ids())}
+        bin_codes = rating_bin_codes(self.ratings.astype(np.float64), bins)
+        word_to_col = {}
+        cols = []
+        lengths = []
+        keys = []
+        for review_id, toks in toks_per_review_w_id:
+            row = id_to_row.get(review_id)
+            if row is None or self.groups[row] < 0 or bin_codes[row] < 0:
+                continue
+            review_cols = [word_to_col.setdefault((lemma, pos), len(word_to_col)) for word, lemma, pos in toks]
+            cols.append(np.array(review_cols, dtype=np.int64))
+            lengths.append(len(review_cols))
+            keys.append(bin_codes[row] * len(GENDERS) + self.groups[row])
+        vocab = list(word_to_col.keys())
+        V = len(vocab)
+        num_keys = len(bins) * len(GENDERS)
+        if len(cols) == 0:
+            return vocab, np.zeros((len(bins), len(GENDERS), V), dtype=np.int64)
+        flat = np.repeat(np.array(keys, dtype=np.int64), lengths) * V + np.concatenate(cols)
+        counts = np.bincount(flat, minlength=num_keys * V).reshape(len(bins), len(GENDERS), V)
+        return vocab, counts
+
+    def rating_word_associations(self, toks_per_review_w_id, bins=RATING_BINS, min_count=5, sort=True):
+        """
+        Returns a dictionary from each rating bin's name to its female- and
+        male-associated words, e.g. which words distinguish low-rated reviews of
+        female professors from low-rated reviews of male professors.
+        Note that the bins are not balanced by gender like score_words balances the
+        corpus; the beta scoring compares each group's relative frequency, so the
+        imbalance only affects the power of the test, not its direction.
+        """
+        with timed('rating_word_associations', num_bins=len(bins)):
+            vocab, counts = self.rating_word_counts(toks_per_review_w_id, bins)
+            results = {}
+            for i, (name, low, high) in enumerate(bins):
+                print('Rating bin {} [{}, {}):'.format(name, low, high))
+                results[name] = beta_scoring_from_arrays(vocab, counts[i, 0], counts[i, 1], min_count=min_count,
+                                                         sort=sort)
+        return results
+
+def print_rating_distribution(dist):
+    print('Rating distribution by gender ({}):'.format(', '.join(dist['bins'])))
+    for gender in GENDERS:
+        print('  {}: counts {}, proportions {}, mean {}, std {}'.format(
+            gender, dist['counts'][gender], ['{:.3f}'.format(p) for p in dist['proportions'][gender]],
+            None if dist['mean'][gender] is None else round(dist['mean'][gender], 3),
+            None if dist['std'][gender] is None else round(dist['std'][gender], 3)))
+    print('  chi2 = {}, dof = {}, p = {}'.format(dist['chi2'], dist['dof'], dist['p']))
+
+if __name__ == '__main__':
+    from data_loader import ProfDataLoader, PROF_PATH
+    table = ProfDataLoader(PROF_PATH).to_table(include_unk=False)
+    engine = ReviewAssociations(table)
+    print_rating_distribution(engine.rating_distribution())
+    f_tags, m_tags = engine.tag_associations()
+    print('Female-associated tags:', [(tag, '{:.2e}'.format(p)) for tag, p, count, group_count in f_tags])
+    print('Male-associated tags:', [(tag, '{:.2e}'.format(p)) for tag, p, count, group_count in m_tags])
+    toks_per_review_w_id = load_processed(PATH_TO_PROF_PROCESSED + 'f_toks_per_review.pkl') + \
+                           load_processed(PATH_TO_PROF_PROCESSED + 'm_toks_per_review.pkl')
+    for name, (f_ass, m_ass) in engine.rating_word_associations(toks_per_review_w_id).items():
+        alpha = 0.05 / max(len(f_ass) + len(m_ass), 1)  # Bonferroni correction
+        print('Rating bin:', name)
+        print_top_n_per_pos(filter_associations_on_p(f_ass, alpha), filter_associations_on_p(m_ass, alpha), top_n=10)
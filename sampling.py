@@ -0,0 +1,142 @@
+import hashlib
+import numpy as np
+import os
+
+PATH_TO_SAMPLES = '../processed/samples/'  # where sampled index arrays are cached
+LENGTH_EDGES = (25, 50, 100, 200, 400, 800)  # token-count boundaries of the length strata
+
+def site_of_article_id(article_id):
+    """
+    Returns the celeb site (people, usweekly, eonline) that a processed article ID
+    comes from. Processed article IDs are of the form <site>_<article_id>.
+    """
+    return article_id.split('_', 1)[0]
+
+def teacher_of_review_id(review_id):
+    """
+    Returns the teacher ID of a processed review ID, which is of the form
+    <teacher_id>#<review_num>.
+    """
+    return review_id.rsplit('#', 1)[0]
+
+def length_bucket(toks, edges=LENGTH_EDGES):
+    """
+    Returns the length stratum of a text, given its tokens.
+    """
+    return int(np.searchsorted(edges, len(toks), side='right'))
+
+def make_strata(ids_w_toks, stratify_by, school_by_teacher=None):
+    """
+    Makes one stratum label per text, given a list of <text_id, toks> tuples and the
+    names of the strata to combine. Valid names are 'site', 'school', and 'length'.
+    """
+    labels = []
+    for text_id, toks in ids_w_toks:
+        label = []
+        for key in stratify_by:
+            if key == 'site':
+                label.append(site_of_article_id(text_id))
+            elif key == 'school':
+                label.append(school_by_teacher.get(teacher_of_review_id(text_id), 'UNK'))
+            elif key == 'length':
+                label.append(str(length_bucket(toks)))
+            else:
+                raise ValueError('Invalid stratum: {}'.format(key))
+        labels.append('|'.join(label))
+    return labels
+
+'''
+    This class draws balanced samples from two groups of texts (e.g., the female and
+    the male articles) as sorted arrays of indices into each group. Without strata,
+    the smaller group is kept whole and the larger one is randomly undersampled to
+    the same size. With strata, the larger group is undersampled within each stratum,
+    so both samples have the same size in every stratum. Each draw is determined by
+    its seed and is cached on disk, where it is loaded back as a memory-mapped array,
+    so that repeated runs are reproducible and cheap. The cache is keyed by the groups'
+    sizes and strata and, if given, their text IDs, so that a corpus that changed
+    without changing size does not reuse indices drawn for the old one.
+'''
+class BalancedSampler:
+    def __init__(self, n_f, n_m, f_strata=None, m_strata=None, name='sample', cache_dir=PATH_TO_SAMPLES, f_ids=None,
+                 m_ids=None):
+        self.n_f = n_f
+        self.n_m = n_m
+        self.name = name
+        self.cache_dir = cache_dir
+        if f_strata is None or m_strata is None:
+            f_strata = [''] * n_f
+            m_strata = [''] * n_m
+        assert(len(f_strata) == n_f and len(m_strata) == n_m)
+        labels, codes = np.unique(np.array(list(f_strata) + list(m_strata), dtype=str), return_inverse=True)
+        self.num_strata = len(labels)
+        # group the indices of each stratum once so that every draw is only a shuffle
+        self._f_groups = self._group_by_stratum(codes[:n_f])
+        self._m_groups = self._group_by_stratum(codes[n_f:])
+        self._key = self._make_key(codes, f_ids, m_ids)
+
+    def _group_by_stratum(self, codes):
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(self.num_strata + 1))
+        return [order[bounds[s]:bounds[s+1]] for s in range(self.num_strata)]
+
+    def _make_key(self, codes, f_ids=None, m_ids=None):
+        h = hashlib.sha1()
+        h.update('{}:{}:{}'.format(self.name, self.n_f, self.n_m).encode())
+        h.update(codes.astype(np.int64).tobytes())
+        for ids, n in [(f_ids, self.n_f), (m_ids, self.n_m)]:
+            if ids is not None:
+                assert(len(ids) == n)
+                h.update(b'\1')  # keeps keys with and without IDs apart
+                for text_id in ids:
+                    h.update(str(text_id).encode('utf-8') + b'\0')
+        return h.hexdigest()[:16]
+
+    def sample(self, seed, use_cache=True):
+        """
+        Returns the sorted female and male index arrays of the sample with this seed.
+        """
+        if use_cache and self.cache_dir is not None:
+            f_fn, m_fn = self._cache_filenames(seed)
+            if os.path.isfile(f_fn) and os.path.isfile(m_fn):
+                return np.load(f_fn, mmap_mode='r'), np.load(m_fn, mmap_mode='r')
+        f_idx, m_idx = self._draw(seed)
+        if use_cache and self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for fn, idx in [(f_fn, f_idx), (m_fn, m_idx)]:
+                # write then rename, so that a concurrent sample() never loads a partial file
+                tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+                with open(tmp_fn, 'wb') as f:
+                    np.save(f, idx)
+                os.replace(tmp_fn, fn)
+        return f_idx, m_idx
+
+    def resamples(self, seeds, use_cache=False):
+        """
+        Yields <seed, f_idx, m_idx> for each seed, e.g. for stability analyses over
+        many resamples. Caching is off by default since resamples are cheap to draw.
+        """
+        for seed in seeds:
+            f_idx, m_idx = self.sample(seed, use_cache=use_cache)
+            yield seed, f_idx, m_idx
+
+    def _draw(self, seed):
+        rng = np.random.default_rng(seed)
+        f_kept = []
+        m_kept = []
+        for f_group, m_group in zip(self._f_groups, self._m_groups):
+            size = min(len(f_group), len(m_group))
+            f_kept.append(f_group if len(f_group) == size else rng.choice(f_group, size=size, replace=False))
+            m_kept.append(m_group if len(m_group) == size else rng.choice(m_group, size=size, replace=False))
+        f_idx = np.sort(np.concatenate(f_kept)) if f_kept else np.array([], dtype=np.int64)
+        m_idx = np.sort(np.concatenate(m_kept)) if m_kept else np.array([], dtype=np.int64)
+        return f_idx.astype(np.int64), m_idx.astype(np.int64)
+
+    def _cache_filenames(self, seed):
+        prefix = os.path.join(self.cache_dir, '{}_{}_seed{}'.format(self.name, self._key, seed))
+        return prefix + '_f.npy', prefix + '_m.npy'
+
+def take(items, idx):
+    """
+    Returns the items at the given indices.
+    """
+    return [items[i] for i in idx]
@@ -1,89 +1,171 @@
+from artifacts import load_processed, save_processed
 from collections import Counter
+from data_loader import ProfDataLoader, PROF_PATH
+import heapq
+from instrumentation import get_meter, timed
 from nltk.corpus import stopwords
-import pickle
+import numpy as np
 from preprocessing import PATH_TO_CELEB_PROCESSED, PATH_TO_PROF_PROCESSED
+from sampling import BalancedSampler, make_strata, take
 from scipy.stats import beta
 
 STOPWORDS = stopwords.words('english')
 
-def get_tok_counts_from_balanced_celeb_corpus():
-    """
-    Loads the pre-processed articles and undersamples the larger one. Counts are then
-    computed over the <lemma>,<pos> tuples in the kept articles.
-    """
-    f_toks_per_article_w_id = pickle.load(open(PATH_TO_CELEB_PROCESSED + 'f_toks_per_article.pkl', 'rb'))
-    m_toks_per_article_w_id = pickle.load(open(PATH_TO_CELEB_PROCESSED + 'm_toks_per_article.pkl', 'rb'))
-    f_toks_per_article = [tup[1] for tup in f_toks_per_article_w_id]
-    m_toks_per_article = [tup[1] for tup in m_toks_per_article_w_id]
-    print('Original lengths:', len(f_toks_per_article), len(m_toks_per_article))
-    if len(f_toks_per_article) > len(m_toks_per_article):
-        f_toks_per_article = f_toks_per_article[:len(m_toks_per_article)]
-    elif len(m_toks_per_article) > len(f_toks_per_article):
-        m_toks_per_article = m_toks_per_article[:len(f_toks_per_article)]
-    print('Balanced lengths:', len(f_toks_per_article), len(m_toks_per_article))
+def get_tok_counts_from_balanced_celeb_corpus(seed=None, stratify_by=None):
+    """
+    Loads the pre-processed articles and undersamples the larger one. If seed is None,
+    the larger one is truncated to the length of the smaller one; otherwise, a seeded
+    random sample is drawn, optionally stratified by 'site' and/or 'length'. Counts are
+    then computed over the <lemma>,<pos> tuples in the kept articles.
+    """
+    f_toks_per_article_w_id = load_processed(PATH_TO_CELEB_PROCESSED + 'f_toks_per_article.pkl')
+    m_toks_per_article_w_id = load_processed(PATH_TO_CELEB_PROCESSED + 'm_toks_per_article.pkl')
+    f_toks_per_article, m_toks_per_article = balance_toks_per_text(f_toks_per_article_w_id, m_toks_per_article_w_id,
+                                                                   seed=seed, stratify_by=stratify_by, name='celeb')
     f_counts = compute_lemma_pos_counts(f_toks_per_article)
     m_counts = compute_lemma_pos_counts(m_toks_per_article)
     return f_counts, m_counts
 
-def get_tok_counts_from_balanced_prof_corpus():
-    """
-    Loads the pre-processed reviews and undersamples the larger one. Counts are then
-    computed over the <lemma>,<pos> tuples in the kept reviews.
-    """
-    f_toks_per_review_w_id = pickle.load(open(PATH_TO_PROF_PROCESSED + 'f_toks_per_review.pkl', 'rb'))
-    m_toks_per_review_w_id = pickle.load(open(PATH_TO_PROF_PROCESSED + 'm_toks_per_review.pkl', 'rb'))
-    f_toks_per_review = []
-    m_toks_per_review = []
-    for review_id, toks in f_toks_per_review_w_id:
-        f_toks_per_review.append(toks)
-    for review_id, toks in m_toks_per_review_w_id:
-        m_toks_per_review.append(toks)
-    print('Original lengths:', len(f_toks_per_review), len(m_toks_per_review))
-    if len(f_toks_per_review) > len(m_toks_per_review):
-        f_toks_per_review = f_toks_per_review[:len(m_toks_per_review)]
-    elif len(m_toks_per_review) > len(f_toks_per_review):
-        m_toks_per_review = m_toks_per_review[:len(f_toks_per_review)]
-    print('Balanced lengths:', len(f_toks_per_review), len(m_toks_per_review))
+def get_tok_counts_from_balanced_prof_corpus(seed=None, stratify_by=None, school_by_teacher=None):
+    """
+    Loads the pre-processed reviews and undersamples the larger one. If seed is None,
+    the larger one is truncated to the length of the smaller one; otherwise, a seeded
+    random sample is drawn, optionally stratified by 'school' and/or 'length'. Counts
+    are then computed over the <lemma>,<pos> tuples in the kept reviews.
+    """
+    f_toks_per_review_w_id = load_processed(PATH_TO_PROF_PROCESSED + 'f_toks_per_review.pkl')
+    m_toks_per_review_w_id = load_processed(PATH_TO_PROF_PROCESSED + 'm_toks_per_review.pkl')
+    if stratify_by is not None and 'school' in stratify_by and school_by_teacher is None:
+        school_by_teacher = get_school_by_teacher()
+    f_toks_per_review, m_toks_per_review = balance_toks_per_text(f_toks_per_review_w_id, m_toks_per_review_w_id,
+                                                                 seed=seed, stratify_by=stratify_by, name='prof',
+                                                                 school_by_teacher=school_by_teacher)
     f_counts = compute_lemma_pos_counts(f_toks_per_review)
     m_counts = compute_lemma_pos_counts(m_toks_per_review)
     return f_counts, m_counts
 
+def get_school_by_teacher():
+    dl = ProfDataLoader(PROF_PATH)
+    school_by_teacher = {}
+    for corpus in [dl.female_corpus, dl.male_corpus]:
+        for teacher_id, entry in corpus.items():
+            school_by_teacher[teacher_id] = entry['metadata']['school']
+    return school_by_teacher
+
+def balance_toks_per_text(f_toks_per_text_w_id, m_toks_per_text_w_id, seed=None, stratify_by=None, name='sample',
+                          school_by_teacher=None):
+    """
+    Balances the female and male texts, given lists of <text_id, toks> tuples, and
+    returns the kept tokens per text for each.
+    """
+    f_toks_per_text = [tup[1] for tup in f_toks_per_text_w_id]
+    m_toks_per_text = [tup[1] for tup in m_toks_per_text_w_id]
+    print('Original lengths:', len(f_toks_per_text), len(m_toks_per_text))
+    if seed is None:
+        if len(f_toks_per_text) > len(m_toks_per_text):
+            f_toks_per_text = f_toks_per_text[:len(m_toks_per_text)]
+        elif len(m_toks_per_text) > len(f_toks_per_text):
+            m_toks_per_text = m_toks_per_text[:len(f_toks_per_text)]
+    else:
+        if stratify_by is not None:
+            f_strata = make_strata(f_toks_per_text_w_id, stratify_by, school_by_teacher=school_by_teacher)
+            m_strata = make_strata(m_toks_per_text_w_id, stratify_by, school_by_teacher=school_by_teacher)
+            name += '_' + '_'.join(stratify_by)
+        else:
+            f_strata = m_strata = None
+        sampler = BalancedSampler(len(f_toks_per_text), len(m_toks_per_text), f_strata, m_strata, name=name,
+                                  f_ids=[tup[0] for tup in f_toks_per_text_w_id],
+                                  m_ids=[tup[0] for tup in m_toks_per_text_w_id])
+        f_idx, m_idx = sampler.sample(seed)
+        f_toks_per_text = take(f_toks_per_text, f_idx)
+        m_toks_per_text = take(m_toks_per_text, m_idx)
+    print('Balanced lengths:', len(f_toks_per_text), len(m_toks_per_text))
+    return f_toks_per_text, m_toks_per_text
+
 def compute_lemma_pos_counts(toks_per_text):
-    all_toks = []
-    for toks in toks_per_text:
-        for word, lemma, pos in toks:
-            all_toks.append((lemma, pos))
-    return Counter(all_toks)
-
-def beta_scoring_from_counts(fcounts, mcounts, min_count=5):
-    f_N = sum([count for count in fcounts.values()])
-    m_N = sum([count for count in mcounts.values()])
-    all_counts = fcounts + mcounts
-    N = f_N + m_N
-    f_associated = []
-    m_associated = []
-    for word, count in all_counts.items():
-        if count >= min_count:
-            rv = beta(a=count, b=N-count)
-            freq = count / N
-            if word in fcounts:
-                count_f = fcounts[word]
-                freq_f = count_f / f_N
-                if freq < freq_f:  # more frequent in female than in overall
-                    p = rv.sf(freq_f)
-                    f_associated.append((word, p, count, count_f))
-            if word in mcounts:
-                count_m = mcounts[word]
-                freq_m = count_m / m_N
-                if freq < freq_m:  # more frequent in male than in overall
-                    p = rv.sf(freq_m)
-                    m_associated.append((word, p, count, count_m))
-    print('Num female-associated:', len(f_associated))
-    print('Num male-associated:', len(m_associated))
-
-    f_associated = sorted(f_associated, key=lambda x:x[1])
-    m_associated = sorted(m_associated, key=lambda x:x[1])
-    return f_associated, m_associated
+    with timed('count', num_texts=len(toks_per_text)):
+        all_toks = []
+        for toks in toks_per_text:
+            for word, lemma, pos in toks:
+                all_toks.append((lemma, pos))
+        get_meter('count').add(docs=len(toks_per_text), toks=len(all_toks))
+        return Counter(all_toks)
+
+def beta_scoring_from_counts(fcounts, mcounts, min_count=5, sort=True, totals=None):
+    """
+    Scores every <lemma>,<pos> with at least min_count occurrences by how surprising
+    its frequency in each group is under a beta distribution fit to its overall
+    frequency. If sort is False, the associations are returned unordered; the top-k
+    and threshold queries below do not need them sorted. totals is the <female, male>
+    number of tokens, if the counts have been pruned of rare words (see
+    external_count); by default, it is the sum of the counts.
+    """
+    with timed('score', vocab_size=len(fcounts) + len(mcounts), min_count=min_count):
+        if totals is not None:
+            f_N, m_N = totals
+        else:
+            f_N = sum([count for count in fcounts.values()])
+            m_N = sum([count for count in mcounts.values()])
+        all_counts = fcounts + mcounts
+        N = f_N + m_N
+        f_associated = []
+        m_associated = []
+        for word, count in all_counts.items():
+            if count >= min_count:
+                rv = beta(a=count, b=N-count)
+                freq = count / N
+                if word in fcounts:
+                    count_f = fcounts[word]
+                    freq_f = count_f / f_N
+                    if freq < freq_f:  # more frequent in female than in overall
+                        p = rv.sf(freq_f)
+                        f_associated.append((word, p, count, count_f))
+                if word in mcounts:
+                    count_m = mcounts[word]
+                    freq_m = count_m / m_N
+                    if freq < freq_m:  # more frequent in male than in overall
+                        p = rv.sf(freq_m)
+                        m_associated.append((word, p, count, count_m))
+        print('Num female-associated:', len(f_associated))
+        print('Num male-associated:', len(m_associated))
+
+        if sort:
+            f_associated = sorted(f_associated, key=lambda x:x[1])
+            m_associated = sorted(m_associated, key=lambda x:x[1])
+        return f_associated, m_associated
+
+def beta_scoring_from_arrays(vocab, fcounts, mcounts, min_count=5, sort=True, totals=None):
+    """
+    Same as beta_scoring_from_counts, but the counts are given as two arrays aligned
+    with a vocabulary list of <lemma>,<pos>, and the p-values of all words are
+    computed in one vectorized pass. Returns associations in the same format.
+    """
+    fcounts = np.asarray(fcounts, dtype=np.float64)
+    mcounts = np.asarray(mcounts, dtype=np.float64)
+    with timed('score', vocab_size=len(vocab), min_count=min_count):
+        if totals is not None:
+            f_N, m_N = float(totals[0]), float(totals[1])
+        else:
+            f_N = fcounts.sum()
+            m_N = mcounts.sum()
+        N = f_N + m_N
+        counts = fcounts + mcounts
+        keep = counts >= min_count
+        associated = []
+        for group_counts, group_N in [(fcounts, f_N), (mcounts, m_N)]:
+            ass = []
+            if group_N > 0:
+                freq = counts / N
+                group_freq = group_counts / group_N
+                idx = np.flatnonzero(keep & (freq < group_freq))  # more frequent in group than in overall
+                ps = beta.sf(group_freq[idx], counts[idx], N - counts[idx])
+                ass = [(vocab[i], p, int(counts[i]), int(group_counts[i])) for i, p in zip(idx, ps.tolist())]
+            if sort:
+                ass = sorted(ass, key=lambda x:x[1])
+            associated.append(ass)
+        print('Num female-associated:', len(associated[0]))
+        print('Num male-associated:', len(associated[1]))
+        return associated[0], associated[1]
 
 def filter_associations_on_lemma_and_pos(ass, valid_pos=None, invalid_pos=None, blacklist=STOPWORDS):
     filtered = []
@@ -99,45 +181,76 @@ def is_valid_lemma(lemma, blacklist):
     return lemma.isalpha() and lemma not in blacklist and len(lemma) > 2 and len(lemma) < 20 and lemma.lower() == lemma
 
 def filter_associations_on_p(associations, p_thresh, print_filtered=False):
-    filtered = []
-    for tuple in associations:  # already ordered by largest to smallest cdf
-        if tuple[1] <= p_thresh:
-            filtered.append(tuple)
-        else:
-            break
+    """
+    Keeps the associations with p <= p_thresh, ordered by p. The associations do not
+    need to be sorted; only the kept ones are.
+    """
+    filtered = [tuple for tuple in associations if tuple[1] <= p_thresh]
+    filtered = sorted(filtered, key=lambda x:x[1])
     print('Number of associations with p <= {}: {}'.format(round(p_thresh, 3), len(filtered)))
     if print_filtered:
         for i, tuple in enumerate(filtered):
             print('{}. {}, p={}'.format(i+1, tuple[0], tuple[1]))
     return filtered
 
+def top_k_associations(ass, k):
+    """
+    Returns the k associations with the smallest p-values, ordered by p. Uses a heap,
+    so the associations do not need to be sorted.
+    """
+    return heapq.nsmallest(k, ass, key=lambda x:x[1])
+
+def top_k_associations_per_pos(ass, k, pos_set=('NOUN', 'VERB', 'ADJ'), blacklist=STOPWORDS):
+    """
+    Returns the k associations with the smallest p-values for each pos in pos_set,
+    keeping only valid lemmas, in one pass over the associations. Returns a dictionary
+    of pos to its top k (ordered by p), and a dictionary of pos to its number of valid
+    associations.
+    """
+    heaps = {pos:[] for pos in pos_set}
+    num_valid = {pos:0 for pos in pos_set}
+    for i, tuple in enumerate(ass):
+        lemma, pos = tuple[0]
+        if pos in heaps and is_valid_lemma(lemma, blacklist):
+            num_valid[pos] += 1
+            heap = heaps[pos]
+            item = (-tuple[1], -i, tuple)  # root is the worst kept, ties broken by input order
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    top = {}
+    for pos, heap in heaps.items():
+        top[pos] = [item[2] for item in sorted(heap, key=lambda x:(-x[0], -x[1]))]
+    return top, num_valid
+
 def print_top_n(f_ass, m_ass, top_n=25):
     print('Most Female')
-    for i, (word, p, _, _) in enumerate(f_ass[:top_n]):
+    for i, (word, p, _, _) in enumerate(top_k_associations(f_ass, top_n)):
         print('{}. {}, p={}'.format(i+1, word, round(p, 4)))
     print('\nMost Male')
-    for i, (word, p, _, _) in enumerate(m_ass[:top_n]):
+    for i, (word, p, _, _) in enumerate(top_k_associations(m_ass, top_n)):
         print('{}. {}, p={}'.format(i+1, word, round(p, 4)))
 
-def print_top_n_per_pos(f_ass, m_ass, top_n=25):
-    for pos in ['NOUN', 'VERB', 'ADJ']:
+def print_top_n_per_pos(f_ass, m_ass, top_n=25, pos_set=('NOUN', 'VERB', 'ADJ')):
+    f_top, f_num_valid = top_k_associations_per_pos(f_ass, top_n, pos_set=pos_set)
+    m_top, m_num_valid = top_k_associations_per_pos(m_ass, top_n, pos_set=pos_set)
+    for pos in pos_set:
         print('\nFiltering on only lemmas with pos={}...'.format(pos))
-        f_ass_within_pos = filter_associations_on_lemma_and_pos(f_ass, valid_pos={pos})
-        m_ass_within_pos = filter_associations_on_lemma_and_pos(m_ass, valid_pos={pos})
-        print('{} female, {} male'.format(len(f_ass_within_pos), len(m_ass_within_pos)))
+        print('{} female, {} male'.format(f_num_valid[pos], m_num_valid[pos]))
         print('Most Female')
-        for i, (word, p, _, _) in enumerate(f_ass_within_pos[:top_n]):
+        for i, (word, p, _, _) in enumerate(f_top[pos]):
             print('{}. {}, p={}'.format(i+1, word, round(p, 4)))
         print('\nMost Male')
-        for i, (word, p, _, _) in enumerate(m_ass_within_pos[:top_n]):
+        for i, (word, p, _, _) in enumerate(m_top[pos]):
             print('{}. {}, p={}'.format(i+1, word, round(p, 4)))
 
 if __name__ == '__main__':
     f_counts, m_counts = get_tok_counts_from_balanced_prof_corpus()
-    f_ass, m_ass = beta_scoring_from_counts(f_counts, m_counts)
-    pickle.dump((f_ass, m_ass), open(PATH_TO_PROF_PROCESSED + 'lex.pkl', 'wb'))
+    f_ass, m_ass = beta_scoring_from_counts(f_counts, m_counts)  # lex.pkl stays sorted by p-value for its readers
+    save_processed(PATH_TO_PROF_PROCESSED + 'lex.pkl', (f_ass, m_ass), 'lex')
 
-    # f_ass, m_ass = pickle.load(open(PATH_TO_PROF_PROCESSED + 'lex.pkl', 'rb'))
+    # f_ass, m_ass = load_processed(PATH_TO_PROF_PROCESSED + 'lex.pkl')
     f_ass = filter_associations_on_lemma_and_pos(f_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
     print('Num female words:', len(f_ass))
     m_ass = filter_associations_on_lemma_and_pos(m_ass, valid_pos={'NOUN', 'VERB', 'ADJ'})
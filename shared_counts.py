@@ -0,0 +1,264 @@
+"""
+Publishes the vocabulary and per-group count arrays (and optionally the doc-term
+matrix) of a corpus once, so that any number of scoring and filtering processes can
+attach to them without copying.
+
+    python shared_counts.py publish --corpus prof --name prof_counts     # shared memory, stays up until Ctrl-C
+    python shared_counts.py publish --corpus prof --path ../processed/professor/shared/ --doc-term   # memory-mapped files
+
+Workers then call SharedCounts.attach('prof_counts') (or attach_path(path)).
+"""
+import argparse
+import json
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import os
+import time
+
+BACKENDS = {'shm', 'mmap'}
+META_SIZE = 1 << 16  # bytes reserved for the shared-memory header
+KEY_SEP = '\t'
+
+'''
+    This class is a read-only sequence over a vocabulary of <lemma>,<pos> tuples
+    stored as one UTF-8 blob plus offsets, so that it can live in shared memory.
+    Words are decoded on access, which lets beta_scoring_from_arrays index into it
+    without every worker building its own list of the whole vocabulary.
+'''
+class SharedVocab:
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        word = bytes(self.blob[self.offsets[i]:self.offsets[i+1]]).decode('utf-8')
+        return tuple(word.split(KEY_SEP, 1))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def index(self):
+        """
+        Returns a dictionary of word to position (this does build one copy).
+        """
+        return {w:i for i, w in enumerate(self)}
+
+def encode_vocab(vocab):
+    encoded = [KEY_SEP.join(w).encode('utf-8') for w in vocab]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def build_count_arrays(f_toks_per_text, m_toks_per_text, with_doc_term=False):
+    """
+    Returns a dictionary of the arrays to publish: the encoded vocabulary, the female
+    and male counts aligned with it, and, if with_doc_term is True, the doc-term
+    matrix in CSR form (indptr, indices, data), with each document's group (0 for
+    female, 1 for male).
+    """
+    word_to_col = {}
+    rows = []
+    for toks_per_text in [f_toks_per_text, m_toks_per_text]:
+        group_rows = []
+        for toks in toks_per_text:
+            cols = [word_to_col.setdefault((lemma, pos), len(word_to_col)) for word, lemma, pos in toks]
+            group_rows.append(np.array(cols, dtype=np.int32))
+        rows.append(group_rows)
+    vocab = list(word_to_col.keys())
+    V = len(vocab)
+    arrays = {}
+    arrays['vocab_blob'], arrays['vocab_offsets'] = encode_vocab(vocab)
+    for name, group_rows in zip(['f_counts', 'm_counts'], rows):
+        cols = np.concatenate(group_rows) if group_rows else np.zeros(0, dtype=np.int32)
+        arrays[name] = np.bincount(cols, minlength=V).astype(np.int64)
+    if with_doc_term:
+        indptr = [0]
+        indices = []
+        data = []
+        for group_rows in rows:
+            for cols in group_rows:
+                doc_cols, doc_counts = np.unique(cols, return_counts=True)
+                indices.append(doc_cols.astype(np.int32))
+                data.append(doc_counts.astype(np.int32))
+                indptr.append(indptr[-1] + len(doc_cols))
+        arrays['dt_indptr'] = np.array(indptr, dtype=np.int64)
+        arrays['dt_indices'] = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+        arrays['dt_data'] = np.concatenate(data) if data else np.zeros(0, dtype=np.int32)
+        arrays['doc_groups'] = np.array([0] * len(rows[0]) + [1] * len(rows[1]), dtype=np.int8)
+    return arrays
+
+'''
+    This class holds published count arrays. The publisher creates it with publish()
+    and keeps it open for as long as workers may attach; workers get read-only views
+    with attach() (shared memory) or attach_path() (memory-mapped .npy files), so the
+    data is in RAM once no matter how many workers there are.
+'''
+class SharedCounts:
+    def __init__(self, arrays, handles=(), owner=False):
+        self.arrays = arrays
+        self._handles = list(handles)
+        self._owner = owner
+        self.vocab = SharedVocab(arrays['vocab_blob'], arrays['vocab_offsets'])
+
+    @property
+    def fcounts(self):
+        return self.arrays['f_counts']
+
+    @property
+    def mcounts(self):
+        return self.arrays['m_counts']
+
+    def has_doc_term(self):
+        return 'dt_indptr' in self.arrays
+
+    def counts_for_docs(self, docs):
+        """
+        Returns the female and male count arrays of a subset of documents (e.g. a
+        bootstrap sample), computed from the doc-term matrix.
+        """
+        indptr, indices, data = self.arrays['dt_indptr'], self.arrays['dt_indices'], self.arrays['dt_data']
+        groups = self.arrays['doc_groups']
+        docs = np.asarray(docs, dtype=np.int64)
+        counts = []
+        for g in [0, 1]:
+            group_docs = docs[groups[docs] == g]
+            lengths = indptr[group_docs + 1] - indptr[group_docs]
+            # positions of every nonzero of the selected rows
+            starts = np.repeat(indptr[group_docs] - np.cumsum(lengths) + lengths, lengths)
+            pos = starts + np.arange(lengths.sum())
+            counts.append(np.bincount(indices[pos], weights=data[pos], minlength=len(self.vocab)).astype(np.int64))
+        return counts[0], counts[1]
+
+    def score(self, min_count=5, sort=False):
+        from score_words import beta_scoring_from_arrays
+        return beta_scoring_from_arrays(self.vocab, self.fcounts, self.mcounts, min_count=min_count, sort=sort)
+
+    @staticmethod
+    def publish(arrays, name=None, backend='shm', path=None):
+        """
+        Publishes a dictionary of arrays, either as shared-memory blocks named
+        <name>_<array> plus a header block <name>, or as .npy files plus a header
+        file in the folder path. Returns the publisher's SharedCounts.
+        """
+        assert(backend in BACKENDS)
+        meta = {}
+        handles = []
+        views = {}
+        if backend == 'mmap':
+            os.makedirs(path, exist_ok=True)
+            for key, arr in arrays.items():
+                np.save(os.path.join(path, key + '.npy'), arr)
+                meta[key] = key + '.npy'
+            json.dump(meta, open(os.path.join(path, 'meta.json'), 'w'))
+            return SharedCounts.attach_path(path)
+        for key, arr in arrays.items():
+            shm = shared_memory.SharedMemory(name='{}_{}'.format(name, key), create=True, size=max(arr.nbytes, 1))
+            view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+            view[...] = arr
+            handles.append(shm)
+            views[key] = view
+            meta[key] = {'shm':shm.name, 'dtype':arr.dtype.str, 'shape':list(arr.shape)}
+        header = json.dumps(meta).encode('utf-8')
+        assert(len(header) < META_SIZE)
+        meta_shm = shared_memory.SharedMemory(name=name, create=True, size=META_SIZE)
+        meta_shm.buf[:len(header)] = header
+        handles.append(meta_shm)
+        return SharedCounts(views, handles=handles, owner=True)
+
+    @staticmethod
+    def attach(name):
+        """
+        Attaches to counts published in shared memory under name, without copying.
+        """
+        meta_shm = _attach_shm(name)
+        meta = json.loads(bytes(meta_shm.buf).rstrip(b'\0').decode('utf-8'))
+        handles = [meta_shm]
+        views = {}
+        for key, spec in meta.items():
+            shm = _attach_shm(spec['shm'])
+            view = np.ndarray(tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=shm.buf)
+            view.flags.writeable = False
+            views[key] = view
+            handles.append(shm)
+        return SharedCounts(views, handles=handles)
+
+    @staticmethod
+    def attach_path(path):
+        """
+        Attaches to counts published as memory-mapped files in the folder path.
+        """
+        meta = json.load(open(os.path.join(path, 'meta.json'), 'r'))
+        views = {key:np.load(os.path.join(path, fn), mmap_mode='r') for key, fn in meta.items()}
+        return SharedCounts(views)
+
+    def close(self):
+        """
+        Detaches from the shared memory; the publisher also frees it.
+        """
+        self.arrays = {}
+        self.vocab = None
+        for shm in self._handles:
+            shm.close()
+            if self._owner:
+                shm.unlink()
+        self._handles = []
+
+def _attach_shm(name):
+    """
+    Attaches to a shared-memory block without registering it with this process's
+    resource tracker, which would otherwise unlink it when this process exits; only
+    the publisher should free it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+def load_corpus_toks(corpus, seed=None):
+    from artifacts import load_processed
+    from preprocessing import PATH_TO_CELEB_PROCESSED, PATH_TO_PROF_PROCESSED
+    from score_words import balance_toks_per_text
+    if corpus == 'celeb':
+        path, unit = PATH_TO_CELEB_PROCESSED, 'article'
+    else:
+        path, unit = PATH_TO_PROF_PROCESSED, 'review'
+    f_toks_per_text_w_id = load_processed(path + 'f_toks_per_{}.pkl'.format(unit))
+    m_toks_per_text_w_id = load_processed(path + 'm_toks_per_{}.pkl'.format(unit))
+    return balance_toks_per_text(f_toks_per_text_w_id, m_toks_per_text_w_id, seed=seed, name=corpus)
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish count arrays for zero-copy workers.')
+    parser.add_argument('command', choices=['publish'])
+    parser.add_argument('--corpus', choices=['celeb', 'prof'], default='prof')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='shm')
+    parser.add_argument('--name', default=None, help='shared-memory name (shm backend)')
+    parser.add_argument('--path', default=None, help='folder of the memory-mapped files (mmap backend)')
+    parser.add_argument('--doc-term', action='store_true', help='also publish the doc-term matrix')
+    args = parser.parse_args()
+
+    backend = 'mmap' if args.path is not None else args.backend
+    name = args.name or '{}_counts'.format(args.corpus)
+    f_toks_per_text, m_toks_per_text = load_corpus_toks(args.corpus)
+    arrays = build_count_arrays(f_toks_per_text, m_toks_per_text, with_doc_term=args.doc_term)
+    del f_toks_per_text, m_toks_per_text
+    shared = SharedCounts.publish(arrays, name=name, backend=backend, path=args.path)
+    del arrays
+    print('Published {} words{}'.format(len(shared.vocab), ' to ' + args.path if backend == 'mmap' else ' as ' + name))
+    if backend == 'shm':
+        try:
+            while True:  # the shared memory lives as long as the publisher
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            shared.close()
+
+if __name__ == '__main__':
+    main()
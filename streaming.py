@@ -0,0 +1,270 @@
+from artifacts import save_processed
+from collections import Counter
+from corpus_store import CorpusReader, pack_exists, pack_path_for, read_new_records
+from data_loader import parse_celeb_lines, parse_prof_lines
+from instrumentation import Progress, emit
+import io
+from multiprocessing import Pool
+import os
+import queue
+import sys
+import threading
+import time
+
+'''
+    A streaming pipeline connects a source of items to a chain of stages and a sink
+    through bounded queues. Each stage has its own worker threads, and a full queue
+    blocks the stage feeding it (backpressure), so memory stays flat no matter how
+    large the corpus is, and every stage works on items as soon as they arrive
+    instead of waiting for the previous stage to finish the whole corpus. A stage
+    marked as CPU-bound runs its function in a pool of worker processes instead.
+'''
+
+_DONE = object()
+
+'''
+    This class is one pipeline stage. fn takes one item and returns a list of output
+    items (possibly empty) to pass on.
+'''
+class Stage:
+    def __init__(self, name, fn, workers=1, maxsize=100, processes=False):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.maxsize = maxsize
+        self.processes = processes
+
+class StreamingPipeline:
+    def __init__(self, stages):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=stage.maxsize) for stage in stages]
+        self.out_queue = queue.Queue(maxsize=stages[-1].maxsize if stages else 100)
+        self.progress = {stage.name:Progress('stream_' + stage.name, every_sec=60, stall_sec=900) for stage in stages}
+        self.errors = Counter()
+        self._source_error = None
+
+    def _feed(self, source):
+        first = self.queues[0] if self.stages else self.out_queue
+        try:
+            for item in source:
+                first.put(item)
+        except Exception as e:
+            self._source_error = e  # re-raised by run() once the items before it are done
+        finally:
+            first.put(_DONE)
+
+    def _run_stage(self, i):
+        stage = self.stages[i]
+        in_queue = self.queues[i]
+        out_queue = self.queues[i+1] if i+1 < len(self.stages) else self.out_queue
+        pool = Pool(stage.workers) if stage.processes else None
+        remaining = [stage.workers]
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    in_queue.put(_DONE)  # let the other workers of this stage see it too
+                    break
+                try:
+                    outputs = pool.apply(stage.fn, (item,)) if pool is not None else stage.fn(item)
+                except Exception as e:
+                    with lock:
+                        self.errors[stage.name] += 1
+                    emit('stream_error', stage=stage.name, error=repr(e))
+                    continue
+                for output in outputs:
+                    out_queue.put(output)
+                self.progress[stage.name].update(docs=1, outputs=len(outputs))
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:  # the last worker out passes the end on
+                    out_queue.put(_DONE)
+                    self.progress[stage.name].finish()
+                    if pool is not None:
+                        pool.close()
+
+        threads = [threading.Thread(target=work, daemon=True, name='{}-{}'.format(stage.name, w)) for w in range(stage.workers)]
+        for t in threads:
+            t.start()
+        return threads
+
+    def run(self, source, sink):
+        """
+        Streams the items from source through the stages and calls sink on each
+        final output, in this thread. Returns once every item has been processed; if
+        the source raised an error, it is raised here after the items before it.
+        """
+        threads = [threading.Thread(target=self._feed, args=(source,), daemon=True, name='source')]
+        threads[0].start()
+        for i in range(len(self.stages)):
+            threads += self._run_stage(i)
+        while True:
+            item = self.out_queue.get()
+            if item is _DONE:
+                break
+            sink(item)
+        for t in threads:
+            t.join()
+        if len(self.errors) > 0:
+            print('Stream errors per stage:', dict(self.errors))
+        if self._source_error is not None:
+            raise self._source_error
+
+'''
+    This class is a pipeline sink that aggregates <lemma>,<pos> counts per gender as
+    processed texts arrive. Every snapshot_every texts, it calls on_snapshot with the
+    current counts (e.g. to publish them or to rescore the lexicon), and if
+    snapshot_path is given, it saves them there (see artifacts.save_processed), so
+    counts update continuously.
+'''
+class CountAggregator:
+    def __init__(self, snapshot_every=1000, snapshot_path=None, on_snapshot=None):
+        self.fcounts = Counter()
+        self.mcounts = Counter()
+        self.num_texts = Counter()
+        self.snapshot_every = snapshot_every
+        self.snapshot_path = snapshot_path
+        self.on_snapshot = on_snapshot
+
+    def __call__(self, item):
+        gender, text_id, toks = item
+        counts = self.fcounts if gender == 'f' else self.mcounts
+        for word, lemma, pos in toks:
+            counts[(lemma, pos)] += 1
+        self.num_texts[gender] += 1
+        if sum(self.num_texts.values()) % self.snapshot_every == 0:
+            self.snapshot()
+
+    def snapshot(self):
+        if self.snapshot_path is not None:
+            save_processed(self.snapshot_path, (self.fcounts, self.mcounts), 'counts')  # never seen partially written
+        emit('counts_snapshot', f_texts=self.num_texts['f'], m_texts=self.num_texts['m'],
+             f_vocab=len(self.fcounts), m_vocab=len(self.mcounts))
+        if self.on_snapshot is not None:
+            self.on_snapshot(self.fcounts, self.mcounts)
+
+# ========== STAGE FUNCTIONS ==========
+def tag_text(item):
+    """
+    Runs one <gender, text_id, text> item through the NLP stage. Imported lazily
+    so that the spaCy model is only loaded by the processes that tag.
+    """
+    from preprocessing import texts_to_pos_toks
+    gender, text_id, text = item
+    toks_per_text, _, _ = texts_to_pos_toks([text_id], [text])
+    return [(gender, text_id, toks_per_text[0])]
+
+def parse_celeb_item(item):
+    """
+    Parses one <filename or ID, lines or contents> celeb document into a gendered
+    text; unlabeled articles are dropped.
+    """
+    record_id, content = item
+    lines = io.StringIO(content).readlines() if isinstance(content, str) else content
+    parsed = parse_celeb_lines(lines)
+    if parsed['label'] == 1:
+        return [('f', record_id, parsed['text'])]
+    if parsed['label'] == 0:
+        return [('m', record_id, parsed['text'])]
+    return []
+
+def parse_prof_item(item):
+    """
+    Parses one <filename or ID, lines or contents> professor document into one
+    gendered text per review, with review IDs <teacher_id>#<review_num>.
+    """
+    record_id, content = item
+    lines = io.StringIO(content).readlines() if isinstance(content, str) else content
+    parsed = parse_prof_lines(lines)
+    gender = {'F':'f', 'M':'m'}.get(parsed['gender'])
+    if gender is None:
+        return []
+    teacher_id = record_id[:-len('.txt')] if record_id.endswith('.txt') else record_id
+    return [(gender, '{}#{}'.format(teacher_id, i), text) for i, (rating, tags, text) in enumerate(parsed['reviews'])]
+
+def follow_corpus(txt_dir, poll_sec=None, stop_event=None):
+    """
+    Yields <filename, lines> for the documents in a corpus folder and its packed
+    corpus, like iter_corpus_files. If poll_sec is given, keeps polling for documents
+    that a crawler adds afterwards, until stop_event is set. A poll only reads what
+    is new: the packed records indexed since the last poll, and the .txt files that
+    were not in the folder's last listing (which is only relisted when the folder's
+    modification time changes).
+    """
+    pack_path = pack_path_for(txt_dir)
+    index_pos = 0
+    listed = None  # the .txt files of the folder's last listing
+    dir_mtime = None
+    while True:
+        if pack_exists(pack_path):
+            records, index_pos = read_new_records(pack_path, index_pos)
+            for record_id, content in records:
+                if listed is None or record_id + '.txt' not in listed:  # not already read as a loose file
+                    yield record_id + '.txt', io.StringIO(content).readlines()
+        if os.path.isdir(txt_dir) and os.stat(txt_dir).st_mtime_ns != dir_mtime:
+            dir_mtime = os.stat(txt_dir).st_mtime_ns
+            fns = set(fn for fn in os.listdir(txt_dir) if fn.endswith('.txt'))
+            if listed is None:  # skip the files that were packed before we started
+                packed = CorpusReader(pack_path) if pack_exists(pack_path) else set()
+                listed = set(fn for fn in fns if fn[:-len('.txt')] in packed)
+            for fn in sorted(fns - listed):
+                with open(txt_dir + fn, 'r') as f:
+                    yield fn, f.readlines()
+            listed = fns
+        if poll_sec is None or (stop_event is not None and stop_event.is_set()):
+            break
+        time.sleep(poll_sec)
+
+def make_celeb_crawl_stages(dataset, fetch_workers=8, extract_workers=4):
+    """
+    Returns the stages that turn article URLs into celeb documents: fetching the
+    page through the crawlers' shared fetcher (so that a URL that cannot be fetched
+    raises, and is counted as an error of the fetch stage instead of being extracted),
+    then extracting and labeling the article as CelebBuilder does.
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_datasets'))
+    from bs4 import BeautifulSoup
+    from celeb_builder import CelebBuilder
+    builder = CelebBuilder(dataset=dataset)
+
+    def fetch(url):
+        return [(url, builder.fetcher.fetch(url, latency_name='http_' + dataset).content)]
+
+    def extract(item):
+        url, html = item
+        soup = BeautifulSoup(html, 'html.parser')
+        if not builder.want_to_parse(soup):
+            return []
+        return [builder.format_article(url, soup)]
+
+    return [Stage('fetch', fetch, workers=fetch_workers), Stage('extract', extract, workers=extract_workers)]
+
+def stream_counts(source, parse_fn, nlp_workers=1, nlp_processes=False, prefix_stages=None, aggregator=None, maxsize=100):
+    """
+    Streams documents from source through parsing and NLP into a CountAggregator,
+    and returns the aggregator with the final counts.
+    """
+    if aggregator is None:
+        aggregator = CountAggregator()
+    stages = list(prefix_stages or [])
+    stages.append(Stage('parse', parse_fn, workers=1, maxsize=maxsize))
+    stages.append(Stage('nlp', tag_text, workers=nlp_workers, maxsize=maxsize, processes=nlp_processes))
+    StreamingPipeline(stages).run(source, aggregator)
+    aggregator.snapshot()
+    return aggregator
+
+def stream_celeb_crawl(dataset, urls, nlp_workers=2, snapshot_path=None):
+    """
+    Crawls, extracts, parses, tags, and counts celeb articles in one streaming pass.
+    """
+    aggregator = CountAggregator(snapshot_path=snapshot_path)
+    return stream_counts(iter(urls), parse_celeb_item, nlp_workers=nlp_workers, nlp_processes=nlp_workers > 1,
+                         prefix_stages=make_celeb_crawl_stages(dataset), aggregator=aggregator)
+
+if __name__ == '__main__':
+    from data_loader import PROF_PATH
+    from preprocessing import PATH_TO_PROF_PROCESSED
+    agg = CountAggregator(snapshot_path=PATH_TO_PROF_PROCESSED + 'stream_counts.pkl')
+    stream_counts(follow_corpus(PROF_PATH), parse_prof_item, nlp_workers=4, nlp_processes=True, aggregator=agg)
@@ -0,0 +1,146 @@
+import csv
+import itertools
+import numpy as np
+from preprocessing import PATH_TO_PROF_PROCESSED
+from score_words import STOPWORDS, beta_scoring_from_arrays, get_tok_counts_from_balanced_prof_corpus, is_valid_lemma
+
+CORRECTIONS = {'none', 'bonferroni', 'holm', 'bh'}
+SWEEP_COLUMNS = ['min_count', 'alpha', 'pos_set', 'correction', 'num_tested', 'p_cutoff', 'num_sig', 'num_f_sig', 'num_m_sig']
+
+def counts_to_arrays(fcounts, mcounts):
+    """
+    Returns the vocabulary of two <lemma>,<pos> Counters and their counts as arrays
+    aligned with it.
+    """
+    vocab = sorted(set(fcounts) | set(mcounts))
+    f_arr = np.fromiter((fcounts.get(w, 0) for w in vocab), dtype=np.int64, count=len(vocab))
+    m_arr = np.fromiter((mcounts.get(w, 0) for w in vocab), dtype=np.int64, count=len(vocab))
+    return vocab, f_arr, m_arr
+
+def rejection_cutoff(sorted_ps, alpha, correction):
+    """
+    Returns the number of hypotheses rejected by a multiple-testing correction, given
+    the p-values of the whole family in ascending order. The rejected hypotheses are
+    always the ones with the smallest p-values.
+        - none: p <= alpha
+        - bonferroni: p <= alpha / m
+        - holm: the k smallest, where k is the first rank (from 1) at which
+          p_k > alpha / (m - k + 1), minus one
+        - bh (Benjamini-Hochberg FDR): the k smallest, where k is the largest rank at
+          which p_k <= k * alpha / m
+    """
+    assert(correction in CORRECTIONS)
+    m = len(sorted_ps)
+    if m == 0:
+        return 0
+    if correction == 'none':
+        return int(np.searchsorted(sorted_ps, alpha, side='right'))
+    if correction == 'bonferroni':
+        return int(np.searchsorted(sorted_ps, alpha / m, side='right'))
+    ranks = np.arange(1, m + 1)
+    if correction == 'holm':
+        fails = np.flatnonzero(sorted_ps > alpha / (m - ranks + 1))
+        return int(fails[0]) if len(fails) > 0 else m
+    passes = np.flatnonzero(sorted_ps <= ranks * alpha / m)
+    return int(passes[-1]) + 1 if len(passes) > 0 else 0
+
+'''
+    This class scores the full vocabulary once, and then evaluates settings of
+    min_count, alpha, POS set, and multiple-testing correction as array masks over
+    those scores. A word's p-value does not depend on min_count (which only decides
+    whether it is tested), so the p-values are computed a single time at the smallest
+    min_count of interest, and all words' p-values (female- and male-associated
+    together, as one family of tests, like the Bonferroni correction in score_words)
+    are sorted once. Each setting then costs a mask and a pass over the sorted
+    p-values, instead of a rerun of the whole script.
+'''
+class ScoreSweep:
+    def __init__(self, fcounts, mcounts, min_count=1, blacklist=STOPWORDS):
+        vocab, f_arr, m_arr = counts_to_arrays(fcounts, mcounts)
+        f_ass, m_ass = beta_scoring_from_arrays(vocab, f_arr, m_arr, min_count=min_count, sort=False)
+        self.min_count = min_count
+        ass = f_ass + m_ass
+        self.words = [a[0] for a in ass]
+        self.is_female = np.array([True] * len(f_ass) + [False] * len(m_ass), dtype=bool)
+        self.ps = np.array([a[1] for a in ass], dtype=np.float64)
+        self.counts = np.array([a[2] for a in ass], dtype=np.int64)
+        self.group_counts = np.array([a[3] for a in ass], dtype=np.int64)
+        self.pos = np.array([w[1] for w in self.words], dtype=object)
+        blacklist = set(blacklist)
+        self.valid_lemma = np.array([is_valid_lemma(w[0], blacklist) for w in self.words], dtype=bool)
+        self.order = np.argsort(self.ps, kind='stable')
+        self._pos_masks = {}
+
+    def pos_mask(self, pos_set):
+        """
+        Returns the mask of words with a valid lemma and a pos in pos_set (or any pos,
+        if pos_set is None).
+        """
+        key = None if pos_set is None else tuple(sorted(pos_set))
+        if key not in self._pos_masks:
+            mask = self.valid_lemma.copy()
+            if key is not None:
+                mask &= np.isin(self.pos, list(key))
+            self._pos_masks[key] = mask
+        return self._pos_masks[key]
+
+    def significant_mask(self, min_count=5, alpha=0.05, pos_set=('NOUN', 'VERB', 'ADJ'), correction='bonferroni'):
+        """
+        Returns the mask of significant words under one setting, and the number of
+        tested words and p-value cutoff.
+        """
+        assert(min_count >= self.min_count), 'Sweep was scored with min_count={}'.format(self.min_count)
+        tested = self.pos_mask(pos_set) & (self.counts >= min_count)
+        tested_in_order = self.order[tested[self.order]]
+        num_rejected = rejection_cutoff(self.ps[tested_in_order], alpha, correction)
+        sig = np.zeros(len(self.ps), dtype=bool)
+        sig[tested_in_order[:num_rejected]] = True
+        p_cutoff = float(self.ps[tested_in_order[num_rejected-1]]) if num_rejected > 0 else None
+        return sig, len(tested_in_order), p_cutoff
+
+    def significant(self, **setting):
+        """
+        Returns the significant female and male associations under one setting, ordered
+        by p, in the format of filter_associations_on_p.
+        """
+        sig, _, _ = self.significant_mask(**setting)
+        rows = [i for i in self.order if sig[i]]
+        ass = [(self.words[i], float(self.ps[i]), int(self.counts[i]), int(self.group_counts[i])) for i in rows]
+        return [a for i, a in zip(rows, ass) if self.is_female[i]], [a for i, a in zip(rows, ass) if not self.is_female[i]]
+
+    def run(self, min_counts=(5,), alphas=(0.05,), pos_sets=(('NOUN', 'VERB', 'ADJ'),), corrections=('bonferroni',)):
+        """
+        Evaluates every combination of the given settings, and returns one row (a
+        dictionary with the SWEEP_COLUMNS) per combination.
+        """
+        rows = []
+        for min_count, alpha, pos_set, correction in itertools.product(min_counts, alphas, pos_sets, corrections):
+            sig, num_tested, p_cutoff = self.significant_mask(min_count=min_count, alpha=alpha, pos_set=pos_set,
+                                                              correction=correction)
+            num_f_sig = int(np.count_nonzero(sig & self.is_female))
+            num_sig = int(np.count_nonzero(sig))
+            rows.append({'min_count':min_count, 'alpha':alpha,
+                         'pos_set':'ALL' if pos_set is None else '+'.join(pos_set), 'correction':correction,
+                         'num_tested':num_tested, 'p_cutoff':p_cutoff, 'num_sig':num_sig,
+                         'num_f_sig':num_f_sig, 'num_m_sig':num_sig - num_f_sig})
+        return rows
+
+def write_sweep_csv(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SWEEP_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def print_sweep(rows):
+    print('\t'.join(SWEEP_COLUMNS))
+    for row in rows:
+        print('\t'.join(str(row[col]) for col in SWEEP_COLUMNS))
+
+if __name__ == '__main__':
+    f_counts, m_counts = get_tok_counts_from_balanced_prof_corpus()
+    sweep = ScoreSweep(f_counts, m_counts, min_count=2)
+    rows = sweep.run(min_counts=[2, 5, 10, 20, 50], alphas=[0.05, 0.01],
+                     pos_sets=[('NOUN', 'VERB', 'ADJ'), ('ADJ',), None],
+                     corrections=['bonferroni', 'holm', 'bh'])
+    print_sweep(rows)
+    write_sweep_csv(rows, PATH_TO_PROF_PROCESSED + 'sweep.csv')
@@ -0,0 +1,279 @@
+"""
+Tagging backends for preprocessing.texts_to_pos_toks. Each backend turns a list of
+sentences into lists of <original_form, lemma, pos> tokens, without punctuation, with
+spaCy's universal POS tags, so that its output can be scored like the reference:
+
+    spacy           en_core_web_sm with its full pipeline (the reference)
+    spacy_stripped  en_core_web_sm without the parser and NER, which the tokens do
+                    not use (same tags and lemmas, much faster)
+    lookup          NLTK's perceptron tagger on spaCy's tokenization, mapped to
+                    universal tags, with a memoized <form, pos> -> lemma table over
+                    WordNet (fastest, slightly different tags and lemmas)
+
+The comparison reports each backend's tokens/sec and its agreement with the
+reference on a sample of reviews or articles:
+
+    python taggers.py --corpus prof --sample 2000 --out tagger_report.json
+"""
+import argparse
+from difflib import SequenceMatcher
+import json
+from nltk import sent_tokenize
+import random
+import time
+
+SPACY_MODEL = 'en_core_web_sm'
+STRIPPED_EXCLUDE = ['parser', 'senter', 'ner']  # components the tokens do not use
+CONTENT_POS = {'NOUN', 'VERB', 'ADJ'}  # the POS that lexicons are built from
+# Penn Treebank tags to universal POS tags, following spaCy's English tag map
+PTB_TO_POS = {'$':'SYM', '#':'SYM', "''":'PUNCT', '``':'PUNCT', ',':'PUNCT', '.':'PUNCT', ':':'PUNCT',
+              '(':'PUNCT', ')':'PUNCT', '-LRB-':'PUNCT', '-RRB-':'PUNCT', 'HYPH':'PUNCT', 'NFP':'PUNCT',
+              'AFX':'ADJ', 'CC':'CCONJ', 'CD':'NUM', 'DT':'DET', 'EX':'PRON', 'FW':'X', 'IN':'ADP', 'JJ':'ADJ',
+              'JJR':'ADJ', 'JJS':'ADJ', 'LS':'X', 'MD':'AUX', 'NN':'NOUN', 'NNS':'NOUN', 'NNP':'PROPN',
+              'NNPS':'PROPN', 'PDT':'DET', 'POS':'PART', 'PRP':'PRON', 'PRP$':'PRON', 'RB':'ADV', 'RBR':'ADV',
+              'RBS':'ADV', 'RP':'ADP', 'SYM':'SYM', 'TO':'PART', 'UH':'INTJ', 'VB':'VERB', 'VBD':'VERB',
+              'VBG':'VERB', 'VBN':'VERB', 'VBP':'VERB', 'VBZ':'VERB', 'WDT':'PRON', 'WP':'PRON', 'WP$':'PRON',
+              'WRB':'ADV'}
+POS_TO_WORDNET = {'NOUN':'n', 'VERB':'v', 'AUX':'v', 'ADJ':'a', 'ADV':'r'}
+BE_FORMS = {'be', 'am', 'is', 'are', 'was', 'were', 'been', 'being', "'m", "'re", "'s"}
+AUX_VERBS = {'have', 'has', 'had', 'having', "'ve", "'d", 'do', 'does', 'did'}  # auxiliaries when a verb follows
+
+def spacy_model_id(nlp):
+    """
+    Returns the name and version of a loaded spaCy pipeline, e.g.
+    'en_core_web_sm-3.7.1', so that outputs cached under it are not reused after the
+    model changes.
+    """
+    return '{}_{}-{}'.format(nlp.meta.get('lang', ''), nlp.meta['name'], nlp.meta['version'])
+SPECIAL_LEMMAS = {"n't":'not', "'m":'be', "'re":'be', "'ve":'have', "'ll":'will', "'d":'would', 'ca':'can',
+                  'wo':'will', 'i':'I'}
+
+'''
+    This class tags sentences with a spaCy pipeline, loaded on first use. exclude
+    lists the components not to load at all (not just to disable), so a stripped
+    pipeline also saves their load time and memory. Sentences are tagged in batches
+    with nlp.pipe.
+'''
+class SpacyTagger:
+    def __init__(self, name='spacy', model=SPACY_MODEL, exclude=(), batch_size=256):
+        self.name = name
+        self.model = model
+        self.exclude = list(exclude)
+        self.batch_size = batch_size
+        self._nlp = None
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            import spacy
+            self._nlp = spacy.load(self.model, exclude=self.exclude)
+        return self._nlp
+
+    def model_id(self):
+        return spacy_model_id(self.nlp)
+
+    def tag_sents(self, sents):
+        """
+        Returns the <original_form, lemma, pos> tokens of each sentence, without
+        punctuation.
+        """
+        return [[(tok.text, tok.lemma_, tok.pos_) for tok in doc if tok.pos_ != 'PUNCT']
+                for doc in self.nlp.pipe(sents, batch_size=self.batch_size)]
+
+'''
+    This class tags sentences without a neural pipeline: spaCy's rule-based tokenizer
+    (so that tokens line up with the reference), NLTK's averaged perceptron tagger,
+    Penn Treebank tags mapped to universal POS tags (with forms of "be", modals, and
+    "have"/"do" before a verb as AUX, like spaCy), and lemmas from WordNet's morphy.
+    Lemmas are memoized in a <form, pos> -> lemma table, since a corpus repeats a
+    small vocabulary; memo_hits and memo_misses count its lookups.
+'''
+class LookupTagger:
+    def __init__(self, name='lookup'):
+        self.name = name
+        self.memo = {}
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self._tokenizer = None
+        self._tagger = None
+        self._lemmatizer = None
+
+    def _load(self):
+        if self._tokenizer is None:
+            import spacy
+            from nltk.stem import WordNetLemmatizer
+            from nltk.tag import PerceptronTagger
+            self._tokenizer = spacy.blank('en').tokenizer
+            self._tagger = PerceptronTagger()
+            self._lemmatizer = WordNetLemmatizer()
+
+    def model_id(self):
+        import nltk
+        import spacy
+        return 'nltk-{}_spacy-{}'.format(nltk.__version__, spacy.__version__)
+
+    def to_pos(self, forms, ptb_tags):
+        """
+        Maps the Penn Treebank tags of a sentence to universal POS tags.
+        """
+        pos_tags = []
+        for i, (form, tag) in enumerate(zip(forms, ptb_tags)):
+            pos = PTB_TO_POS.get(tag, 'X')
+            lower = form.lower()
+            if pos == 'VERB':
+                next_tag = ptb_tags[i+1] if i + 1 < len(ptb_tags) else None
+                if lower in BE_FORMS or (lower in AUX_VERBS and next_tag is not None and next_tag.startswith('VB')):
+                    pos = 'AUX'
+            pos_tags.append(pos)
+        return pos_tags
+
+    def lemmatize(self, form, pos):
+        key = (form, pos)
+        lemma = self.memo.get(key)
+        if lemma is not None:
+            self.memo_hits += 1
+            return lemma
+        self.memo_misses += 1
+        lower = form.lower()
+        if lower in SPECIAL_LEMMAS and pos not in {'NOUN', 'PROPN'}:
+            lemma = SPECIAL_LEMMAS[lower]
+        elif pos == 'PROPN':
+            lemma = form
+        elif lower in BE_FORMS and pos in {'AUX', 'VERB'}:
+            lemma = 'be'
+        elif pos in POS_TO_WORDNET:
+            lemma = self._lemmatizer.lemmatize(lower, POS_TO_WORDNET[pos])
+        else:
+            lemma = lower
+        self.memo[key] = lemma
+        return lemma
+
+    def tag_sents(self, sents):
+        """
+        Returns the <original_form, lemma, pos> tokens of each sentence, without
+        punctuation.
+        """
+        self._load()
+        sents_toks = []
+        for sent in sents:
+            forms = [tok.text for tok in self._tokenizer(sent) if not tok.is_space]
+            ptb_tags = [tag for form, tag in self._tagger.tag(forms)] if forms else []
+            sents_toks.append([(form, self.lemmatize(form, pos), pos)
+                               for form, pos in zip(forms, self.to_pos(forms, ptb_tags)) if pos != 'PUNCT'])
+        return sents_toks
+
+TAGGERS = {'spacy':lambda: SpacyTagger('spacy'),
+           'spacy_stripped':lambda: SpacyTagger('spacy_stripped', exclude=STRIPPED_EXCLUDE),
+           'lookup':lambda: LookupTagger('lookup')}
+
+def get_tagger(name):
+    """
+    Returns a new tagger, given its name in TAGGERS.
+    """
+    if name not in TAGGERS:
+        raise ValueError('Invalid tagger: {} (expected one of {})'.format(name, ', '.join(sorted(TAGGERS))))
+    return TAGGERS[name]()
+
+def tagger_agreement(reference_toks, toks):
+    """
+    Returns the numbers of reference tokens, of those that the other tagging has
+    too (tokens are aligned on their forms, in case the tokenizations differ), and
+    of those whose POS, lemma, and both match; and the same counts over reference
+    tokens with a content POS.
+    """
+    counts = {key:0 for key in ['toks', 'aligned', 'pos', 'lemma', 'both',
+                                'content_toks', 'content_pos', 'content_lemma', 'content_both']}
+    for ref_sent, sent in zip(reference_toks, toks):
+        counts['toks'] += len(ref_sent)
+        counts['content_toks'] += sum(1 for tok in ref_sent if tok[2] in CONTENT_POS)
+        matcher = SequenceMatcher(None, [tok[0] for tok in ref_sent], [tok[0] for tok in sent], autojunk=False)
+        for a, b, size in matcher.get_matching_blocks():
+            for ref_tok, tok in zip(ref_sent[a:a+size], sent[b:b+size]):
+                pos_match = ref_tok[2] == tok[2]
+                lemma_match = ref_tok[1] == tok[1]
+                counts['aligned'] += 1
+                counts['pos'] += pos_match
+                counts['lemma'] += lemma_match
+                counts['both'] += pos_match and lemma_match
+                if ref_tok[2] in CONTENT_POS:
+                    counts['content_pos'] += pos_match
+                    counts['content_lemma'] += lemma_match
+                    counts['content_both'] += pos_match and lemma_match
+    return counts
+
+def compare_taggers(texts, tagger_names, reference='spacy'):
+    """
+    Tags the sentences of the texts with every tagger, and returns one row per tagger
+    with its load time, tagging time, tokens/sec, and its agreement with the reference
+    tagger (the fraction of reference tokens whose POS, lemma, and both match, overall
+    and over content words).
+    """
+    sents = [sent for text in texts for sent in sent_tokenize(text)]
+    print('Comparing taggers on {} texts, {} sentences'.format(len(texts), len(sents)))
+    names = [reference] + [name for name in tagger_names if name != reference]
+    outputs = {}
+    rows = []
+    for name in names:
+        tagger = get_tagger(name)
+        start = time.perf_counter()
+        tagger.tag_sents(sents[:1])  # loads the models
+        load_sec = time.perf_counter() - start
+        start = time.perf_counter()
+        outputs[name] = tagger.tag_sents(sents)
+        sec = time.perf_counter() - start
+        num_toks = sum(len(toks) for toks in outputs[name])
+        row = {'tagger':name, 'load_sec':round(load_sec, 3), 'sec':round(sec, 3), 'toks':num_toks,
+               'toks_per_sec':round(num_toks / sec, 1) if sec > 0 else None}
+        counts = tagger_agreement(outputs[reference], outputs[name])
+        for key in ['pos', 'lemma', 'both']:
+            row[key + '_agreement'] = round(counts[key] / max(counts['toks'], 1), 4)
+            row['content_{}_agreement'.format(key)] = round(counts['content_' + key] / max(counts['content_toks'], 1), 4)
+        row['aligned'] = round(counts['aligned'] / max(counts['toks'], 1), 4)
+        if isinstance(tagger, LookupTagger):
+            row['memo_size'] = len(tagger.memo)
+            row['memo_hit_rate'] = round(tagger.memo_hits / max(tagger.memo_hits + tagger.memo_misses, 1), 4)
+        rows.append(row)
+    return rows
+
+def print_comparison(rows):
+    reference_speed = rows[0]['toks_per_sec'] or 0
+    for row in rows:
+        speedup = row['toks_per_sec'] / reference_speed if reference_speed and row['toks_per_sec'] else None
+        print('{:<15} {:>10} toks/sec ({}x)  pos {:.2%}  lemma {:.2%}  both {:.2%}  content both {:.2%}'.format(
+            row['tagger'], row['toks_per_sec'], None if speedup is None else round(speedup, 2), row['pos_agreement'],
+            row['lemma_agreement'], row['both_agreement'], row['content_both_agreement']))
+
+def sample_texts(corpus, sample, seed=0):
+    """
+    Returns a random sample of sample review (prof) or article (celeb) texts.
+    """
+    if corpus == 'prof':
+        from data_loader import ProfDataLoader, PROF_PATH
+        dl = ProfDataLoader(PROF_PATH)
+        texts = dl.get_female_reviews() + dl.get_male_reviews()
+    else:
+        from data_loader import CelebDataLoader, CELEB_PATH
+        dl = CelebDataLoader(CELEB_PATH)  # loads all three sites
+        texts = [e['text'] for e in dl.get_female_entries() + dl.get_male_entries()]
+    random.Random(seed).shuffle(texts)
+    return texts[:sample]
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the throughput and accuracy of the tagging backends.')
+    parser.add_argument('--corpus', choices=['celeb', 'prof'], default='prof')
+    parser.add_argument('--sample', type=int, default=2000, help='number of texts to tag')
+    parser.add_argument('--taggers', nargs='+', default=sorted(TAGGERS), help='subset of: ' + ' '.join(sorted(TAGGERS)))
+    parser.add_argument('--reference', default='spacy', help='the tagger to measure agreement against')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='JSON file to save the report to')
+    args = parser.parse_args()
+
+    rows = compare_taggers(sample_texts(args.corpus, args.sample, seed=args.seed), args.taggers,
+                           reference=args.reference)
+    print_comparison(rows)
+    if args.out is not None:
+        json.dump({'config':vars(args), 'taggers':rows}, open(args.out, 'w'), indent=2)
+        print('Saved report to', args.out)
+
+if __name__ == '__main__':
+    main()
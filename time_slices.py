@@ -0,0 +1,198 @@
+from artifacts import load_processed
+from collections import Counter
+import numpy as np
+from preprocessing import PATH_TO_CELEB_PROCESSED
+from score_words import beta_scoring_from_arrays, top_k_associations_per_pos
+
+PATH_TO_TIME_SLICES = PATH_TO_CELEB_PROCESSED + 'time_slices.npz'
+PERIODS = {'month', 'quarter', 'year'}
+KEY_SEP = '\t'
+
+def date_of_article_id(article_id):
+    """
+    Returns the <year>,<month> of a processed article ID, or None if it has no
+    parsable date. Processed article IDs are of the form
+    <site>_<year>-<month>-<date>_<time>_<last_name> (see CelebBuilder._make_id).
+    """
+    try:
+        year, month = article_id.split('_')[1].split('-')[:2]
+        return int(year), int(month)
+    except (IndexError, ValueError):
+        return None
+
+def period_of_date(year, month, period='month'):
+    """
+    Returns the label of the period that a month falls in, e.g. '2018-12', '2018-Q4',
+    or '2018'. Labels sort chronologically.
+    """
+    assert(period in PERIODS)
+    if period == 'month':
+        return '{}-{:02d}'.format(year, month)
+    if period == 'quarter':
+        return '{}-Q{}'.format(year, (month - 1) // 3 + 1)
+    return str(year)
+
+'''
+    This class holds the <lemma>,<pos> counts of each gender per time slice as
+    cumulative prefix sums over the slices: row i of f_cum is the total count of each
+    word in the first i slices (so row 0 is all zeros). The counts of any window of
+    consecutive slices are then one subtraction of two rows, and its associations come
+    from one vectorized scoring pass, without recounting the articles. Words that occur
+    fewer than min_count times in total are dropped, since they cannot reach min_count
+    in any window; the token totals of every slice are kept, so that the groups' sizes
+    (and so the p-values) are the same as from a full recount.
+    Note that windows are not balanced like score_words balances the whole corpus;
+    the beta scoring compares each group's relative frequency, so the imbalance only
+    affects the power of the test, not its direction.
+'''
+class SlicedCounts:
+    def __init__(self, slices, vocab, f_cum, m_cum, num_texts, totals_cum=None):
+        self.slices = list(slices)
+        self.vocab = list(vocab)
+        self.f_cum = f_cum
+        self.m_cum = m_cum
+        self.num_texts = num_texts  # per slice: [num female texts, num male texts]
+        self.totals_cum = totals_cum  # row i: [female, male] tokens in the first i slices, pruned words included
+
+    def __len__(self):
+        return len(self.slices)
+
+    def slice_index(self, label, side='left'):
+        """
+        Returns the position of a period label among the slices; with side='right', the
+        position after it, so that window(start, end) includes both ends.
+        """
+        return int(np.searchsorted(self.slices, label, side=side))
+
+    def window_counts(self, start=None, end=None):
+        """
+        Returns the female and male count arrays (aligned with vocab) of the slices from
+        label start to label end, inclusive. Either end can be None for an open window.
+        """
+        i = 0 if start is None else self.slice_index(start)
+        j = len(self.slices) if end is None else self.slice_index(end, side='right')
+        j = max(i, j)
+        return self.f_cum[j] - self.f_cum[i], self.m_cum[j] - self.m_cum[i]
+
+    def window_totals(self, start=None, end=None):
+        """
+        Returns the <female, male> total number of tokens in the window, including
+        the words that were pruned from vocab, or None if they were not recorded.
+        """
+        if self.totals_cum is None:
+            return None
+        i = 0 if start is None else self.slice_index(start)
+        j = len(self.slices) if end is None else self.slice_index(end, side='right')
+        j = max(i, j)
+        return tuple(int(n) for n in self.totals_cum[j] - self.totals_cum[i])
+
+    def score_window(self, start=None, end=None, min_count=5, sort=False):
+        fcounts, mcounts = self.window_counts(start, end)
+        return beta_scoring_from_arrays(self.vocab, fcounts, mcounts, min_count=min_count, sort=sort,
+                                        totals=self.window_totals(start, end))
+
+    def rolling_windows(self, width, step=1):
+        """
+        Returns the <start, end> labels of the windows of width consecutive slices,
+        every step slices.
+        """
+        return [(self.slices[i], self.slices[i+width-1]) for i in range(0, len(self.slices) - width + 1, step)]
+
+    def save(self, path=PATH_TO_TIME_SLICES):
+        np.savez_compressed(path, slices=np.array(self.slices, dtype=str),
+                            vocab=np.array([KEY_SEP.join(w) for w in self.vocab], dtype=str),
+                            f_cum=self.f_cum, m_cum=self.m_cum, num_texts=self.num_texts,
+                            **({} if self.totals_cum is None else {'totals_cum':self.totals_cum}))
+
+    @staticmethod
+    def load(path=PATH_TO_TIME_SLICES):
+        data = np.load(path, allow_pickle=False)
+        vocab = [tuple(w.split(KEY_SEP, 1)) for w in data['vocab'].tolist()]
+        totals_cum = data['totals_cum'] if 'totals_cum' in data.files else None  # older files lack it
+        return SlicedCounts(data['slices'].tolist(), vocab, data['f_cum'], data['m_cum'], data['num_texts'],
+                            totals_cum=totals_cum)
+
+def build_sliced_counts(f_toks_per_text_w_id, m_toks_per_text_w_id, period='month', min_count=5):
+    """
+    Builds SlicedCounts from lists of <article_id, toks> tuples, slicing by the
+    article's date. Articles whose ID has no parsable date are skipped.
+    """
+    texts = []  # <gender column, period label, toks>
+    num_undated = 0
+    for g, toks_per_text_w_id in enumerate([f_toks_per_text_w_id, m_toks_per_text_w_id]):
+        for text_id, toks in toks_per_text_w_id:
+            date = date_of_article_id(text_id)
+            if date is None:
+                num_undated += 1
+                continue
+            texts.append((g, period_of_date(date[0], date[1], period), toks))
+    if num_undated > 0:
+        print('Skipped {} articles without a date'.format(num_undated))
+    slices = sorted(set(label for _, label, _ in texts))
+    slice_to_row = {label:i for i, label in enumerate(slices)}
+
+    totals = Counter()
+    for _, _, toks in texts:
+        totals.update((lemma, pos) for word, lemma, pos in toks)
+    vocab = sorted(w for w, c in totals.items() if c >= min_count)
+    word_to_col = {w:i for i, w in enumerate(vocab)}
+
+    V = len(vocab)
+    cells = [[], []]  # flat <slice row, word col> cell indices per gender
+    num_texts = np.zeros((len(slices), 2), dtype=np.int64)
+    num_toks = np.zeros((len(slices), 2), dtype=np.int64)
+    for g, label, toks in texts:
+        row = slice_to_row[label]
+        num_texts[row, g] += 1
+        num_toks[row, g] += len(toks)
+        cols = [word_to_col.get((lemma, pos), -1) for word, lemma, pos in toks]
+        cells[g].extend(row * V + c for c in cols if c >= 0)
+    cums = []
+    for g in range(2):
+        table = np.bincount(np.array(cells[g], dtype=np.int64), minlength=len(slices) * V).reshape(len(slices), V)
+        cum = np.zeros((len(slices) + 1, V), dtype=np.int64)
+        np.cumsum(table, axis=0, out=cum[1:])
+        cums.append(cum)
+    totals_cum = np.zeros((len(slices) + 1, 2), dtype=np.int64)
+    np.cumsum(num_toks, axis=0, out=totals_cum[1:])
+    print('Built {} {} slices over {} words'.format(len(slices), period, V))
+    return SlicedCounts(slices, vocab, cums[0], cums[1], num_texts, totals_cum=totals_cum)
+
+def build_celeb_sliced_counts(period='month', min_count=5, path=PATH_TO_TIME_SLICES):
+    f_toks_per_article_w_id = load_processed(PATH_TO_CELEB_PROCESSED + 'f_toks_per_article.pkl')
+    m_toks_per_article_w_id = load_processed(PATH_TO_CELEB_PROCESSED + 'm_toks_per_article.pkl')
+    sliced = build_sliced_counts(f_toks_per_article_w_id, m_toks_per_article_w_id, period=period, min_count=min_count)
+    if path is not None:
+        sliced.save(path)
+    return sliced
+
+def trend_report(sliced, width, step=1, top_n=10, p_thresh=None, pos_set=('NOUN', 'VERB', 'ADJ'), min_count=5):
+    """
+    Scores every rolling window of width slices, and returns one row per window,
+    gender, pos, and rank: <start, end, gender, pos, rank, word, p, count, group_count>.
+    If p_thresh is given, only associations with p below it are ranked.
+    """
+    rows = []
+    for start, end in sliced.rolling_windows(width, step):
+        f_ass, m_ass = sliced.score_window(start, end, min_count=min_count)
+        for gender, ass in [('f', f_ass), ('m', m_ass)]:
+            if p_thresh is not None:
+                ass = [a for a in ass if a[1] < p_thresh]
+            top, _ = top_k_associations_per_pos(ass, top_n, pos_set=pos_set)
+            for pos in pos_set:
+                for rank, (word, p, count, group_count) in enumerate(top[pos]):
+                    rows.append((start, end, gender, pos, rank + 1, word[0], p, count, group_count))
+    return rows
+
+def print_trend_report(rows):
+    last = None
+    for start, end, gender, pos, rank, lemma, p, count, group_count in rows:
+        if (start, end, gender, pos) != last:
+            print('\n{} to {} | {} | {}'.format(start, end, 'Most Female' if gender == 'f' else 'Most Male', pos))
+            last = (start, end, gender, pos)
+        print('{}. {}, p={}'.format(rank, lemma, round(p, 4)))
+
+if __name__ == '__main__':
+    sliced = build_celeb_sliced_counts(period='month')
+    # sliced = SlicedCounts.load()
+    print_trend_report(trend_report(sliced, width=6, step=3, top_n=10))